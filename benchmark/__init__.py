@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+
+"""Benchmarks for CherryMusic's hot paths, run against deterministic
+synthetic media libraries.
+
+The libraries consist of empty files with realistic artist/album/track
+names, so they can be built in a temporary directory on any machine. The
+same size and seed always produce the same library, which makes results
+comparable across releases.
+
+Benchmarks print one JSON object per measurement to stdout.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import json
+import os
+import sys
+import time
+
+import cherrymusicserver as cherry
+from cherrymusicserver import configuration
+from cherrymusicserver import database
+from cherrymusicserver import log
+from cherrymusicserver import service
+from cherrymusicserver import util
+
+
+def setup_environment(datadir, basedir, **config):
+    '''configure CherryMusic to keep its databases in datadir and serve media
+    from basedir; further config values are given as key=value pairs,
+    using '_' instead of '.', e.g. ``search_engine='memory'``.'''
+    log.setTest()                   # keep the measurements free of logging
+    util.PERFORMANCE_TEST = False
+    settings = {'media.basedir': basedir}
+    settings.update((key.replace('_', '.', 1), value) for key, value in config.items())
+    cherry.config = configuration.from_defaults().replace(settings)
+    service.provide('dbconnector', database.sql.SQLiteConnector, kwargs={
+        'datadir': datadir,
+        'extension': 'db',
+        'connargs': {'check_same_thread': False},
+    })
+    database.ensure_current_version(autoconsent=True)
+
+
+def timed(func, *args, **kwargs):
+    '''calls func and returns a tuple (seconds taken, return value)'''
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def best_of(repeat, func, *args, **kwargs):
+    '''calls func repeatedly and returns a tuple (fastest time, last result)'''
+    times = []
+    for _ in range(repeat):
+        seconds, result = timed(func, *args, **kwargs)
+        times.append(seconds)
+    return min(times), result
+
+
+def report(benchmark, seconds, **info):
+    '''print one measurement as a JSON line'''
+    info.update({
+        'benchmark': benchmark,
+        'seconds': round(seconds, 6),
+        'version': cherry.VERSION,
+        'python': '%d.%d.%d' % sys.version_info[:3],
+    })
+    print(json.dumps(info, sort_keys=True))
+    sys.stdout.flush()
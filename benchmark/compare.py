@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+
+"""Compares two sets of benchmark results.
+
+Usage::
+
+    python -m benchmark.compare old.json new.json
+
+Matches measurements by benchmark name and parameters and prints the old and
+new times side by side, slowest ratio first.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import argparse
+import io
+import json
+
+# reported values that describe a result rather than identify a measurement
+OUTCOMES = ('seconds', 'version', 'python', 'results', 'entries')
+
+
+def load(filename):
+    '''returns a dict mapping measurement keys to seconds'''
+    results = {}
+    with io.open(filename, encoding='utf-8') as resultfile:
+        for line in resultfile:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            key = tuple(sorted((k, v) for k, v in result.items() if k not in OUTCOMES))
+            results[key] = result['seconds']
+    return results
+
+
+def describe(key):
+    info = dict(key)
+    name = info.pop('benchmark')
+    return name + ' ' + ' '.join('%s=%s' % item for item in sorted(info.items()))
+
+
+def compare(old, new):
+    '''returns a list of (description, old seconds, new seconds, ratio)'''
+    rows = []
+    for key in set(old) & set(new):
+        ratio = new[key] / old[key] if old[key] else float('inf')
+        rows.append((describe(key), old[key], new[key], ratio))
+    return sorted(rows, key=lambda row: row[3], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+    for description, old, new, ratio in compare(load(args.old), load(args.new)):
+        print('%8.2fx %10.6f %10.6f  %s' % (ratio, old, new, description))
+
+
+if __name__ == '__main__':
+    main()
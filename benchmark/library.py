@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+
+"""Deterministic synthetic media libraries.
+
+A library is a tree of ``artist/album/track`` files. Names are drawn from
+small vocabularies by a seeded random generator, so that words repeat the
+way they do in real collections: a few are very common, most are rare.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import os
+import random
+
+SIZES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+
+COMMON_WORDS = '''the a of and in my you love me night to is for on your all
+    blue time heart day life world man no one way dream home light'''.split()
+
+WORDS = '''abbey absolute acid after against alchemy alive alone amber angel
+    animal answer apple april arrow ashes atlas autumn avenue baby back
+    ballad band battle beach beast beat bells berlin between bird bitter
+    black blood bloom boat bones border boy brave bread bridge bright broken
+    brother burning butterfly cactus california calling candle canyon
+    captain carnival castle cathedral chain champagne chaos child chrome
+    circle city clockwork cloud coast cobalt cold colour comet concrete
+    copper coral cosmic country crazy crimson crystal cuba dance danger
+    dark dawn daylight december delta desert diamond disco distance doctor
+    dollar door double dragon drift drum dust eagle earth echo eclipse
+    eden electric elephant ember empire empty end engine escape eternal
+    evening exile eye factory falcon fall fantasy fast feather fever field
+    fire flame flower fool forest forever fortune fountain fox freedom
+    frost funk garden ghost giant glass glory gold golden gospel grace
+    gravity green guitar gypsy harbor harvest haze heaven highway hollow
+    honey horizon horse hotel hunter hurricane ice idol island ivory jade
+    jazz jungle justice kaleidoscope king kingdom kiss lady lake lantern
+    last lazy legend lemon liberty lightning lion liquid little lonely
+    lost lotus lucky lullaby machine madness magic magnolia marble mars
+    melody memory mercury midnight milk mirror mission monday monkey moon
+    morning mountain mystery neon never nightingale noise north nova ocean
+    october orange orchid paradise paris parade passenger peach pearl
+    people phantom piano pilot pink planet poison polar prayer pretty
+    prince prophet purple queen radio rain rainbow raven rebel red
+    revolution rhythm river road rock rocket roll rose ruby runaway sailor
+    saint salt sand satellite saturday savage scarlet sea secret serpent
+    shadow shelter shine silence silver sister sky slow smoke snake snow
+    soldier solar song soul south space spark spirit spring star steel
+    stone storm strange street sugar summer sun sunday sunset swan sweet
+    tango temple thunder tiger tokyo tomorrow tower train treasure tree
+    tribe tropical twilight valley velvet venus violet voodoo voyage
+    wall wanderer war water wave white wild wind winter wolf wonder yellow
+    young zero zodiac'''.split()
+
+TRACK_FORMATS = ['.mp3'] * 6 + ['.ogg', '.flac', '.m4a']
+EXTRA_FILES = ['cover.jpg', 'folder.jpg', 'info.txt']
+
+
+def _title(rng, minwords, maxwords):
+    words = []
+    for _ in range(rng.randint(minwords, maxwords)):
+        vocabulary = COMMON_WORDS if rng.random() < 0.3 else WORDS
+        words.append(rng.choice(vocabulary))
+    return ' '.join(words).title()
+
+
+def paths(size, seed=0):
+    '''yields ``size`` relative file paths (directories are implied), always
+    the same ones for the same size and seed'''
+    rng = random.Random(seed)
+    count = 0
+    artistno = 0
+    while count < size:
+        artistno += 1
+        artist = '%s %d' % (_title(rng, 1, 3), artistno)
+        for albumno in range(1, rng.randint(1, 8) + 1):
+            year = rng.randint(1955, 2014)
+            album = '%d - %s' % (year, _title(rng, 1, 4))
+            if albumno > 1 and rng.random() < 0.1:
+                album += ' (Live)'
+            files = ['%02d - %s%s' % (trackno, _title(rng, 1, 5), rng.choice(TRACK_FORMATS))
+                     for trackno in range(1, rng.randint(6, 16) + 1)]
+            if rng.random() < 0.5:
+                files.append(rng.choice(EXTRA_FILES))
+            for filename in files:
+                if count == size:
+                    return
+                yield os.path.join(artist, album, filename)
+                count += 1
+
+
+def create(basedir, size, seed=0):
+    '''create a library of ``size`` empty files below basedir. Does nothing
+    if it was already created with the same parameters.'''
+    marker = '%s.synthetic-%d-%d' % (basedir.rstrip(os.path.sep), size, seed)
+    if os.path.exists(marker):
+        return
+    for path in paths(size, seed):
+        fullpath = os.path.join(basedir, path)
+        dirpath = os.path.dirname(fullpath)
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        open(fullpath, 'w').close()
+    open(marker, 'w').close()
+
+
+def queries(seed=0, count=20):
+    '''returns a fixed list of search strings of various kinds: common and
+    rare words, prefixes, several terms and the !f/!d modes'''
+    rng = random.Random(seed)
+    result = []
+    while len(result) < count:
+        kind = len(result) % 5
+        if kind == 0:
+            result.append(rng.choice(COMMON_WORDS))
+        elif kind == 1:
+            result.append(rng.choice(WORDS))
+        elif kind == 2:
+            result.append(rng.choice(WORDS)[:3])
+        elif kind == 3:
+            result.append(' '.join(rng.choice(WORDS) for _ in range(3)))
+        else:
+            result.append(rng.choice(['!f ', '!d ']) + rng.choice(WORDS))
+    return result
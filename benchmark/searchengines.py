@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+
+"""Compares the search engines of the file cache on a synthetic library.
+
+Usage::
+
+    python -m benchmark.searchengines [--size 1m] [--workdir DIR]
+
+For each available value of the ``search.engine`` option, measures how long
+the file cache takes to start up and to answer a fixed set of queries with
+``SQLiteCache.searchfor``.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import argparse
+import os
+import shutil
+import tempfile
+
+from benchmark import best_of, library, report, setup_environment, timed
+
+ENGINES = ('database', 'memory', 'fts5')
+
+
+def run(workdir, size, repeat=3, seed=0):
+    basedir = os.path.join(workdir, 'library')
+    datadir = os.path.join(workdir, 'data-%d-%d' % (size, seed))
+    seconds, _ = timed(library.create, basedir, size, seed)
+    report('create_library', seconds, size=size)
+    for dirpath in (basedir, datadir):
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+
+    from cherrymusicserver import sqlitecache
+    setup_environment(datadir, basedir)
+    cache = sqlitecache.SQLiteCache()
+    if cache.file_db_is_empty():
+        seconds, _ = timed(cache.full_update)
+        report('bulk_build', seconds, size=size)
+    cache.conn.close()
+
+    for engine in ENGINES:
+        setup_environment(datadir, basedir, search_engine=engine)
+        seconds, cache = timed(sqlitecache.SQLiteCache)
+        if engine == 'fts5' and not cache.fts:
+            report('startup', 0, size=size, engine=engine, skipped='FTS5 not available')
+            continue
+        report('startup', seconds, size=size, engine=engine)
+        for query in library.queries(seed):
+            seconds, results = best_of(repeat, cache.searchfor, query, 20)
+            report('searchfor', seconds, size=size, engine=engine,
+                   query=query, results=len(results))
+        cache.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', default='100k', choices=sorted(library.SIZES),
+                        help='number of files in the synthetic library')
+    parser.add_argument('--workdir', help='keep the library and databases here'
+                        ' for later runs instead of in a temporary directory')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='run each query this many times, report the fastest')
+    args = parser.parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cherrymusic-benchmark-')
+    try:
+        run(workdir, library.SIZES[args.size], args.repeat)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+
+"""Times the hot paths of CherryMusic on a synthetic library.
+
+Usage::
+
+    python -m benchmark.suite [--size 10k|100k|1m] [--workdir DIR] > results.json
+
+Measures scanning (``full_update``, ``partial_update``), searching
+(``SQLiteCache.searchfor``, ``CherryModel.search``), browsing (``listdir``)
+and random playlists (``randomFileEntries``). Each measurement is printed as
+one JSON object per line; compare two such files with
+``python -m benchmark.compare old.json new.json``.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import argparse
+import os
+import shutil
+import tempfile
+
+from benchmark import best_of, library, report, setup_environment, timed
+
+
+def scan(cache, basedir, size):
+    seconds, _ = timed(cache.full_update)
+    report('full_update', seconds, size=size, mode='initial')
+    seconds, _ = timed(cache.full_update)
+    report('full_update', seconds, size=size, mode='unchanged')
+    seconds, _ = timed(cache.full_update, deep=True)
+    report('full_update', seconds, size=size, mode='deep')
+
+    artist = sorted(os.listdir(basedir))[0]
+    album = os.path.join(basedir, artist, '9999 - Benchmark Album')
+    os.mkdir(album)
+    for trackno in range(1, 13):
+        open(os.path.join(album, '%02d - Benchmark Track.mp3' % trackno), 'w').close()
+    seconds, _ = timed(cache.partial_update, artist)
+    report('partial_update', seconds, size=size, mode='add album')
+    shutil.rmtree(album)
+    seconds, _ = timed(cache.partial_update, artist)
+    report('partial_update', seconds, size=size, mode='remove album')
+
+
+def search(cache, model, size, repeat):
+    for query in library.queries():
+        seconds, results = best_of(repeat, cache.searchfor, query, 20)
+        report('searchfor', seconds, size=size, query=query, results=len(results))
+
+        def uncached_search():
+            cache.bump_generation()
+            return model.search(query)
+        seconds, results = best_of(repeat, uncached_search)
+        report('CherryModel.search', seconds, size=size, query=query,
+               results=len(results), cached=False)
+        seconds, results = best_of(repeat, model.search, query)
+        report('CherryModel.search', seconds, size=size, query=query,
+               results=len(results), cached=True)
+
+
+def browse(cache, model, basedir, size, repeat):
+    artist = sorted(os.listdir(basedir))[len(os.listdir(basedir)) // 2]
+    album = os.path.join(artist, sorted(os.listdir(os.path.join(basedir, artist)))[0])
+    # listings may be read lazily: time reading all of them
+    for kind, path in (('root', ''), ('artist', artist), ('album', album)):
+        seconds, entries = best_of(repeat, lambda: list(cache.listdir(path)))
+        report('SQLiteCache.listdir', seconds, size=size, dir=kind, entries=len(entries))
+        seconds, entries = best_of(repeat, lambda: list(model.listdir(path)))
+        report('CherryModel.listdir', seconds, size=size, dir=kind, entries=len(entries))
+
+
+def random_entries(cache, size, repeat):
+    for count in (10, 100):
+        seconds, entries = best_of(repeat, cache.randomFileEntries, count)
+        report('randomFileEntries', seconds, size=size, count=count, entries=len(entries))
+
+
+def run(workdir, size, repeat=5, seed=0):
+    basedir = os.path.join(workdir, 'library')
+    datadir = tempfile.mkdtemp(prefix='data-', dir=workdir)
+    try:
+        seconds, _ = timed(library.create, basedir, size, seed)
+        report('create_library', seconds, size=size)
+
+        setup_environment(datadir, basedir)
+        from cherrymusicserver import cherrymodel, service, sqlitecache
+        import cherrypy
+        cherrypy.session = {}       # CherryModel.search expects a request context
+        cache = sqlitecache.SQLiteCache()
+        service.provide('filecache', cache)
+        model = cherrymodel.CherryModel()
+
+        scan(cache, basedir, size)
+        search(cache, model, size, repeat)
+        browse(cache, model, basedir, size, repeat)
+        random_entries(cache, size, repeat)
+        cache.conn.close()
+    finally:
+        shutil.rmtree(datadir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', default='10k', choices=sorted(library.SIZES),
+                        help='number of files in the synthetic library')
+    parser.add_argument('--workdir', help='keep the synthetic library here for'
+                        ' later runs, instead of in a temporary directory')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='repeat each measurement this many times, report the fastest')
+    args = parser.parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cherrymusic-benchmark-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    try:
+        run(workdir, library.SIZES[args.size], args.repeat)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
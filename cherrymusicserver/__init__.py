@@ -149,6 +149,7 @@ from cherrymusicserver import cherrymodel
 from cherrymusicserver import database
 from cherrymusicserver import httphandler
 from cherrymusicserver import log
+from cherrymusicserver import mediawatcher
 from cherrymusicserver import playlistdb
 from cherrymusicserver import service
 from cherrymusicserver import sqlitecache
@@ -161,7 +162,8 @@ import cherrymusicserver.browsersetup
 class CherryMusic:
     """Sets up services (configuration, database, etc) and starts the server"""
     def __init__(self, update=None, createNewConfig=False, dropfiledb=False,
-                 setup=False, cfg_override={}, adduser=None):
+                 setup=False, cfg_override={}, adduser=None, deepupdate=False,
+                 repairfiledb=False):
         self.setup_services()
         self.setup_config(createNewConfig, setup, cfg_override)
         signal.signal(signal.SIGTERM, CherryMusic.stopAndCleanUp)
@@ -174,7 +176,10 @@ class CherryMusic:
             else:
                 sys.exit(1)
         CherryMusic.create_pid_file()
-        self.setup_databases(update, dropfiledb, setup)
+        self.setup_databases(update, dropfiledb, setup, deepupdate)
+        if repairfiledb:
+            sqlitecache.SQLiteCache().update_word_occurrences()
+            CherryMusic.stopAndCleanUp()
         self.start_server(httphandler.HTTPHandler(config))
         CherryMusic.delete_pid_file()
 
@@ -256,7 +261,7 @@ I've you are sure that cherrymusic is not running, you can delete this file and
                 self.printWelcomeAndExit()
         self._init_config(cfg_override)
 
-    def setup_databases(self, update, dropfiledb, setup):
+    def setup_databases(self, update, dropfiledb, setup, deepupdate=False):
         """ delete or update the file db if so requested.
         check if the db schema is up to date
         """
@@ -273,7 +278,7 @@ I've you are sure that cherrymusic is not running, you can delete this file and
         if update is not None:
             cacheupdate = threading.Thread(name="Updater",
                                            target=self._update_if_necessary,
-                                           args=(update,))
+                                           args=(update, deepupdate))
             cacheupdate.start()
             # self._update_if_necessary(update)
             if not setup:
@@ -305,16 +310,17 @@ Run schema update? [y/N]: """).format(
             dblocation='\t' + pathprovider.databaseFilePath(''))
         return input(msg).lower().strip() in ('y',)
 
-    def _update_if_necessary(self, update):
+    def _update_if_necessary(self, update, deep=False):
         """perform a database update if update (a list of paths to update is
         not None. If update is an empty list, perform a full update instead
-        of a partial update
+        of a partial update. A full update only rescans directories that
+        appear unchanged if deep is True.
         """
         cache = sqlitecache.SQLiteCache()
         if update:
             cache.partial_update(*update)
         elif update is not None:
-            cache.full_update()
+            cache.full_update(deep=deep)
 
     def _init_config(self, override_dict):
         """update the internal configuration using the following hierarchy:
@@ -397,6 +403,20 @@ Have fun!
 """))
         sys.exit(0)
 
+    def start_media_watcher(self):
+        """keep the media database up to date while the server is running"""
+        if not mediawatcher.is_available():
+            log.w(_('media.watch is enabled, but watching for changes is not '
+                    'supported on this system.'))
+            return
+        watcher = mediawatcher.MediaWatcher(config['media.basedir'])
+        try:
+            watcher.start()
+        except OSError as error:
+            log.e(_('cannot watch media.basedir for changes: %s'), error)
+            return
+        cherrypy.engine.subscribe('stop', watcher.stop)
+
     def start_server(self, httphandler):
         """use the configuration to setup and start the cherrypy server
         """
@@ -492,6 +512,8 @@ Have fun!
         log.i(_('Starting server on port %s ...') % config['server.port'])
 
         cherrypy.lib.caching.expires(0)  # disable expiry caching
+        if config['media.watch']:
+            self.start_media_watcher()
         cherrypy.engine.start()
         cherrypy.engine.block()
 
@@ -35,12 +35,14 @@ will delegate different calls between other classes.
 from __future__ import unicode_literals
 
 import os
+import sys
+import threading
 from random import choice
 import codecs
 import json
+from collections import namedtuple
 import cherrypy
 import audiotranscode
-from imp import reload
 
 try:
     from urllib.parse import quote
@@ -53,11 +55,17 @@ except ImportError:
 
 import cherrymusicserver as cherry
 from cherrymusicserver import service
+from cherrymusicserver import util
 from cherrymusicserver import pathprovider
-from cherrymusicserver.util import Performance
+from cherrymusicserver.util import Performance, LRUCache
 from cherrymusicserver import resultorder
 from cherrymusicserver import log
 
+DirEntry = namedtuple('DirEntry', 'name isdir playable sortkey')
+
+SEARCHCACHESIZE = 256                   # max. number of cached searches
+SEARCHCACHEMAXBYTES = 16 * 1024 * 1024  # max. estimated memory for cached results
+
 
 @service.user(cache='filecache')
 class CherryModel:
@@ -68,13 +76,19 @@ class CherryModel:
             self.transcoder = audiotranscode.AudioTranscode()
             CherryModel.supportedFormats += self.transcoder.availableDecoderFormats()
             CherryModel.supportedFormats = list(set(CherryModel.supportedFormats))
+        self.searchcache = SearchResultCache()
 
     def abspath(self, path):
         return os.path.join(cherry.config['media.basedir'], path)
 
+    @classmethod
+    def fileNameKey(cls, filepath):
+        # the name as compared for compact listings and their filters
+        return pathprovider.filename(filepath).upper()
+
     @classmethod
     def fileSortFunc(cls, filepath):
-        upper = pathprovider.filename(filepath).upper()
+        upper = cls.fileNameKey(filepath)
         if ' ' in upper:
             part_part = upper[:upper.index(' ')]
             # make sure that numbers are sorted correctly by evening out
@@ -83,69 +97,120 @@ class CherryModel:
                 return '0'*(5 - len(part_part)) + upper
         return upper
 
-    def sortFiles(self, files, fullpath=''):
+    def sortFiles(self, entries, dirsfirst=True):
         # sort alphabetically (case insensitive, make sure numbers are
-        # sorted correctly)
-        sortedfiles = sorted(files, key=CherryModel.fileSortFunc)
-        if fullpath:
-            #sort directories up
-            isfile = lambda x: os.path.isfile(os.path.join(fullpath, x))
-            sortedfiles = sorted(sortedfiles, key=isfile)
-        return sortedfiles
-
-    def listdir(self, dirpath, filterstr=''):
+        # sorted correctly), directories first if wanted
+        if dirsfirst:
+            key = lambda e: (not e.isdir, e.sortkey)
+        else:
+            key = lambda e: e.sortkey
+        return sorted(entries, key=key)
+
+    def fs_listdir(self, absdirpath):
+        '''list a directory in the filesystem as DirEntries'''
+        entries = []
+        for name in os.listdir(absdirpath):
+            isfile = os.path.isfile(os.path.join(absdirpath, name))
+            entries.append(DirEntry(name, not isfile, bool(isfile and isplayable(name)),
+                                    CherryModel.fileSortFunc(name)))
+        return entries
+
+    def listdir(self, dirpath, filterstr='', offset=0, limit=None):
+        '''lists a directory as MusicEntries, in display order.
+
+        filterstr narrows the listing down to names starting with it,
+        ignoring case, like the labels of compact listings do. Without it,
+        hidden names are left out. Directories with more entries than
+        ``browser.maxshowfiles`` get a compact listing, unless a window of
+        the full listing is requested with ``offset`` and ``limit``.
+
+        With ``browser.pure_database_lookup``, a full listing is returned as
+        an iterator that reads the entries from the database while it is
+        consumed. Otherwise, a list is returned.'''
         absdirpath = self.abspath(dirpath)
+        prefix = filterstr.upper() if filterstr else ''
+        maximum_shown_files = cherry.config['browser.maxshowfiles']
         if cherry.config['browser.pure_database_lookup']:
-            allfilesindir = self.cache.listdir(dirpath)
+            # no filesystem access at all, so sleeping disks stay asleep;
+            # comes in display order, and only the part that is shown
+            formats = CherryModel.supportedFormats
+            if (limit is None and
+                    self.cache.countdir(dirpath, prefix, hidden=bool(prefix)) > maximum_shown_files):
+                groups = self.cache.listdir_groups(dirpath, formats, prefix, hidden=bool(prefix))
+                return self.compactEntries(absdirpath, groups)
+            entries = self.cache.listdir(dirpath, formats, prefix=prefix, hidden=bool(prefix),
+                                         offset=offset, limit=limit, playableonly=True)
+            return self.musicEntries(absdirpath, entries)
         else:
-            allfilesindir = os.listdir(absdirpath)
-
-        #remove all files not inside the filter
-        if filterstr:
-            filterstr = filterstr.lower()
-            allfilesindir = [f for f in allfilesindir
-                             if f.lower().startswith(filterstr)]
-        else:
-            allfilesindir = [f for f in allfilesindir if not f.startswith('.')]
-
+            entries = self.sortFiles(self.fs_listdir(absdirpath))
+            if prefix:
+                entries = [e for e in entries
+                           if CherryModel.fileNameKey(e.name).startswith(prefix)]
+            else:
+                entries = [e for e in entries if not e.name.startswith('.')]
+            if limit is None and len(entries) > maximum_shown_files:
+                groups = self.groupFiles(entries)
+                return self.compactEntries(absdirpath, groups)
+            entries = [e for e in entries if e.isdir or e.playable]
+            if limit is not None:
+                entries = entries[offset:offset + limit]
+            else:
+                entries = entries[offset:]
+            return list(self.musicEntries(absdirpath, entries))
+
+    def listdirStamp(self, dirpath):
+        '''returns a value that changes whenever the listing of dirpath
+        might change, or None if there is no such directory'''
+        if cherry.config['browser.pure_database_lookup']:
+            return self.cache.generation
+        try:
+            return os.stat(self.abspath(dirpath)).st_mtime
+        except OSError:
+            return None
+
+    def groupFiles(self, entries):
+        '''groups DirEntries by their names for a compact listing, like
+        :meth:`SQLiteCache.listdir_groups` does in the database'''
+        keyed = sorted(((CherryModel.fileNameKey(entry.name), entry) for entry in entries),
+                       key=lambda keyentry: keyentry[0])
+        namekeys = [key for key, entry in keyed]
+        grouplength = len(os.path.commonprefix(namekeys)) + 1
+        groups = []
+        group = None
+        for key, entry in keyed:
+            if len(key) < grouplength:
+                groups.append(entry)
+            elif group is None or not key.startswith(group):
+                group = key[:grouplength]
+                label = entry.name[:grouplength]
+                # upper case can change the length of some letters
+                groups.append(label if label.upper() == group else group)
+        return groups
+
+    def compactEntries(self, absdirpath, groups):
         musicentries = []
-
-        maximum_shown_files = cherry.config['browser.maxshowfiles']
-        compactlisting = len(allfilesindir) > maximum_shown_files
-        if compactlisting:
-            upper_case_files = [x.upper() for x in allfilesindir]
-            filterstr = os.path.commonprefix(upper_case_files)
-            filterlength = len(filterstr)+1
-            currentletter = '/'  # impossible first character
-            sortedfiles = self.sortFiles(allfilesindir)
-            for dir in sortedfiles:
-                filter_match = dir.upper().startswith(currentletter.upper())
-                if filter_match and not len(currentletter) < filterlength:
-                    continue
-                else:
-                    currentletter = dir[:filterlength]
-                    #if the filter equals the foldername
-                    if len(currentletter) == len(filterstr):
-                        subpath = os.path.join(absdirpath, dir)
-                        self.addMusicEntry(subpath, musicentries)
-                    else:
-                        musicentries.append(
-                            MusicEntry(strippath(absdirpath),
-                                       repr=currentletter,
-                                       compact=True))
-        else:
-            sortedfiles = self.sortFiles(allfilesindir, absdirpath)
-            for dir in sortedfiles:
-                subpath = os.path.join(absdirpath, dir)
-                self.addMusicEntry(subpath, musicentries)
+        for group in groups:
+            if isinstance(group, DirEntry):
+                #the name is all the entries have in common
+                self.addMusicEntry(absdirpath, group, musicentries)
+            else:
+                musicentries.append(MusicEntry(strippath(absdirpath),
+                                               repr=group,
+                                               compact=True))
         return musicentries
 
-    def addMusicEntry(self, fullpath, list):
-        if os.path.isfile(fullpath):
-            if isplayable(fullpath):
-                list.append(MusicEntry(strippath(fullpath)))
-        else:
-            list.append(MusicEntry(strippath(fullpath), dir=True))
+    def addMusicEntry(self, absdirpath, entry, list):
+        list.extend(self.musicEntries(absdirpath, (entry,)))
+
+    def musicEntries(self, absdirpath, entries):
+        '''yields MusicEntries for the directories and playable files among
+        DirEntries, one at a time'''
+        for entry in entries:
+            fullpath = os.path.join(absdirpath, entry.name)
+            if entry.isdir:
+                yield MusicEntry(strippath(fullpath), dir=True)
+            elif entry.playable:
+                yield MusicEntry(strippath(fullpath))
 
     def updateLibrary(self):
         self.cache.full_update()
@@ -160,20 +225,28 @@ class CherryModel:
         return True
 
     def search(self, term):
-        reload(cherry.tweak)
-        tweaks = cherry.tweak.CherryModelTweaks
+        term = term.strip()
+        tweaks = util.tweaks()
+        modeltweaks = tweaks.CherryModelTweaks
         user = cherrypy.session.get('username', None)
         if user:
             log.d(_("%(user)s searched for '%(term)s'"), {'user': user, 'term': term})
         max_search_results = cherry.config['search.maxresults']
+        # the weights are part of the key, so edited tweaks apply at once
+        cachekey = (SearchResultCache.normalize(term), max_search_results,
+                    tweaks.ResultOrderTweaks)
+        generation = self.cache.generation
+        debug = modeltweaks.result_order_debug
+        if not debug:
+            results = self.searchcache.get(cachekey, generation)
+            if results is not None:
+                return list(results)
         results = self.cache.searchfor(term, maxresults=max_search_results)
         with Performance(_('sorting DB results using ResultOrder')) as perf:
-            debug = tweaks.result_order_debug
-            order_function = resultorder.ResultOrder(term, debug=debug)
-            results = sorted(results, key=order_function, reverse=True)
+            results = resultorder.rank(term, results, debug=debug, tweaks=tweaks)
             results = results[:min(len(results), max_search_results)]
             if debug:
-                n = tweaks.result_order_debug_files
+                n = modeltweaks.result_order_debug_files
                 for sortedResults in results[:n]:
                     perf.log(sortedResults.debugOutputSort)
                 for sortedResults in results:
@@ -181,7 +254,13 @@ class CherryModel:
 
         with Performance(_('checking and classifying results:')):
             results = list(filter(isValidMediaFile, results))
-        return results
+        if not debug:
+            # debug results must not be served to normal searches later
+            self.searchcache.put(cachekey, results, generation)
+        return list(results)
+
+    def search_cache_stats(self):
+        return self.searchcache.stats()
 
     def check_for_updates(self):
         url = 'http://fomori.org/cherrymusic/update_check.php?version='
@@ -256,12 +335,10 @@ class CherryModel:
             oneliner = oneliner.replace('{liquid}', choice(liquid))
         return oneliner
 
-    def randomMusicEntries(self, count):
-        loadCount = int(count * 1.5) + 1           # expect 70% valid entries
-        entries = self.cache.randomFileEntries(loadCount)
-        filteredEntries = list(filter(isValidMediaFile, entries))
-
-        return filteredEntries[:count]
+    def randomMusicEntries(self, count, subtree=None):
+        entries = self.cache.randomFileEntries(
+            count, formats=CherryModel.supportedFormats, subtree=subtree)
+        return list(filter(isValidMediaFile, entries))
 
 
 def isValidMediaFile(file):
@@ -287,6 +364,56 @@ def strippath(path):
     return path
 
 
+class SearchResultCache(object):
+    '''Threadsafe LRU cache of ranked search results, bounded by number of
+    entries and estimated memory use. All entries become invalid as soon as
+    the library generation of the file cache changes.'''
+
+    entryoverhead = 400     # rough size of a MusicEntry without its path
+
+    def __init__(self, maxsize=SEARCHCACHESIZE, maxbytes=SEARCHCACHEMAXBYTES):
+        self._lock = threading.Lock()
+        self._results = LRUCache(maxsize, maxweight=maxbytes,
+                                 weigh=SearchResultCache.sizeof)
+        self.generation = None
+
+    @classmethod
+    def normalize(cls, term):
+        '''returns a key for term that is the same for all search strings
+        that find the same results in the same order. The ranking depends
+        on the order and repetition of the words, so only case and
+        surrounding whitespace are ignored.'''
+        from cherrymusicserver.sqlitecache import SQLiteCache   # circular import
+        term = term.strip()
+        mode, value = SQLiteCache.searchmode(term)
+        return mode, term.lower()
+
+    @classmethod
+    def sizeof(cls, results):
+        return sum(cls.entryoverhead + sys.getsizeof(entry.path) for entry in results)
+
+    def get(self, key, generation):
+        '''returns the cached results for key, or None'''
+        with self._lock:
+            if generation != self.generation:
+                self._results.clear()
+                self.generation = generation
+            return self._results.get(key)
+
+    def put(self, key, results, generation):
+        '''cache results for key, unless they were searched for in an
+        outdated library generation'''
+        with self._lock:
+            if generation == self.generation:
+                self._results.put(key, tuple(results))
+
+    def stats(self):
+        with self._lock:
+            stats = self._results.stats()
+            stats['generation'] = self.generation
+            return stats
+
+
 class MusicEntry:
     def __init__(self, path, compact=False, dir=False, repr=None):
         self.path = path
@@ -108,6 +108,18 @@ def from_defaults():
                     Defaults to {default_value} {default_unit}.
                             """.format(default_value='250', default_unit=_('megabytes')))
 
+    with c['media.watch'] as watch:
+        watch.value = False
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        watch.doc = _("""
+                    Watch BASEDIR for changes while the server is running
+                    and update the media database automatically, so new
+                    files can be found within seconds. Only available on
+                    Linux. Each directory needs an inotify watch; for very
+                    large collections, you may need to raise the limit in
+                    /proc/sys/fs/inotify/max_user_watches.
+                            """)
+
     with c['search.maxresults'] as maxresults:
         maxresults.value = 20
         # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
@@ -126,6 +138,21 @@ def from_defaults():
                     sufficient memory, because it will hurt the performance otherwise.
                             """)
 
+    with c['search.engine'] as engine:
+        engine.value = 'database'
+        engine.valid = 'database|memory|fts5'
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        engine.doc = _("""
+                    ENGINE selects how search words are looked up. "database"
+                    queries the media database for each search. "memory"
+                    keeps a compact word index in memory, which makes searching
+                    large collections much faster at the cost of some memory
+                    and a longer startup. "fts5" uses the full text search
+                    extension of SQLite, which also finds files by the names
+                    of their folders; if it is not available, "database" is
+                    used instead.
+                            """)
+
     with c['browser.maxshowfiles'] as maxshowfiles:
         maxshowfiles.value = 100
         # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
@@ -206,6 +233,15 @@ def from_defaults():
                     playlists will be lost when the server is restarted.
                             ''')
 
+    with c['server.legacy_json_api'] as legacy_json_api:
+        legacy_json_api.value = False
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        legacy_json_api.doc = _('''
+                    Older versions sent the results of some API calls as JSON
+                    strings inside the JSON response. Set this to "True" if you
+                    use a client that still expects them that way.
+                            ''')
+
     with c['server.ssl_enabled'] as ssl_enabled:
         ssl_enabled.value = False
         # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
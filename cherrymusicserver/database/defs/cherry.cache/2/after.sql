@@ -0,0 +1,64 @@
+CREATE UNIQUE INDEX IF NOT EXISTS idx_files_parent_filename_filetype ON files(parent, filename, filetype);    -- for path lookup
+CREATE INDEX IF NOT EXISTS idx_dictionary_word ON dictionary(word);
+CREATE INDEX IF NOT EXISTS idx_search_drowid_frowid ON search(drowid, frowid);    -- for lookup
+CREATE INDEX IF NOT EXISTS idx_search_frowid_drowid ON search(frowid, drowid);    -- for deletion
+
+CREATE TRIGGER IF NOT EXISTS trigger_files_after_update_set_modified
+    AFTER UPDATE ON files
+    FOR EACH ROW
+    BEGIN
+        UPDATE files SET _modified=(strftime('%s', 'now')) WHERE _id = new._id;
+    END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_search_after_insert_count_occurrence
+    AFTER INSERT ON search
+    FOR EACH ROW
+    BEGIN
+        UPDATE dictionary SET occurrences = occurrences + 1 WHERE _id = new.drowid;
+    END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_search_after_delete_uncount_occurrence
+    AFTER DELETE ON search
+    FOR EACH ROW
+    BEGIN
+        UPDATE dictionary SET occurrences = occurrences - 1 WHERE _id = old.drowid;
+    END;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_tracks_filetype_pos ON tracks(filetype, pos);
+CREATE INDEX IF NOT EXISTS idx_tracks_file ON tracks(file);
+
+CREATE TRIGGER IF NOT EXISTS trigger_files_after_insert_add_track
+    AFTER INSERT ON files
+    FOR EACH ROW WHEN new.isdir = 0
+    BEGIN
+        INSERT OR IGNORE INTO trackcounts (filetype, tracks)
+            VALUES (coalesce(lower(new.filetype), ''), 0);
+        UPDATE trackcounts SET tracks = tracks + 1
+            WHERE filetype = coalesce(lower(new.filetype), '');
+        INSERT INTO tracks (file, filetype, pos)
+            SELECT new._id, filetype, tracks FROM trackcounts
+            WHERE filetype = coalesce(lower(new.filetype), '');
+    END;
+
+-- keeps positions dense: the last track of the same type moves into the gap
+CREATE TRIGGER IF NOT EXISTS trigger_files_after_delete_remove_track
+    AFTER DELETE ON files
+    FOR EACH ROW WHEN old.isdir = 0 AND EXISTS (SELECT 1 FROM tracks WHERE file = old._id)
+    BEGIN
+        UPDATE tracks SET file = (
+                SELECT last.file FROM tracks AS last JOIN trackcounts
+                    ON trackcounts.filetype = last.filetype
+                WHERE last.filetype = tracks.filetype AND last.pos = trackcounts.tracks)
+            WHERE file = old._id;
+        DELETE FROM tracks
+            WHERE filetype = coalesce(lower(old.filetype), '')
+            AND pos = (SELECT tracks FROM trackcounts
+                       WHERE filetype = coalesce(lower(old.filetype), ''));
+        UPDATE trackcounts SET tracks = tracks - 1
+            WHERE filetype = coalesce(lower(old.filetype), '');
+        DELETE FROM trackcounts WHERE tracks = 0;
+    END;
+
+CREATE INDEX IF NOT EXISTS idx_files_parent_isdir_sortkey ON files(parent, isdir DESC, sortkey, filename);    -- for listings
+CREATE INDEX IF NOT EXISTS idx_files_parent_isdir_namekey ON files(parent, isdir DESC, namekey);    -- for name prefixes
+CREATE INDEX IF NOT EXISTS idx_files_path_isdir_filetype ON files(path, isdir, filetype);    -- for subtrees
@@ -0,0 +1,47 @@
+CREATE TABLE files(
+    _id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    _created INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+    _modified INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+    _deleted INTEGER DEFAULT 0,
+    parent INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    filetype TEXT,
+    isdir INTEGER NOT NULL,
+    path TEXT,
+    mtime REAL,
+    inode INTEGER,
+    sortkey TEXT,
+    namekey TEXT
+);
+
+CREATE TABLE dictionary(
+    _id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    word TEXT NOT NULL,
+    occurrences INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE TABLE search(
+    _id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    drowid INTEGER NOT NULL,
+    frowid INTEGER NOT NULL
+);
+
+CREATE TABLE tracks(
+    _id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    file INTEGER NOT NULL,
+    filetype TEXT NOT NULL,
+    pos INTEGER NOT NULL
+);
+
+CREATE TABLE trackcounts(
+    filetype TEXT PRIMARY KEY NOT NULL,
+    tracks INTEGER NOT NULL
+);
+
+-- the library generation: counts changes to the media database, so anything
+-- derived from it knows when to start over, even in other processes
+CREATE TABLE library(
+    generation INTEGER NOT NULL
+);
+
+INSERT INTO library (generation) VALUES (0);
@@ -0,0 +1,13 @@
+DROP TABLE IF EXISTS files;
+
+DROP TABLE IF EXISTS dictionary;
+
+DROP TABLE IF EXISTS search;
+
+DROP TABLE IF EXISTS files_fts;
+
+DROP TABLE IF EXISTS tracks;
+
+DROP TABLE IF EXISTS trackcounts;
+
+DROP TABLE IF EXISTS library;
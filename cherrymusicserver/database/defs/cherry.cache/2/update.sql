@@ -0,0 +1,88 @@
+-- path relative to basedir: existing rows are filled in by the media cache
+-- on startup, since the path separator depends on the platform.
+
+ALTER TABLE files ADD COLUMN path TEXT;
+
+
+-- modification time and inode of directories as seen at their last scan,
+-- used to skip unchanged directories during updates.
+
+ALTER TABLE files ADD COLUMN mtime REAL;
+
+ALTER TABLE files ADD COLUMN inode INTEGER;
+
+
+-- the natural sort key of each file name, so directory listings come out of
+-- the database in display order, and the upper case file name, so names
+-- starting with some letters can be found in a range of an index. The media
+-- cache fills them in on its next start.
+
+ALTER TABLE files ADD COLUMN sortkey TEXT;
+
+ALTER TABLE files ADD COLUMN namekey TEXT;
+
+
+-- all files, numbered densely per file type for random sampling.
+-- the media cache fills them in on its next start.
+
+CREATE TABLE tracks(
+    _id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    file INTEGER NOT NULL,
+    filetype TEXT NOT NULL,
+    pos INTEGER NOT NULL
+);
+
+CREATE TABLE trackcounts(
+    filetype TEXT PRIMARY KEY NOT NULL,
+    tracks INTEGER NOT NULL
+);
+
+
+-- each name may only occur once per directory: after.sql replaces the index on
+-- parent with a unique one on (parent, filename, filetype), which also serves
+-- path lookups. Duplicate entries are removed first, with everything below
+-- them, keeping the oldest entry for each name. Directories have no stamps yet,
+-- so the content of the kept ones gets listed again on the next update.
+
+DROP INDEX IF EXISTS idx_files_parent;
+
+CREATE TEMPORARY TABLE _tmp_names AS
+    SELECT parent, filename || coalesce(filetype, '') AS name, min(_id) AS kept
+    FROM files GROUP BY 1, 2 HAVING count(*) > 1;
+
+CREATE TEMPORARY TABLE _tmp_duplicates(_id INTEGER PRIMARY KEY);
+
+INSERT INTO _tmp_duplicates(_id)
+    WITH RECURSIVE doomed(_id) AS (
+        SELECT files._id FROM files JOIN _tmp_names
+            ON files.parent = _tmp_names.parent
+            AND files.filename || coalesce(files.filetype, '') = _tmp_names.name
+            AND files._id != _tmp_names.kept
+        UNION
+        SELECT files._id FROM files JOIN doomed ON files.parent = doomed._id
+    ) SELECT _id FROM doomed;
+
+DELETE FROM search WHERE frowid IN (SELECT _id FROM _tmp_duplicates);
+DELETE FROM files WHERE _id IN (SELECT _id FROM _tmp_duplicates);
+
+DROP TABLE _tmp_duplicates;
+DROP TABLE _tmp_names;
+
+
+-- word occurrences are kept up to date by triggers from now on:
+-- start from an exact count, and drop the words no file uses any more.
+
+UPDATE dictionary SET occurrences = (
+    SELECT count(*) FROM search WHERE search.drowid = dictionary._id);
+
+DELETE FROM dictionary WHERE occurrences <= 0;
+
+
+-- the library generation: counts changes to the media database, so anything
+-- derived from it knows when to start over, even in other processes
+
+CREATE TABLE library(
+    generation INTEGER NOT NULL
+);
+
+INSERT INTO library (generation) VALUES (0);
@@ -140,7 +140,7 @@ class Updater(object):
         version, target = self._version, self._target
         log.d('%s update check: version=[%s] target=[%s]',
               self.name, version, target)
-        return version is None or version < target
+        return version is None or int(version) < int(target)
 
     @property
     def requires_consent(self):
@@ -196,7 +196,8 @@ class Updater(object):
         try:
             return self.__version
         except AttributeError:
-            maxv = self.db.execute('SELECT MAX(version) FROM _meta_version').fetchone()
+            maxv = self.db.execute(
+                'SELECT MAX(CAST(version AS INTEGER)) FROM _meta_version').fetchone()
             maxv = maxv and maxv[0]
             self.__version = maxv if maxv is None else str(maxv)
             return self.__version
@@ -209,13 +210,13 @@ class Updater(object):
 
     @property
     def _target(self):
-        return max(self.desc)
+        return max(self.desc, key=int)
 
     @property
     def _updates_due(self):
         if None is self._version:
             return ()
-        versions = sorted(self.desc)
+        versions = sorted(self.desc, key=int)
         start = versions.index(self._version) + 1
         return versions[start:]
 
@@ -277,6 +278,10 @@ class TmpConnector(AbstractConnector):
         return os.path.join(self.testdirname, basename)
 
 
+def _ignore_close(cxn):
+    pass
+
+
 class MemConnector(AbstractConnector):  # NOT threadsafe
     """Special SQLite3 Connector that reuses THE SAME memory connection for
     each dbname. This connection is NOT CLOSABLE by normal means.
@@ -284,10 +289,12 @@ class MemConnector(AbstractConnector):  # NOT threadsafe
     """
     def __init__(self):
         self.connections = {}
+        # close must not refer back to self: without a reference cycle, the
+        # connections are released as soon as the connector goes away
         self.Connection = type(
             self.__class__.__name__ + '.Connection',
             (sqlite3.Connection,),
-            {'close': self.__disconnect})
+            {'close': _ignore_close})
 
     def __del__(self):
         self.__disconnect(seriously=True)
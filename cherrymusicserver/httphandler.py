@@ -36,7 +36,9 @@ requested information"""
 import os  # shouldn't have to list any folder in the future!
 import json
 import cherrypy
+from cherrypy.lib import httputil
 import codecs
+import email.utils
 import sys
 
 try:
@@ -55,6 +57,7 @@ from cherrymusicserver import userdb
 from cherrymusicserver import log
 from cherrymusicserver import albumartfetcher
 from cherrymusicserver import service
+from cherrymusicserver import jsoncodec
 from cherrymusicserver.pathprovider import readRes
 from cherrymusicserver.pathprovider import albumArtFilePath
 import cherrymusicserver as cherry
@@ -66,6 +69,28 @@ import time
 
 debug = True
 
+STREAMCHUNKSIZE = 64 * 1024     # bytes of JSON to collect before sending
+
+
+def jsonstream(items, chunksize=STREAMCHUNKSIZE):
+    '''encodes ``{"data": [...]}`` for a sequence of items one item at a
+    time, yielding the result in chunks of about ``chunksize`` bytes'''
+    chunk = ['{"data": [']
+    size = 0
+    separator = ''
+    for item in items:
+        encoded = jsoncodec.dumps(item)
+        chunk.append(separator)
+        chunk.append(encoded)
+        separator = ', '
+        size += len(encoded)
+        if size >= chunksize:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+            size = 0
+    chunk.append(']}')
+    yield ''.join(chunk).encode('utf-8')
+
 
 @service.user(model='cherrymodel', playlistdb='playlist',
               useroptions='useroptions', userdb='users')
@@ -77,6 +102,9 @@ class HTTPHandler(object):
         template_login = 'res/login.html'
         template_firstrun = 'res/firstrun.html'
 
+        # part of every ETag: responses may change with a restart
+        self.etagprefix = '%x' % int(time.time())
+
         self.mainpage = readRes(template_main)
         self.loginpage = readRes(template_login)
         self.firstrunpage = readRes(template_firstrun)
@@ -104,6 +132,7 @@ class HTTPHandler(object):
             'getdecoders': self.api_getdecoders,
             'transcodingenabled': self.api_transcodingenabled,
             'updatedb': self.api_updatedb,
+            'getsearchcachestats': self.api_getsearchcachestats,
             'getconfiguration': self.api_getconfiguration,
             'compactlistdir': self.api_compactlistdir,
             'listdir': self.api_listdir,
@@ -266,6 +295,32 @@ class HTTPHandler(object):
     trans._cp_config = {'response.stream': True}
 
 
+    def validate_cache(self, version, lastmodified=None):
+        '''make the current response cacheable: derive its validators from
+        version and lastmodified (a timestamp), and answer conditional
+        GET requests with "304 Not Modified" if they still match.
+
+        Clients must check back every time before they reuse it.'''
+        headers = cherrypy.response.headers
+        etag = '"%s-%s"' % (self.etagprefix, version)
+        headers['ETag'] = etag
+        if lastmodified is not None:
+            headers['Last-Modified'] = httputil.HTTPDate(lastmodified)
+        headers['Cache-Control'] = 'private, no-cache'
+        if cherrypy.request.method not in ('GET', 'HEAD'):
+            return
+        requestheaders = cherrypy.request.headers
+        ifnonematch = requestheaders.get('If-None-Match')
+        if ifnonematch is not None:
+            tags = [tag.strip() for tag in ifnonematch.split(',')]
+            if '*' in tags or etag in tags or 'W/' + etag in tags:
+                raise cherrypy.HTTPRedirect([], 304)
+        elif lastmodified is not None:
+            since = requestheaders.get('If-Modified-Since')
+            since = since and email.utils.parsedate_tz(since)
+            if since and int(lastmodified) <= email.utils.mktime_tz(since):
+                raise cherrypy.HTTPRedirect([], 304)
+
     def api(self, *args, **kwargs):
         """calls the appropriate handler from the handlers
         dict, if available. handlers having noauth set to
@@ -282,12 +337,23 @@ class HTTPHandler(object):
             raise cherrypy.HTTPError(401, 'Unauthorized')
         handler_args = {}
         if 'data' in kwargs:
-            handler_args = json.loads(kwargs['data'])
+            handler_args = jsoncodec.loads(kwargs['data'])
         is_binary = ('binary' in dir(handler) and handler.binary)
         if is_binary:
             return handler(**handler_args)
+        result = handler(**handler_args)
+        is_double_encoded = ('double_encoded' in dir(handler) and handler.double_encoded)
+        if is_double_encoded and cherry.config['server.legacy_json_api']:
+            # older clients expect these results as JSON strings
+            result = jsoncodec.dumps(result)
+        is_streaming = ('streaming' in dir(handler) and handler.streaming)
+        if is_streaming:
+            # send the response while it is encoded, instead of keeping the
+            # whole thing in memory first
+            cherrypy.response.stream = True
+            return jsonstream(result)
         else:
-            return json.dumps({'data': handler(**handler_args)})
+            return jsoncodec.dumps({'data': result})
 
     api.exposed = True
 
@@ -393,8 +459,16 @@ class HTTPHandler(object):
     def api_fetchalbumart(self, directory):
         cherrypy.session.release_lock()
 
-        #try getting a cached album art image
+        #the image can only change with the cached one or the folder
         b64imgpath = albumArtFilePath(directory)
+        localpath = os.path.join(cherry.config['media.basedir'], directory)
+        stamps = [os.path.getmtime(path) for path in (b64imgpath, localpath)
+                  if os.path.exists(path)]
+        if stamps:
+            lastmodified = max(stamps)
+            self.validate_cache('%x' % int(lastmodified * 1000), lastmodified)
+
+        #try getting a cached album art image
         img_data = self.albumartcache_load(b64imgpath)
         if img_data:
             cherrypy.response.headers["Content-Length"] = len(img_data)
@@ -402,7 +476,6 @@ class HTTPHandler(object):
 
         #try getting album art inside local folder
         fetcher = albumartfetcher.AlbumArtFetcher()
-        localpath = os.path.join(cherry.config['media.basedir'], directory)
         header, data, resized = fetcher.fetchLocal(localpath)
 
         if header:
@@ -422,6 +495,11 @@ class HTTPHandler(object):
                 cherrypy.response.headers.update(header)
                 self.albumartcache_save(b64imgpath, data)
                 return data
+        #no art yet: nothing to revalidate, ask again next time
+        headers = cherrypy.response.headers
+        headers.pop('ETag', None)
+        headers.pop('Last-Modified', None)
+        headers['Cache-Control'] = 'no-store'
         cherrypy.HTTPRedirect("/res/img/folder.png", 302)
     api_fetchalbumart.noauth = True
     api_fetchalbumart.binary = True
@@ -435,22 +513,42 @@ class HTTPHandler(object):
         with open(path, 'wb') as f:
             f.write(data)
 
-    def api_compactlistdir(self, directory, filterstr=None):
-        files_to_list = self.model.listdir(directory, filterstr)
-        return [entry.to_dict() for entry in files_to_list]
-
-    def api_listdir(self, directory=''):
-        return [entry.to_dict() for entry in self.model.listdir(directory)]
+    def listdir_window(self, offset, limit):
+        '''validate the optional window of a paginated listing'''
+        try:
+            offset = max(0, int(offset or 0))
+            limit = None if limit is None else max(0, int(limit))
+        except (TypeError, ValueError):
+            raise cherrypy.HTTPError(400, "Bad query: "
+                "offset ({0!r}) and limit ({1!r}) must be integers".format(offset, limit))
+        return offset, limit
+
+    def validate_listdir_cache(self, directory):
+        stamp = self.model.listdirStamp(directory)
+        if stamp is not None:
+            self.validate_cache('%x' % int(stamp * 1000))
+
+    def api_compactlistdir(self, directory, filterstr=None, offset=0, limit=None):
+        offset, limit = self.listdir_window(offset, limit)
+        self.validate_listdir_cache(directory)
+        files_to_list = self.model.listdir(directory, filterstr, offset, limit)
+        return (entry.to_dict() for entry in files_to_list)
+    api_compactlistdir.streaming = True
+
+    def api_listdir(self, directory='', offset=0, limit=None):
+        offset, limit = self.listdir_window(offset, limit)
+        self.validate_listdir_cache(directory)
+        files_to_list = self.model.listdir(directory, offset=offset, limit=limit)
+        return (entry.to_dict() for entry in files_to_list)
+    api_listdir.streaming = True
 
     def api_search(self, searchstring):
         if not searchstring.strip():
-            jsonresults = '[]'
-        else:
-            with Performance(_('processing whole search request')):
-                searchresults = self.model.search(searchstring.strip())
-                with Performance(_('rendering search results as json')):
-                    jsonresults = [entry.to_dict() for entry in searchresults]
-        return jsonresults
+            return []
+        with Performance(_('processing whole search request')):
+            searchresults = self.model.search(searchstring.strip())
+        return (entry.to_dict() for entry in searchresults)
+    api_search.streaming = True
 
     def api_rememberplaylist(self, playlist):
         cherrypy.session['playlist'] = playlist
@@ -479,10 +577,10 @@ class HTTPHandler(object):
             raise cherrypy.HTTPError(400, res)
 
     def api_loadplaylist(self, playlistid):
-        return [entry.to_dict() for entry in self.playlistdb.loadPlaylist(
-                                        playlistid=playlistid,
-                                        userid=self.getUserId()
-                                        )]
+        tracks = self.playlistdb.iterPlaylist(playlistid=playlistid,
+                                              userid=self.getUserId())
+        return (entry.to_dict() for entry in tracks or ())
+    api_loadplaylist.streaming = True
 
     def api_generaterandomplaylist(self):
         return [entry.to_dict() for entry in self.model.randomMusicEntries(50)]
@@ -523,7 +621,8 @@ class HTTPHandler(object):
 
     def api_getplayables(self):
         """DEPRECATED"""
-        return json.dumps(cherry.config['media.playable'])
+        return cherry.config['media.playable']
+    api_getplayables.double_encoded = True
 
     def api_getuserlist(self):
         if cherrypy.session['admin']:
@@ -536,10 +635,11 @@ class HTTPHandler(object):
                 may_download = user_options.getOptionValue('media.may_download')
                 user['last_time_online'] = t
                 user['may_download'] = may_download
-            return json.dumps({'time': int(time.time()),
-                               'userlist': userlist})
+            return {'time': int(time.time()),
+                    'userlist': userlist}
         else:
-            return json.dumps({'time': 0, 'userlist': []})
+            return {'time': 0, 'userlist': []}
+    api_getuserlist.double_encoded = True
 
     def api_adduser(self, username, password, isadmin):
         if cherrypy.session['admin']:
@@ -572,17 +672,23 @@ class HTTPHandler(object):
             return "You didn't think that would work, did you?"
 
     def api_showplaylists(self, sortby="created", filterby=''):
-        playlists = self.playlistdb.showPlaylists(self.getUserId(), filterby)
-        curr_time = int(time.time())
-        #translate userids to usernames:
-        for pl in playlists:
-            pl['username'] = self.userdb.getNameById(pl['userid'])
-            pl['type'] = 'playlist'
-            pl['age'] = curr_time - pl['created']
         if not sortby in ('username', 'age', 'title'):
             sortby = 'created'
-        playlists = sorted(playlists, key=lambda x: x[sortby])
+        curr_time = int(time.time())
+        def annotated(playlists):
+            #translate userids to usernames:
+            for pl in playlists:
+                pl['username'] = self.userdb.getNameById(pl['userid'])
+                pl['type'] = 'playlist'
+                pl['age'] = curr_time - pl['created']
+                yield pl
+        playlists = annotated(self.playlistdb.iterPlaylists(
+            self.getUserId(), filterby, sortby=sortby))
+        if sortby == 'username':
+            # user names are in another database, so sort them here
+            playlists = sorted(playlists, key=lambda x: x[sortby])
         return playlists
+    api_showplaylists.streaming = True
 
     def api_logout(self):
         cherrypy.lib.sessions.expire()
@@ -643,21 +749,37 @@ class HTTPHandler(object):
     def api_getsonginfo(self, path):
         basedir = cherry.config['media.basedir']
         abspath = os.path.join(basedir, path)
-        return json.dumps(metainfo.getSongInfo(abspath).dict())
+        try:
+            stat = os.stat(abspath)
+        except OSError:
+            pass
+        else:
+            self.validate_cache('%x-%x' % (int(stat.st_mtime * 1000), stat.st_size),
+                                stat.st_mtime)
+        return metainfo.getSongInfo(abspath).dict()
+    api_getsonginfo.double_encoded = True
 
     def api_getencoders(self):
-        return json.dumps(audiotranscode.getEncoders())
+        return audiotranscode.getEncoders()
+    api_getencoders.double_encoded = True
 
     def api_getdecoders(self):
-        return json.dumps(audiotranscode.getDecoders())
+        return audiotranscode.getDecoders()
+    api_getdecoders.double_encoded = True
 
     def api_transcodingenabled(self):
-        return json.dumps(cherry.config['media.transcode'])
+        return cherry.config['media.transcode']
+    api_transcodingenabled.double_encoded = True
 
     def api_updatedb(self):
         self.model.updateLibrary()
         return 'success'
 
+    def api_getsearchcachestats(self):
+        if cherrypy.session['admin']:
+            return self.model.search_cache_stats()
+        return {}
+
     def api_getconfiguration(self):
         clientconfigkeys = {
             'transcodingenabled': cherry.config['media.transcode'],
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""JSON encoding for the API, done by the fastest library available:
+orjson or ujson if one of them is installed, the json module of the
+standard library otherwise. They all produce the same data; only
+whitespace and escaping differ.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj)
+
+
+def _orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    except TypeError:
+        # things orjson does not support, like integers over 64 bits
+        return json.dumps(obj)
+
+
+def _ujson_dumps(obj):
+    try:
+        return ujson.dumps(obj, escape_forward_slashes=False)
+    except (TypeError, OverflowError):
+        return json.dumps(obj)
+
+
+if orjson is not None:
+    name = 'orjson'
+    dumps = _orjson_dumps
+    loads = orjson.loads
+elif ujson is not None:
+    name = 'ujson'
+    dumps = _ujson_dumps
+    loads = ujson.loads
+else:
+    name = 'json'
+    dumps = _stdlib_dumps
+    loads = json.loads
@@ -0,0 +1,332 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""Keeps the media database in sync with the filesystem while the server
+is running, using the Linux inotify API through ctypes.
+
+Events are collected per directory. Once things have been quiet for a
+moment, all directories that changed are handed to the file cache in one
+partial update.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import codecs
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from cherrymusicserver import log
+from cherrymusicserver import service
+
+# flags from <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCHMASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO |
+             IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENTHEADER = struct.Struct(str('iIII'))    # wd, mask, cookie, len
+READSIZE = 64 * 1024
+
+DEBOUNCEDELAY = 2       # seconds without events before updating
+MAXDELAY = 30           # update at the latest this long after the first event
+POLLINTERVAL = 0.5      # how often to check if the watcher should stop
+
+
+_libc = None
+
+def _load_libc():
+    '''returns the C library if it provides inotify, else None'''
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                   use_errno=True)
+                libc.inotify_init1
+                libc.inotify_add_watch
+                libc.inotify_rm_watch
+            except (OSError, AttributeError):
+                pass
+            else:
+                libc.inotify_init1.argtypes = [ctypes.c_int]
+                libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+                _libc = libc
+    return _libc or None
+
+
+def is_available():
+    '''True if this system supports watching the filesystem for changes'''
+    return _load_libc() is not None
+
+
+def _oserror(*args):
+    err = ctypes.get_errno()
+    return OSError(err, os.strerror(err), *args)
+
+
+class Inotify(object):
+    '''Minimal wrapper around an inotify instance.'''
+
+    def __init__(self):
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available on this system')
+        self.encoding = sys.getfilesystemencoding() or 'utf-8'
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise _oserror()
+
+    def add_watch(self, path, mask=WATCHMASK):
+        '''start watching path, returns the watch descriptor'''
+        wd = self._libc.inotify_add_watch(self.fd, codecs.encode(path, self.encoding), mask)
+        if wd < 0:
+            raise _oserror(path)
+        return wd
+
+    def rm_watch(self, wd):
+        if self._libc.inotify_rm_watch(self.fd, wd) < 0:
+            raise _oserror()
+
+    def read(self, timeout=None):
+        '''wait up to timeout seconds for events and return them as a list of
+        ``(wd, mask, cookie, name)`` tuples'''
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, READSIZE)
+        except OSError as error:
+            if error.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise
+        events = []
+        pos = 0
+        while pos + EVENTHEADER.size <= len(data):
+            wd, mask, cookie, namelen = EVENTHEADER.unpack_from(data, pos)
+            pos += EVENTHEADER.size
+            name = data[pos:pos + namelen].rstrip(b'\0')
+            pos += namelen
+            try:
+                name = codecs.decode(name, self.encoding)
+            except UnicodeDecodeError:
+                log.e(_('cannot decode filename %r'), name)
+                continue
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def coalesce(paths, basedir):
+    '''reduce a number of changed directories to a sorted list of existing
+    directories, parents first. Directories that no longer exist are
+    replaced by their nearest existing ancestor.'''
+    existing = set()
+    for path in paths:
+        while path != basedir and not os.path.isdir(path):
+            path = os.path.dirname(path)
+        existing.add(path)
+    return sorted(existing)
+
+
+@service.user(cache='filecache')
+class MediaWatcher(object):
+    '''Watches basedir and feeds changed directories to the file cache.
+
+    Bursts of events are debounced: an update only starts once no new event
+    has arrived for ``delay`` seconds, or ``maxdelay`` seconds after the
+    first unhandled event, whichever comes first.
+    '''
+
+    def __init__(self, basedir, delay=DEBOUNCEDELAY, maxdelay=MAXDELAY):
+        self.basedir = os.path.normpath(basedir)
+        self.delay = delay
+        self.maxdelay = maxdelay
+        self._inotify = None
+        self._watches = {}          # wd -> directory path
+        self._dirty = {}            # directory path -> time of first event
+        self._lastevent = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._inotify = Inotify()
+        try:
+            log.i(_('watching %r for changes...'), self.basedir)
+            self.watch_tree(self.basedir)
+            log.i(_('watching %d directories.'), len(self._watches))
+            self._thread = threading.Thread(name='MediaWatcher', target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        except:
+            self.close()
+            raise
+
+    def stop(self):
+        '''stop the watcher thread, wait for it to end and release the
+        inotify instance'''
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self.close()
+
+    def close(self):
+        '''release the inotify instance and forget all watches'''
+        if self._inotify is not None:
+            self._inotify.close()
+        self._watches = {}
+
+    def watch_tree(self, top):
+        '''watch top and all directories below it. Like the file cache, only
+        follow symlinks directly in basedir.'''
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            try:
+                wd = self._inotify.add_watch(path)
+            except OSError as error:
+                if error.errno == errno.ENOSPC:
+                    log.e(_('cannot watch more directories: the limit in '
+                            '/proc/sys/fs/inotify/max_user_watches is too low.'))
+                    return
+                log.w(_('cannot watch %r: %s'), path, error)
+                continue
+            self._watches[wd] = path
+            try:
+                names = os.listdir(path)
+            except OSError as error:
+                log.w(_('cannot list directory: %s'), error)
+                continue
+            for name in names:
+                child = os.path.join(path, name)
+                if os.path.isdir(child) and (path == self.basedir or not os.path.islink(child)):
+                    stack.append(child)
+
+    def unwatch_tree(self, top):
+        '''stop watching top and all directories below it'''
+        prefix = top + os.path.sep
+        for wd, path in list(self._watches.items()):
+            if path == top or path.startswith(prefix):
+                del self._watches[wd]
+                try:
+                    self._inotify.rm_watch(wd)
+                except OSError:
+                    pass    # already gone
+
+    def handle(self, wd, mask, cookie, name):
+        '''process a single inotify event'''
+        if mask & IN_Q_OVERFLOW:
+            log.w(_('too many filesystem events, updating everything.'))
+            self.mark(self.basedir)
+            return
+        path = self._watches.get(wd)
+        if path is None:
+            return
+        if mask & IN_IGNORED:
+            del self._watches[wd]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            return      # handled via the event in the parent directory
+        self.mark(path)
+        if mask & IN_ISDIR:
+            childpath = os.path.join(path, name)
+            if mask & IN_MOVED_FROM:
+                self.unwatch_tree(childpath)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch_tree(childpath)
+
+    def mark(self, path):
+        now = time.time()
+        self._dirty.setdefault(path, now)
+        self._lastevent = now
+
+    def due(self, now=None):
+        '''True if marked directories should be updated now'''
+        if not self._dirty:
+            return False
+        now = time.time() if now is None else now
+        return (now - self._lastevent >= self.delay or
+                now - min(self._dirty.values()) >= self.maxdelay)
+
+    def flush(self):
+        '''update all marked directories.
+
+        Each of them is listed, because an event proves that it changed,
+        even if its modification time has not: that only advances in coarse
+        ticks. Only their unmarked subdirectories are checked for changes
+        before they are listed.'''
+        paths = coalesce(self._dirty, self.basedir)
+        self._dirty = {}
+        try:
+            if self.basedir in paths:
+                paths.remove(self.basedir)
+                self.cache.full_update()
+            if paths:
+                self.cache.partial_update(*paths, deep=False)
+        except Exception as error:
+            log.e(_('error updating changed directories: %r'), error)
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                for event in self._inotify.read(POLLINTERVAL):
+                    self.handle(*event)
+                if self.due():
+                    self.flush()
+        except Exception as error:
+            log.e(_('stopped watching for changes: %r'), error)
+        finally:
+            self._inotify.close()
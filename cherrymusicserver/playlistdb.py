@@ -43,7 +43,8 @@ DBNAME = 'playlist'
 class PlaylistDB:
     def __init__(self, connector=None):
         database.require(DBNAME, version='1')
-        self.conn = BoundConnector(DBNAME, connector).connection()
+        self.connector = BoundConnector(DBNAME, connector)
+        self.conn = self.connector.connection()
 
     def deletePlaylist(self, plid, userid, override_owner=False):
         cursor = self.conn.cursor()
@@ -82,26 +83,43 @@ class PlaylistDB:
         else:
             return _("This playlist name already exists! Nothing saved.")
 
+    def _iterrows(self, query, params):
+        '''yields the result rows of query one at a time. They are read
+        through a connection of their own, so that other users of the
+        shared connection can't interfere while the rows are consumed.'''
+        conn = self.connector.connection()
+        try:
+            for row in conn.execute(query, params):
+                yield row
+        finally:
+            conn.close()
+
     def loadPlaylist(self, playlistid, userid):
+        tracks = self.iterPlaylist(playlistid, userid)
+        if tracks is not None:
+            return list(tracks)
+
+    def iterPlaylist(self, playlistid, userid):
+        '''like :meth:`loadPlaylist`, but returns an iterator that reads the
+        tracks from the database while it is consumed'''
         cursor = self.conn.cursor()
         cursor.execute("""SELECT rowid FROM playlists WHERE
             rowid = ? AND (public = 1 OR userid = ?) LIMIT 0,1""",
             (playlistid, userid));
         result = cursor.fetchone()
         if result:
-            cursor.execute("""SELECT title, url FROM tracks WHERE
-                playlistid = ? ORDER BY track ASC""", (playlistid,))
-            alltracks = cursor.fetchall()
-            apiplaylist = []
-            for track in alltracks:
-                #TODO ugly hack: playlistdb saves the "serve" dir as well...
-                trackurl = unquote(track[1])
-                if trackurl.startswith('/serve/'):
-                    trackurl = trackurl[7:]
-                elif trackurl.startswith('serve/'):
-                    trackurl = trackurl[6:]
-                apiplaylist.append(MusicEntry(path=trackurl, repr=unquote(track[0])))
-            return apiplaylist
+            return self._iterTracks(playlistid)
+
+    def _iterTracks(self, playlistid):
+        for title, url in self._iterrows("""SELECT title, url FROM tracks WHERE
+                playlistid = ? ORDER BY track ASC""", (playlistid,)):
+            #TODO ugly hack: playlistdb saves the "serve" dir as well...
+            trackurl = unquote(url)
+            if trackurl.startswith('/serve/'):
+                trackurl = trackurl[7:]
+            elif trackurl.startswith('serve/'):
+                trackurl = trackurl[6:]
+            yield MusicEntry(path=trackurl, repr=unquote(title))
 
     def getName(self, plid, userid ):
         cur = self.conn.cursor()
@@ -118,40 +136,38 @@ class PlaylistDB:
         cur.execute("""UPDATE playlists SET public = ? WHERE rowid = ? AND userid = ?""", (ispublic, plid, userid))
         self.conn.commit()
 
-    def _searchPlaylist(self, searchterm):
-        q = '''SELECT DISTINCT playlists.rowid FROM playlists, tracks
-               WHERE ( tracks.playlistid = playlists.rowid
-                       AND tracks.title LIKE ? )
-                     OR
-                       playlists.title LIKE ?'''
-        cur = self.conn.cursor()
-        res = cur.execute(q, ('%'+searchterm+'%', '%'+searchterm+'%'))
-        return [row[0] for row in res.fetchall()]
-
     def showPlaylists(self, userid, filterby='', include_public=True):
-        filtered = None
-        if filterby != '':
-            filtered = self._searchPlaylist(filterby)
-        cur = self.conn.cursor()
+        return list(self.iterPlaylists(userid, filterby, include_public))
+
+    def iterPlaylists(self, userid, filterby='', include_public=True, sortby=None):
+        '''like :meth:`showPlaylists`, but returns an iterator that reads the
+        playlists from the database while it is consumed. They can be
+        ordered by ``sortby``: 'created', 'title' or 'age' (newest first).'''
         select = "SELECT rowid, title, userid, public, _created FROM playlists"
         if include_public:
-            where = """ WHERE public=:public OR userid=:userid"""
+            where = """ WHERE (public=:public OR userid=:userid)"""
         else:
             where = """ WHERE userid=:userid"""
-        cur.execute(select + where, {'public': True, 'userid': userid});
-        results = cur.fetchall()
-        playlists = []
-        for result in results:
-            if not filtered is None and result[0] not in filtered:
-                continue
-            playlists.append({'plid': result[0],
-                              'title': result[1],
-                              'userid': result[2],
-                              'public': bool(result[3]),
-                              'owner': bool(userid==result[2]),
-                              'created': result[4]
-                              })
-        return playlists
+        params = {'public': True, 'userid': userid}
+        if filterby != '':
+            where += """ AND rowid IN (
+                SELECT playlists.rowid FROM playlists, tracks
+                WHERE ( tracks.playlistid = playlists.rowid
+                        AND tracks.title LIKE :filter )
+                      OR
+                        playlists.title LIKE :filter)"""
+            params['filter'] = '%' + filterby + '%'
+        order = {'created': ' ORDER BY _created, rowid',
+                 'title': ' ORDER BY title, rowid',
+                 'age': ' ORDER BY _created DESC, rowid'}.get(sortby, '')
+        for result in self._iterrows(select + where + order, params):
+            yield {'plid': result[0],
+                   'title': result[1],
+                   'userid': result[2],
+                   'public': bool(result[3]),
+                   'owner': bool(userid==result[2]),
+                   'created': result[4]
+                   }
 
 
     def createPLS(self,userid,plid, addrstr):
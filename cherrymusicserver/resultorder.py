@@ -35,76 +35,75 @@ hocuspocus heuristics"""
 
 from cherrymusicserver import pathprovider
 from cherrymusicserver import log
-import cherrymusicserver.tweak
-from imp import reload
-from cherrymusicserver.util import Performance
+from cherrymusicserver import util
 
 class ResultOrder:
-    def __init__(self, searchword, debug=False):
+    def __init__(self, searchword, debug=False, tweaks=None):
         self.debug = debug
         self.fullsearchterm = searchword.lower()
         self.searchwords = searchword.lower().split(' ')
 
-        reload(cherrymusicserver.tweak)
-        self.perfect_match_bonus = cherrymusicserver.tweak.ResultOrderTweaks.perfect_match_bonus
-        self.partial_perfect_match_bonus = cherrymusicserver.tweak.ResultOrderTweaks.partial_perfect_match_bonus
-        self.starts_with_bonus = cherrymusicserver.tweak.ResultOrderTweaks.starts_with_bonus
-        self.folder_bonus = cherrymusicserver.tweak.ResultOrderTweaks.folder_bonus
-        self.word_in_file_name_bonus = cherrymusicserver.tweak.ResultOrderTweaks.word_in_file_name_bonus
-        self.word_not_in_file_name_penalty = cherrymusicserver.tweak.ResultOrderTweaks.word_not_in_file_name_penalty
-        self.word_in_file_path_bonus = cherrymusicserver.tweak.ResultOrderTweaks.word_in_file_path_bonus
-        self.word_not_in_file_path_penalty = cherrymusicserver.tweak.ResultOrderTweaks.word_not_in_file_path_penalty
-    def __call__(self,element):
-        file = element.path
-        isdir = element.dir
-        fullpath = file.lower()
-        filename = pathprovider.filename(file).lower()
-        filename_words = filename.split(' ')
-
-        bias = 0
-        occurences_bias = 0
-        perfect_match_bias = 0
-        partial_perfect_match_bias = 0
-        folder_bias = 0
-        starts_with_bias = 0
-        starts_with_no_track_number_bias = 0
+        weights = (tweaks or util.tweaks()).ResultOrderTweaks
+        self.perfect_match_bonus = weights.perfect_match_bonus
+        self.partial_perfect_match_bonus = weights.partial_perfect_match_bonus
+        self.starts_with_bonus = weights.starts_with_bonus
+        self.folder_bonus = weights.folder_bonus
+        self.word_in_file_name_bonus = weights.word_in_file_name_bonus
+        self.word_not_in_file_name_penalty = weights.word_not_in_file_name_penalty
+        self.word_in_file_path_bonus = weights.word_in_file_path_bonus
+        self.word_not_in_file_path_penalty = weights.word_not_in_file_path_penalty
+        self._precompute()
 
-        #count occurences of searchwords
-        occurences=0
+    def _precompute(self):
+        '''prepare everything that only depends on the search term, so that
+        scoring a candidate needs a single pass over the search words'''
+        # a word in the file name is always in the path as well
+        self._in_name_bias = self.word_in_file_name_bonus + self.word_in_file_path_bonus
+        self._in_path_only_bias = self.word_not_in_file_name_penalty + self.word_in_file_path_bonus
+        self._in_neither_bias = self.word_not_in_file_name_penalty + self.word_not_in_file_path_penalty
+        self._wordcounts = {}
         for searchword in self.searchwords:
-            if searchword in fullpath:
-                occurences_bias += self.word_in_file_path_bonus
-            else:
-                occurences_bias += self.word_not_in_file_path_penalty
-            if searchword in filename:
-                occurences_bias += self.word_in_file_name_bonus
-            else:
-                occurences_bias += self.word_not_in_file_name_penalty
+            self._wordcounts[searchword] = self._wordcounts.get(searchword, 0) + 1
+        self._perfect_matches = (self.fullsearchterm,
+                                 self.fullsearchterm + ', the',
+                                 self.fullsearchterm + ', die')
 
-        #perfect match?
-        if filename == self.fullsearchterm or self.noThe(filename) == self.fullsearchterm:
-            perfect_match_bias += self.perfect_match_bonus
+    def __call__(self, element):
+        return self.score(element)
 
-        filename = pathprovider.stripext(filename)
-        #partial perfect match?
-        for searchword in self.searchwords:
-            if searchword in filename_words:
-                partial_perfect_match_bias += self.partial_perfect_match_bonus
-        if isdir:
-            folder_bias += self.folder_bonus
+    def score(self, element):
+        '''return the bias of a single search result; if debug is enabled,
+        the explanation is attached to the element as ``debugOutputSort``'''
+        fullpath = element.path.lower()
+        filename = pathprovider.filename(fullpath)
+        name = pathprovider.stripext(filename)
+        # remove possible track number
+        name_no_track = name.lstrip('0123456789').strip()
 
-        #file starts with match?
+        occurences_bias = 0
+        starts_with_bias = 0
         for searchword in self.searchwords:
-            if filename.startswith(searchword):
+            if searchword in filename:
+                occurences_bias += self._in_name_bias
+            elif searchword in fullpath:
+                occurences_bias += self._in_path_only_bias
+            else:
+                occurences_bias += self._in_neither_bias
+            if name.startswith(searchword):
                 starts_with_bias += self.starts_with_bonus
 
-        #remove possible track number
-        while len(filename)>0 and '0' <= filename[0] <= '9':
-            filename = filename[1:]
-        filename = filename.strip()
-        for searchword in self.searchwords:
-            if filename == searchword:
-                starts_with_no_track_number_bias += self.starts_with_bonus
+        perfect_match_bias = 0
+        if filename in self._perfect_matches:
+            perfect_match_bias = self.perfect_match_bonus
+
+        partial_perfect_match_bias = 0
+        wordcounts = self._wordcounts
+        for word in set(filename.split(' ')):
+            if word in wordcounts:
+                partial_perfect_match_bias += wordcounts[word] * self.partial_perfect_match_bonus
+
+        folder_bias = self.folder_bonus if element.dir else 0
+        starts_with_no_track_number_bias = wordcounts.get(name_no_track, 0) * self.starts_with_bonus
 
         bias = occurences_bias + perfect_match_bias + partial_perfect_match_bias + folder_bias + starts_with_bias + starts_with_no_track_number_bias
 
@@ -125,7 +124,7 @@ total bias                       %d
             ''' % (
         self.fullsearchterm,
         self.searchwords,
-        filename,
+        name_no_track,
         fullpath,
         occurences_bias,
         perfect_match_bias,
@@ -137,7 +136,17 @@ total bias                       %d
 
         return bias
 
+    def rank(self, elements):
+        '''return a new list of elements, best match first. Elements with the
+        same score keep their original order.'''
+        return sorted(elements, key=self.score, reverse=True)
+
     def noThe(self,a):
         if a.lower().endswith((', the',', die')):
             return a[:-5]
         return a
+
+
+def rank(searchterm, elements, debug=False, tweaks=None):
+    '''sort search results for searchterm, best match first'''
+    return ResultOrder(searchterm, debug=debug, tweaks=tweaks).rank(elements)
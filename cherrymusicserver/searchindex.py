@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+
+"""Compact in-memory inverted index of the words in the file database.
+
+Words are kept in one sorted list, so finding all words with a given prefix
+takes a bisection and a short scan. Each word owns a posting list of file
+ids, stored as ``array('I')`` to keep large libraries within a few dozen
+megabytes.
+
+Inserting a new word into the sorted list moves all words after it, so a
+media update collects its changes in :class:`IndexChanges` and merges them
+into the index in a single pass when it is done.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import heapq
+import threading
+
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+from cherrymusicserver import log
+
+
+class SearchIndex(object):
+    '''Maps search words to the ids of the files whose names contain them.
+
+    All public methods are threadsafe.
+    '''
+
+    def __init__(self):
+        self._words = []        # sorted
+        self._postings = []     # posting list for the word at the same index
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._words)
+
+    @classmethod
+    def from_db(cls, conn):
+        '''Return a new index built from the ``dictionary`` and ``search``
+        tables of a media cache connection.'''
+        index = cls()
+        index.load(conn)
+        return index
+
+    def load(self, conn):
+        '''Replace the index content with that of the ``dictionary`` and
+        ``search`` tables of a media cache connection.'''
+        log.i(_('Loading search index into memory...'))
+        postings = defaultdict(lambda: array('I'))
+        cursor = conn.execute(
+            'SELECT dictionary.word, search.frowid'
+            ' FROM dictionary JOIN search ON search.drowid = dictionary.rowid')
+        for word, fileid in cursor:
+            postings[word].append(fileid)
+        words = sorted(postings)
+        postings = [postings[word] for word in words]
+        with self._lock:
+            self._words, self._postings = words, postings
+        log.i(_('search index loaded: %d words'), len(words))
+
+    def add(self, fileid, words):
+        '''Register the file with ``fileid`` under each of ``words``.
+
+        New words are inserted into the sorted word list one by one; to
+        add many files, collect them in :class:`IndexChanges` instead.'''
+        with self._lock:
+            for word in words:
+                i = bisect_left(self._words, word)
+                if i < len(self._words) and self._words[i] == word:
+                    self._postings[i].append(fileid)
+                else:
+                    self._words.insert(i, word)
+                    self._postings.insert(i, array('I', (fileid,)))
+
+    def remove(self, fileid, words):
+        '''Remove the file with ``fileid`` from the posting lists of
+        ``words``; words left without files are dropped from the index.'''
+        with self._lock:
+            for word in words:
+                i = bisect_left(self._words, word)
+                if i == len(self._words) or self._words[i] != word:
+                    continue
+                posting = self._postings[i]
+                try:
+                    posting.remove(fileid)
+                except ValueError:
+                    continue
+                if not posting:
+                    del self._words[i]
+                    del self._postings[i]
+
+    def apply(self, changes):
+        '''Merge the :class:`IndexChanges` collected during an update into
+        the index, rebuilding the word list once instead of once per word.'''
+        if not changes:
+            return
+        added, removed = changes.added, changes.removed
+        newwords = sorted(added)
+        with self._lock:
+            oldwords, oldpostings = self._words, self._postings
+            words, postings = [], []
+            i = j = 0
+            while i < len(oldwords) or j < len(newwords):
+                if j == len(newwords) or (i < len(oldwords) and oldwords[i] <= newwords[j]):
+                    word, posting = oldwords[i], oldpostings[i]
+                    i += 1
+                    if j < len(newwords) and newwords[j] == word:
+                        j += 1
+                else:
+                    word, posting = newwords[j], array('I')
+                    j += 1
+                if word in removed:
+                    gone = removed[word]
+                    posting = array('I', (fileid for fileid in posting if fileid not in gone))
+                if word in added:
+                    posting.extend(sorted(added[word]))
+                if posting:
+                    words.append(word)
+                    postings.append(posting)
+            self._words, self._postings = words, postings
+
+    def fileids(self, terms, maxids_per_term, maxresults):
+        '''Return up to ``maxresults`` ids of files matching ``terms``,
+        ranked by the number of term matches.
+
+        Like the database search, every term is treated as a word prefix,
+        and no more than ``maxids_per_term`` ids are taken per term,
+        preferring the rarest matching words.
+        '''
+        counts = defaultdict(int)
+        with self._lock:
+            for term in terms:
+                remaining = maxids_per_term
+                for posting in sorted(self._prefixed(term), key=len):
+                    for fileid in posting[:remaining]:
+                        counts[fileid] += 1
+                    remaining -= len(posting)
+                    if remaining <= 0:
+                        break
+        return heapq.nlargest(maxresults, counts, key=counts.__getitem__)
+
+    def _prefixed(self, prefix):
+        '''Generate the posting lists of all words starting with ``prefix``.
+        Must be called while holding the lock.'''
+        words = self._words
+        i = bisect_left(words, prefix)
+        while i < len(words) and words[i].startswith(prefix):
+            yield self._postings[i]
+            i += 1
+
+
+class IndexChanges(object):
+    '''Collects additions to and removals from a :class:`SearchIndex`, to be
+    merged with :meth:`SearchIndex.apply`. Has the same ``add`` and
+    ``remove`` methods as the index itself.
+
+    Removals are applied before additions, so a file id that is removed
+    and then added again, as happens when the database reuses the id of a
+    deleted row, ends up in the index.
+    '''
+
+    def __init__(self):
+        self.added = defaultdict(set)       # word -> file ids
+        self.removed = defaultdict(set)     # word -> file ids
+
+    def __len__(self):
+        return len(self.added) + len(self.removed)
+
+    def add(self, fileid, words):
+        for word in words:
+            self.added[word].add(fileid)
+
+    def remove(self, fileid, words):
+        for word in words:
+            if fileid in self.added.get(word, ()):
+                self.added[word].discard(fileid)
+                if not self.added[word]:
+                    del self.added[word]
+            else:
+                self.removed[word].add(fileid)
@@ -36,21 +36,26 @@ import os
 import re
 import sqlite3
 import sys
+import threading
+import time
 import traceback
 
 from collections import deque
-from operator import itemgetter
+from contextlib import contextmanager
+from functools import wraps
 
 import cherrymusicserver as cherry
 from cherrymusicserver import database
 from cherrymusicserver import log
 from cherrymusicserver import service
 from cherrymusicserver import util
-from cherrymusicserver.cherrymodel import MusicEntry
+from cherrymusicserver.cherrymodel import CherryModel, DirEntry, MusicEntry
 from cherrymusicserver.database.connect import BoundConnector
 from cherrymusicserver.util import Performance
 from cherrymusicserver.progress import ProgressTree, ProgressReporter
+from cherrymusicserver.searchindex import IndexChanges, SearchIndex
 import random
+from bisect import bisect_right
 
 UNIDECODE_AVAILABLE = True
 try:
@@ -60,41 +65,340 @@ except ImportError:
 
 scanreportinterval = 1
 AUTOSAVEINTERVAL = 100
+BULKINSERTINTERVAL = 10000
+LISTERTHREADS = 4
+LISTERMAXPENDING = 256
+RACYSTAMPWINDOW = 2       # seconds; mtime resolution is 2 s on FAT
+WORDIDCACHESIZE = 50000
+REMOVEBATCHSIZE = 1000
+MEMORYSYNCMAXROWS = 100000  # reload the in-memory files table if more rows changed
+FTSNAMEWEIGHT = 10.0    # bm25 weight of file name matches
+FTSPATHWEIGHT = 1.0     # bm25 weight of matches in the directory path
 debug = False
 keepInRam = False
 
 NORMAL_FILE_SEARCH_LIMIT = 400
+MAXSQLPARAMS = 500
 FAST_FILE_SEARCH_LIMIT = 20
 
 #if debug:
 #    log.level(log.DEBUG)
 
 DBNAME = 'cherry.cache'
+DBVERSION = '2'
+
+
+class Connections(object):
+    '''Connections to the media database: a single one for writing, and one
+    per thread for reading.
+
+    The database runs in WAL mode, so readers always see the last committed
+    state and are not blocked while an update is writing. Writers are
+    serialized by :meth:`writing`; while inside it, a thread reads through
+    the writer connection as well, to see its own uncommitted changes.
+    '''
+
+    def __init__(self, connector):
+        self.connector = connector
+        self.writer = connector.connection()
+        mode = self.writer.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+        log.d(_('media database journal mode: %s'), mode)
+        # safe in WAL mode: a crash can only lose the latest transactions
+        self.writer.execute('PRAGMA synchronous = NORMAL')
+        self._writelock = threading.RLock()
+        self._local = threading.local()
+
+    def reader(self):
+        '''returns the read connection of the current thread'''
+        local = self._local
+        if getattr(local, 'writing', 0):
+            return self.writer
+        try:
+            return local.reader
+        except AttributeError:
+            conn = self.connector.connection()
+            if conn is not self.writer:     # connectors may share connections
+                conn.execute('PRAGMA query_only = ON')
+            local.reader = conn
+            return conn
+
+    @contextmanager
+    def writing(self):
+        '''block until no other thread is writing, then yield the writer
+        connection. Can be nested.'''
+        with self._writelock:
+            local = self._local
+            local.writing = getattr(local, 'writing', 0) + 1
+            try:
+                yield self.writer
+            finally:
+                local.writing -= 1
+
+
+def writes(method):
+    '''decorator for SQLiteCache methods that change the database'''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.connections.writing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def prefixrange(prefix):
+    '''returns the bounds of all strings starting with prefix, as a tuple
+    ``(low, high)`` with ``low <= string < high``. high is None if there is
+    no upper bound.'''
+    if not prefix:
+        return '', None
+    if sys.version_info < (3,):
+        successor = unichr(ord(prefix[-1]) + 1)
+    else:
+        successor = chr(ord(prefix[-1]) + 1)
+    return prefix, prefix[:-1] + successor
+
+
+def namekeyranges(prefix, hidden):
+    '''returns the name key ranges ``(low, high)`` of all names starting
+    with prefix, leaving out hidden names unless ``hidden`` is true'''
+    low, high = prefixrange(prefix)
+    if hidden:
+        return [(low, high)]
+    # hidden names start with a dot, so their name and sort keys do, too
+    hiddenlow, hiddenhigh = prefixrange('.')
+    ranges = []
+    if low < hiddenlow:
+        ranges.append((low, hiddenlow if high is None else min(high, hiddenlow)))
+    if high is None or high > hiddenhigh:
+        ranges.append((max(low, hiddenhigh), high))
+    return ranges
 
 
 class SQLiteCache(object):
 
     def __init__(self, connector=None):
-        database.require(DBNAME, version='1')
+        database.require(DBNAME, version=DBVERSION)
         self.normalize_basedir()
         connector = BoundConnector(DBNAME, connector)
         self.DBFILENAME = connector.dblocation
-        self.conn = connector.connection()
-        self.db = self.conn.cursor()
-
-        #I don't care about journaling!
-        self.conn.execute('PRAGMA synchronous = OFF')
-        self.conn.execute('PRAGMA journal_mode = MEMORY')
+        self.connections = Connections(connector)
+        self.conn = self.connections.writer
+        self.fill_in_missing_paths()
+        self.fill_in_missing_tracks()
+        self.fill_in_missing_sortkeys()
+        self.create_temp_tables()
+        self.memchanges = None
         self.load_db_to_memory()
+        self.wordidcache = None
+        self.dirstamps = None
+        self.searchindex = None
+        self.searchchanges = None
+        self.fts = False
+        engine = cherry.config['search.engine']
+        if engine == 'memory':
+            self.searchindex = SearchIndex.from_db(self.conn)
+        elif engine == 'fts5':
+            if SQLiteCache.fts5_available(self.conn):
+                self.fts = True
+                self.setup_fts()
+            else:
+                log.w(_('search.engine is fts5, but this sqlite3 build lacks'
+                        ' FTS5 support. Falling back to "database".'))
+        if not self.fts:
+            self.drop_fts()     # it would go stale
+
+    @classmethod
+    def fts5_available(cls, conn):
+        try:
+            conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS temp._fts5_probe USING fts5(x)')
+        except sqlite3.OperationalError:
+            return False
+        conn.execute('DROP TABLE temp._fts5_probe')
+        return True
+
+    def setup_fts(self):
+        '''create and fill the full text search table, if necessary. It is
+        not part of the regular schema, since FTS5 is an optional sqlite3
+        feature.'''
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'files_fts'").fetchone():
+            return
+        log.i(_('creating full text search index...'))
+        with self.conn:
+            self.conn.execute('''CREATE VIRTUAL TABLE files_fts USING fts5(
+                name, path, prefix = '2 3')''')
+            self.rebuild_fts()
+
+    def drop_fts(self):
+        with self.conn:
+            self.conn.execute('DROP TABLE IF EXISTS files_fts')
+
+    def rebuild_fts(self):
+        '''fill the full text search table from the files table'''
+        self.conn.execute('DELETE FROM files_fts')
+        cursor = self.conn.execute('SELECT _id, filename, path FROM files')
+        while True:
+            rows = cursor.fetchmany(BULKINSERTINTERVAL)
+            if not rows:
+                break
+            self.conn.executemany('INSERT INTO files_fts(rowid, name, path) VALUES (?, ?, ?)',
+                ((uid, SQLiteCache.ftstext(name), SQLiteCache.ftstext(os.path.dirname(path or '')))
+                 for uid, name, path in rows))
+
+    @classmethod
+    def ftstext(cls, name):
+        '''the search words of name, as text for the full text index'''
+        return ' '.join(sorted(SQLiteCache.searchterms(name)))
+
+    @classmethod
+    def ftsquery(cls, terms):
+        '''an FTS5 query matching any of the terms as a word prefix'''
+        return ' OR '.join('"%s"*' % term.replace('"', '""')
+                           for term in sorted(terms) if re.search('\w', term, re.UNICODE))
+
+    def fetchFtsFileIds(self, terms, maxresults):
+        '''returns up to maxresults file ids matching the terms, best bm25
+        matches first'''
+        query = SQLiteCache.ftsquery(terms)
+        if not query:
+            return []
+        return [uid for (uid,) in self.connections.reader().execute(
+            '''SELECT rowid FROM files_fts WHERE files_fts MATCH ?
+               ORDER BY bm25(files_fts, ?, ?) LIMIT 0, ?''',
+            (query, FTSNAMEWEIGHT, FTSPATHWEIGHT, maxresults))]
+
+    def fill_in_missing_paths(self):
+        '''store the relative path of all files that don't have one yet, e.g.
+        after a schema update. Paths are resolved top down in a single
+        recursive query.'''
+        if not self.conn.execute('SELECT 1 FROM files WHERE path IS NULL LIMIT 1').fetchone():
+            return
+        log.i(_('storing relative file paths in media database...'))
+        with self.conn:
+            self.conn.execute('''CREATE TEMPORARY TABLE _tmp_paths(
+                    _id INTEGER PRIMARY KEY, path TEXT NOT NULL)''')
+            self.conn.execute('''INSERT INTO _tmp_paths(_id, path)
+                WITH RECURSIVE tree(_id, path) AS (
+                    SELECT _id, filename || filetype FROM files WHERE parent = -1
+                    UNION ALL
+                    SELECT files._id, tree.path || ? || files.filename || files.filetype
+                        FROM files JOIN tree ON files.parent = tree._id
+                ) SELECT _id, path FROM tree''', (os.path.sep,))
+            self.conn.execute('''UPDATE files SET path = (
+                    SELECT path FROM _tmp_paths WHERE _tmp_paths._id = files._id)
+                WHERE path IS NULL''')
+            self.conn.execute('DROP TABLE _tmp_paths')
+
+    def fill_in_missing_tracks(self):
+        '''number the files for random sampling, if they haven't been yet,
+        e.g. after a schema update'''
+        if (self.conn.execute('SELECT 1 FROM trackcounts LIMIT 1').fetchone() or
+                not self.conn.execute('SELECT 1 FROM files WHERE isdir = 0 LIMIT 1').fetchone()):
+            return
+        log.i(_('numbering tracks in media database...'))
+        with self.conn:
+            self.rebuild_tracks()
+
+    def rebuild_tracks(self):
+        '''fill the tracks table from scratch: all files, numbered from 1 per
+        file type. Triggers keep it that way afterwards.'''
+        conn = self.conn
+        conn.execute('DELETE FROM tracks')
+        conn.execute('DELETE FROM trackcounts')
+        counts = {}
+        def numbered(rows):
+            for uid, filetype in rows:
+                pos = counts[filetype] = counts.get(filetype, 0) + 1
+                yield uid, filetype, pos
+        conn.executemany('INSERT INTO tracks (file, filetype, pos) VALUES (?, ?, ?)', numbered(
+            conn.execute('''SELECT _id, coalesce(lower(filetype), '') FROM files
+                            WHERE isdir = 0 ORDER BY _id''')))
+        conn.executemany('INSERT INTO trackcounts (filetype, tracks) VALUES (?, ?)', counts.items())
+
+    def fill_in_missing_sortkeys(self):
+        '''store the sort and name keys of all files that don't have them
+        yet, e.g. after a schema update'''
+        if not self.conn.execute('''SELECT 1 FROM files
+                                    WHERE sortkey IS NULL OR namekey IS NULL LIMIT 1''').fetchone():
+            return
+        log.i(_('storing sort keys in media database...'))
+        self.conn.create_function('sortkey', 1, CherryModel.fileSortFunc)
+        self.conn.create_function('namekey', 1, CherryModel.fileNameKey)
+        with self.conn:
+            self.conn.execute('''UPDATE files SET sortkey = sortkey(filename || coalesce(filetype, ''))
+                WHERE sortkey IS NULL''')
+            self.conn.execute('''UPDATE files SET namekey = namekey(filename || coalesce(filetype, ''))
+                WHERE namekey IS NULL''')
+
+    def create_temp_tables(self):
+        '''scratch tables for set operations. Created once per connection,
+        so that using them does not interfere with running transactions.'''
+        self.conn.execute('CREATE TEMPORARY TABLE IF NOT EXISTS _tmp_removed('
+                          '_id INTEGER PRIMARY KEY)')
+        self.conn.execute('CREATE TEMPORARY TABLE IF NOT EXISTS _tmp_wordids('
+                          '_id INTEGER PRIMARY KEY)')
+        self.conn.commit()
 
     def file_db_in_memory(self):
         return not self.DBFILENAME == ':memory:' and cherry.config['search.load_file_db_into_memory']
 
     def load_db_to_memory(self):
         if self.file_db_in_memory():
-            self.file_db_mem = MemoryDB(self.DBFILENAME, 'files')
-            self.file_db_mem.db.execute('CREATE INDEX IF NOT EXISTS idx_files_parent'
+            memdb = MemoryDB(self.DBFILENAME, 'files')
+            memdb.db.execute('CREATE INDEX IF NOT EXISTS idx_files_parent'
                           ' ON files(parent)')
+            self.file_db_mem = memdb    # readers switch over to the complete copy
+            self.memchanges = set()
+
+    def sync_db_to_memory(self):
+        '''apply the rows that changed since the last sync to the in-memory
+        copy of the files table. Too many changes, or unknown ones, cause a
+        new copy to be loaded instead.'''
+        if not self.file_db_in_memory():
+            return
+        changes, self.memchanges = self.memchanges, set()
+        if changes is None or len(changes) > MEMORYSYNCMAXROWS:
+            self.load_db_to_memory()
+        elif changes:
+            self.file_db_mem.sync(self.conn, changes)
+
+    def reload_searchindex(self):
+        '''bring the in-memory search index, if any, back in sync with the
+        database, e.g. after a rollback.'''
+        if self.searchindex is not None:
+            self.searchindex.load(self.conn)
+
+    def searchindex_writer(self):
+        '''where changes to the in-memory search index go: the changes
+        collected by a running update, which are merged when it ends, or
+        else the index itself.'''
+        if self.searchchanges is not None:
+            return self.searchchanges
+        return self.searchindex
+
+    @property
+    def generation(self):
+        '''changes whenever the content of the media database might have
+        changed. It is kept in the database, so changes made by other
+        processes working on the same database count, too.'''
+        return self.connections.reader().execute(
+            'SELECT generation FROM library').fetchone()[0]
+
+    def bump_generation(self):
+        '''signal that the content of the media database has changed. Must be
+        called after the changes are committed.'''
+        with self.connections.writing() as conn:
+            with conn:
+                conn.execute('UPDATE library SET generation = generation + 1')
+
+    def rollback_caches(self):
+        '''discard or resync everything cached from uncommitted changes after
+        a rollback.'''
+        if self.wordidcache is not None:
+            self.wordidcache.clear()
+        if self.dirstamps is not None:
+            del self.dirstamps[:]   # might belong to rolled back content
+        if self.searchchanges is not None:
+            self.searchchanges = IndexChanges()
+        self.reload_searchindex()
 
     @classmethod
     def searchterms(cls, searchterm):
@@ -105,47 +409,55 @@ class SQLiteCache(object):
             words += unidecoded
         return set(words)
 
-    def fetchFileIds(self, terms, maxFileIdsPerTerm, mode):
-        """returns list of ids each packed in a tuple containing the id"""
+    @classmethod
+    def wordrange(cls, term):
+        """returns an SQL condition matching all dictionary words starting with
+        term, and a tuple of its parameters"""
+        tprefix, tlast = term[:-1], term[-1]
+        if sys.maxunicode <= ord(tlast):
+            return ''' dictionary.word LIKE ? ''', (term + '%',)
+        return ''' (dictionary.word >= ? AND dictionary.word < ?) ''', (term, tprefix + chr(1 + ord(tlast)))
+
+    def fetchRankedFileIds(self, terms, maxFileIdsPerTerm, maxresults):
+        """returns a list of up to maxresults file ids matching the terms,
+        ranked by their number of matches. Resolves all terms in a single
+        query; each term contributes at most maxFileIdsPerTerm matches."""
 
         assert '' not in terms, _("terms must not contain ''")
-        resultlist = []
+        if not terms:
+            return []
 
+        termqueries = []
+        params = []
         for term in terms:
-            tprefix, tlast = term[:-1], term[-1]
-            query = '''SELECT search.frowid FROM dictionary JOIN search ON search.drowid = dictionary.rowid WHERE '''
-            if sys.maxunicode <= ord(tlast):
-                where = ''' dictionary.word LIKE ? '''
-                params = (term + '%',)
-            else:
-                where = ''' (dictionary.word >= ? AND dictionary.word < ?) '''
-                params = (term, tprefix + chr(1 + ord(tlast)))
-            order = ' ORDER BY dictionary.occurrences ASC '
-            limit = ' LIMIT 0, ' + str(maxFileIdsPerTerm) #TODO add maximum db results as configuration parameter
-            sql = query + where + order +limit
-            if debug:
-                log.d('Search term: %r', term)
-                log.d('Query used: %r, %r', sql, params)
-            #print(self.conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall())
-            self.db.execute(sql, params)
-            resultlist += self.db.fetchall()
-        return resultlist
+            where, whereparams = self.wordrange(term)
+            termqueries.append('''SELECT frowid FROM (
+                SELECT search.frowid FROM dictionary JOIN search ON search.drowid = dictionary.rowid
+                WHERE ''' + where + ''' ORDER BY dictionary.occurrences ASC LIMIT 0, ?)''')
+            params += whereparams + (maxFileIdsPerTerm,)
+        sql = ('SELECT frowid FROM (' + ' UNION ALL '.join(termqueries) + ')'
+               ' GROUP BY frowid ORDER BY count(*) DESC LIMIT 0, ?')
+        params.append(maxresults)
+        if debug:
+            log.d('Query used: %r, %r', sql, params)
+        return [row[0] for row in self.connections.reader().execute(sql, params)]
 
-    def searchfor(self, value, maxresults=10):
-        mode = 'normal'
+    @classmethod
+    def searchmode(cls, value):
+        '''splits a search string into its search mode ('normal', 'fileonly'
+        or 'dironly') and the actual search value'''
         if value.startswith('!f '):
-            mode = 'fileonly'
-            value = value[3:]
+            return 'fileonly', value[3:]
         elif value.endswith(' !f'):
-            mode = 'fileonly'
-            value = value[:-3]
+            return 'fileonly', value[:-3]
         elif value.startswith('!d '):
-            mode = 'dironly'
-            value = value[3:]
+            return 'dironly', value[3:]
         elif value.endswith(' !d'):
-            mode = 'dironly'
-            value = value[:-3]
+            return 'dironly', value[:-3]
+        return 'normal', value
 
+    def searchfor(self, value, maxresults=10):
+        mode, value = SQLiteCache.searchmode(value)
         terms = SQLiteCache.searchterms(value)
         with Performance(_('searching for a maximum of %s files') % str(NORMAL_FILE_SEARCH_LIMIT * len(terms))):
             if debug:
@@ -155,21 +467,14 @@ class SQLiteCache(object):
 
             maxFileIdsPerTerm = NORMAL_FILE_SEARCH_LIMIT
             with Performance(_('file id fetching')):
-                #unpack tuples
-                fileids = [t[0] for t in self.fetchFileIds(terms, maxFileIdsPerTerm, mode)]
-
-            if len(fileids) > NORMAL_FILE_SEARCH_LIMIT:
-                with Performance(_('sorting results by fileid occurrences')):
-                    resultfileids = {}
-                    for fileid in fileids:
-                        if fileid in resultfileids:
-                            resultfileids[fileid] += 1
-                        else:
-                            resultfileids[fileid] = 1
-                    # sort items by occurrences and only return maxresults
-                    fileids = sorted(resultfileids.items(), key=itemgetter(1), reverse=True)
-                    fileids = [t[0] for t in fileids]
-                    fileids = fileids[:min(len(fileids), NORMAL_FILE_SEARCH_LIMIT)]
+                if self.fts:
+                    fileids = self.fetchFtsFileIds(terms, NORMAL_FILE_SEARCH_LIMIT)
+                elif self.searchindex is not None:
+                    fileids = self.searchindex.fileids(
+                        terms, maxFileIdsPerTerm, NORMAL_FILE_SEARCH_LIMIT)
+                else:
+                    fileids = self.fetchRankedFileIds(
+                        terms, maxFileIdsPerTerm, NORMAL_FILE_SEARCH_LIMIT)
 
             if mode == 'normal':
                 with Performance(_('querying fullpaths for %s fileIds') % len(fileids)):
@@ -183,100 +488,263 @@ class SQLiteCache(object):
                 log.d(results)
             return results
 
-    def listdir(self, path):
+    def _listdirtarget(self, path):
         basedir = cherry.config['media.basedir']
         targetpath = os.path.join(basedir, path)
         targetdir = self.db_find_file_by_path(targetpath)
         if targetdir is None:
             log.e(_('media cache cannot listdir %r: path not in database'), path)
+        return targetdir
+
+    @staticmethod
+    def _listdirwhere(parent, isdir, low, high, playable=None, key='namekey'):
+        '''returns the SQL condition and arguments for the entries of a
+        directory with name keys (or another key column) from low to high,
+        in a form that lets SQLite find them with a single index seek'''
+        where = 'parent = ? AND isdir = ? AND {0} >= ?'.format(key)
+        args = [parent, int(isdir), low]
+        if high is not None:
+            where += ' AND {0} < ?'.format(key)
+            args.append(high)
+        if playable is not None and not isdir:
+            where += ' AND lower(filetype) IN (%s)' % ', '.join('?' * len(playable))
+            args += playable
+        return where, args
+
+    @staticmethod
+    def _direntry(row, formats):
+        name, ext, isdir, sortkey = row
+        return DirEntry(name + ext, bool(isdir),
+                        not isdir and (formats is None or ext.lower() in formats),
+                        sortkey)
+
+    def listdir(self, path, formats=None, dirsfirst=True, prefix='', hidden=True,
+                offset=0, limit=None, playableonly=False):
+        '''returns the content of a directory as DirEntry tuples in display
+        order, using nothing but the database: sorted naturally by their
+        stored sort keys, directories first unless ``dirsfirst`` is false.
+        Files are playable if their extension is one of ``formats``, or
+        always if no formats are given.
+
+        The listing can be narrowed down to names starting with ``prefix``
+        in upper case, and can leave out ``hidden`` names and, if
+        ``playableonly`` is set, files that are not playable. ``offset`` and
+        ``limit`` then select a window of what is left: only the rows inside
+        it are read from the database, one at a time while the returned
+        iterator is consumed.'''
+        targetdir = self._listdirtarget(path)
+        if targetdir is None:
+            return
+        if formats is not None:
+            formats = sorted(set('.' + f.lower() for f in formats))
+        playable = formats if playableonly else None
+        conn = self.connections.reader()
+        ranges = namekeyranges(prefix, hidden)
+        # without a prefix, the ranges only leave out hidden names, which
+        # are the same in sort key order: then the index of the display
+        # order finds them without sorting anything
+        key = 'namekey' if prefix else 'sortkey'
+        select = '''SELECT filename, coalesce(filetype, ''), isdir, sortkey
+                    FROM files WHERE '''
+        if dirsfirst:
+            # each part of the listing is a range of an index: count the
+            # parts before the window instead of reading them
+            listed = 0
+            for isdir in (True, False):
+                for low, high in ranges:
+                    if limit is not None and listed >= limit:
+                        break
+                    where, args = self._listdirwhere(targetdir.uid, isdir, low, high,
+                                                     playable, key)
+                    if offset:
+                        size = conn.execute('SELECT count(*) FROM files WHERE ' + where,
+                                            args).fetchone()[0]
+                        if size <= offset:
+                            offset -= size
+                            continue
+                    window = -1 if limit is None else limit - listed
+                    for row in conn.execute(
+                            select + where + ' ORDER BY sortkey, filename LIMIT ? OFFSET ?',
+                            args + [window, offset]):
+                        listed += 1
+                        yield self._direntry(row, formats)
+                    offset = 0
+        else:
+            conditions, args = [], []
+            for isdir in (True, False):
+                for low, high in ranges:
+                    where, whereargs = self._listdirwhere(targetdir.uid, isdir, low, high,
+                                                          playable, key)
+                    conditions.append('(%s)' % where)
+                    args += whereargs
+            rows = conn.execute(
+                select + ' OR '.join(conditions) + ' ORDER BY sortkey, filename LIMIT ? OFFSET ?',
+                args + [-1 if limit is None else limit, offset])
+            for row in rows:
+                yield self._direntry(row, formats)
+
+    def countdir(self, path, prefix='', hidden=True):
+        '''returns the number of entries :meth:`listdir` would return with
+        the same arguments, counted from ranges of the name key index'''
+        targetdir = self._listdirtarget(path)
+        if targetdir is None:
+            return 0
+        conn = self.connections.reader()
+        count = 0
+        for isdir in (True, False):
+            for low, high in namekeyranges(prefix, hidden):
+                where, args = self._listdirwhere(targetdir.uid, isdir, low, high)
+                count += conn.execute('SELECT count(*) FROM files WHERE ' + where,
+                                      args).fetchone()[0]
+        return count
+
+    def _seeknamekey(self, conn, parent, low, high, last=False):
+        '''returns the first or last name key from low to high in a
+        directory, together with the name it belongs to, as a tuple
+        ``(namekey, name)``; or None if there is none'''
+        found = []
+        for isdir in (True, False):
+            where, args = self._listdirwhere(parent, isdir, low, high)
+            row = conn.execute(
+                "SELECT namekey, filename || coalesce(filetype, '') FROM files WHERE " +
+                where + ' ORDER BY namekey %s LIMIT 1' % ('DESC' if last else 'ASC'),
+                args).fetchone()
+            if row is not None:
+                found.append(tuple(row))
+        if not found:
+            return None
+        return max(found) if last else min(found)
+
+    def listdir_groups(self, path, formats=None, prefix='', hidden=True):
+        '''groups the entries :meth:`listdir` would return by their names,
+        for a compact listing: each group stands for all names that start
+        with the same letters, one more than all of them have in common,
+        ignoring case. Returns the group labels in alphabetical order, each
+        taken from the first name in its group; names that are just the
+        common letters appear in place as DirEntry tuples.
+
+        Every group is found with a single seek in the name key index, so
+        this does not depend on the number of entries in the directory.'''
+        targetdir = self._listdirtarget(path)
+        if targetdir is None:
             return []
-        return list(map(lambda f: f.basename, self.fetch_child_files(targetdir)))
-
-    def randomFileEntries(self, count):
-        ''' Return a number of random entries from the file cache.
-
-            The actual number returned may be less than ``count`` if the
-            database does not contain enough entries or if randomization hits
-            directory entries or entries that have been deleted.
+        if formats is not None:
+            formats = sorted(set('.' + f.lower() for f in formats))
+        conn = self.connections.reader()
+        parent = targetdir.uid
+        ranges = namekeyranges(prefix, hidden)
+        firsts = [self._seeknamekey(conn, parent, low, high) for low, high in ranges]
+        lasts = [self._seeknamekey(conn, parent, low, high, last=True) for low, high in ranges]
+        firsts = [found[0] for found in firsts if found is not None]
+        lasts = [found[0] for found in lasts if found is not None]
+        if not firsts:
+            return []
+        # the keys are sorted, so the first and last one have the least in common
+        grouplength = len(os.path.commonprefix([firsts[0], lasts[-1]])) + 1
+        groups = []
+        for low, high in ranges:
+            found = self._seeknamekey(conn, parent, low, high)
+            while found is not None:
+                key, name = found
+                if len(key) < grouplength:
+                    rows = conn.execute(
+                        '''SELECT filename, coalesce(filetype, ''), isdir, sortkey
+                           FROM files WHERE parent = ? AND isdir IN (1, 0) AND namekey = ?
+                           ORDER BY isdir DESC, sortkey, filename''', (parent, key))
+                    groups += [self._direntry(row, formats) for row in rows]
+                    low = key + '\0'    # the next possible key
+                else:
+                    group = key[:grouplength]
+                    label = name[:grouplength]
+                    # upper case can change the length of some letters
+                    groups.append(label if label.upper() == group else group)
+                    low = prefixrange(group)[1]
+                found = self._seeknamekey(conn, parent, low, high)
+        return groups
+
+    def randomFileEntries(self, count, formats=None, subtree=None):
+        ''' Return a number of random files from the file cache, chosen with
+            equal probability among all files.
+
+            formats: a sequence of file extensions like ``('mp3', 'ogg')``
+                to choose only from files of those types.
+            subtree: a directory path relative to basedir, to choose only
+                from files below it. This reads the path index entries of
+                all files in that directory, but no others.
+
+            The number returned is less than ``count`` only if there are not
+            enough matching files.
         '''
         assert count >= 0
-        cursor = self.conn.cursor()
-        minId = cursor.execute('''SELECT _id FROM files ORDER BY _id ASC LIMIT 1;''').fetchone()
-        if minId is None:
-            return ()     # database is empty
-        minId = minId[0]
-        maxId = cursor.execute('''SELECT _id FROM files ORDER BY _id DESC LIMIT 1;''').fetchone()[0]
-
-        if sys.version_info < (3,):
-            genrange = xrange                   # use generator, not a large list
+        conn = self.connections.reader()
+        filetypes = None
+        if formats is not None:
+            filetypes = sorted(set('.' + f.lower().lstrip('.') for f in formats))
+        if subtree:
+            entries = self.randomSubtreeEntries(conn, count, filetypes, subtree)
         else:
-            genrange = range
-
-        if maxId - minId < count:
-            file_ids = genrange(minId, maxId + 1)
-        else:
-            # range generator pays off:
-            file_ids = random.sample(genrange(minId, maxId + 1), count)
-
-        entries = self.musicEntryFromFileIds(file_ids, mode='fileonly')
+            counts = conn.execute('SELECT filetype, tracks FROM trackcounts').fetchall()
+            if filetypes is not None:
+                counts = [(ft, n) for ft, n in counts if ft in filetypes]
+            ends = []       # position ranges of the file types, laid end to end
+            for filetype, n in counts:
+                ends.append(n + (ends[-1] if ends else 0))
+            total = ends[-1] if ends else 0
+            if sys.version_info < (3,):
+                genrange = xrange                   # use generator, not a large list
+            else:
+                genrange = range
+            picks = {}      # file type -> positions
+            for i in random.sample(genrange(total), min(count, total)):
+                typeindex = bisect_right(ends, i)
+                offset = ends[typeindex - 1] if typeindex else 0
+                picks.setdefault(counts[typeindex][0], []).append(i - offset + 1)
+            entries = []
+            for filetype, positions in picks.items():
+                for i in range(0, len(positions), MAXSQLPARAMS):
+                    chunk = positions[i:i + MAXSQLPARAMS]
+                    entries += [MusicEntry(path, dir=False) for (path,) in conn.execute(
+                        '''SELECT files.path FROM tracks JOIN files ON files._id = tracks.file
+                           WHERE tracks.filetype = ? AND tracks.pos IN ({0})'''.format(
+                               ', '.join('?' * len(chunk))),
+                        [filetype] + chunk)]
         random.shuffle(entries)
         return entries
 
-
-    def musicEntryFromFileIds(self, filerowids, incompleteMusicEntries=None, mode='normal'):
-        #incompleteMusicEntries maps db parentid to incomplete musicEntry
+    def randomSubtreeEntries(self, conn, count, filetypes, subtree):
+        '''random files below subtree, from a range of the path index'''
+        subtree = os.path.normpath(subtree).strip(os.path.sep)
+        prefix = subtree + os.path.sep
+        sql = 'SELECT path FROM files WHERE isdir = 0 AND path > ? AND path < ?'
+        params = [prefix, subtree + chr(ord(os.path.sep) + 1)]
+        if filetypes is not None:
+            sql += ' AND lower(filetype) IN ({0})'.format(', '.join('?' * len(filetypes)))
+            params += filetypes
+        sql += ' ORDER BY random() LIMIT ?'
+        params.append(count)
+        return [MusicEntry(path, dir=False) for (path,) in conn.execute(sql, params)]
+
+
+    def musicEntryFromFileIds(self, filerowids, mode='normal'):
+        '''returns MusicEntries for the given file ids, resolving all paths
+        in a single query.'''
         assert mode in ('normal', 'dironly', 'fileonly'), mode
-        if incompleteMusicEntries is None:
-            incompleteMusicEntries = {}
-        musicEntries = [] #result list
 
-        if self.file_db_in_memory():
-            db = self.file_db_mem.db
-        else:
-            db = self.conn
-
-        cursor = db.cursor()
-        sqlquery = '''  SELECT rowid, parent, filename, filetype, isdir
+        sqlquery = '''  SELECT path, isdir
                         FROM files WHERE rowid IN ({ids})'''.format(
                             ids=', '.join('?' * len(filerowids)))
         sqlparams = tuple(filerowids)
+        if mode != 'normal':
+            sqlquery += ' AND isdir = ?'
+            sqlparams += ('dironly' == mode,)
+        sqlquery += ' LIMIT 0, ?'
+        sqlparams += (NORMAL_FILE_SEARCH_LIMIT,)
 
-        if not incompleteMusicEntries:
-            #only filter 1st recursion level
-            if mode != 'normal':
-                sqlquery += ' AND isdir = ?'
-                sqlparams += ('dironly' == mode,)
-            sqlquery += ' LIMIT 0, ?'
-            sqlparams += (NORMAL_FILE_SEARCH_LIMIT,)
-
-        cursor.execute(sqlquery, sqlparams)
-        for id, parent_id, filename, fileext, isdir in cursor.fetchall():
-            path = filename + fileext
-            #check if fetched row is parent of existing entry
-            if id in incompleteMusicEntries:
-                #remove item and map to new parent id
-                entries = incompleteMusicEntries.pop(id)
-                for entry in entries:
-                    entry.path = os.path.join(path, entry.path)
-            else:
-                #id is not parent of any entry, so make a new one
-                entries = [MusicEntry(path, dir=bool(isdir))]
-
-            if parent_id == -1:
-                #put entries in result list if they've reached top level
-                musicEntries += entries
-            else:
-                #otherwise map parent id to dict
-                incompleteMusicEntries[parent_id] = incompleteMusicEntries.get(parent_id,[]) + entries
-
-        if incompleteMusicEntries:
-            #recurse for all incomplete entries
-            musicEntries += self.musicEntryFromFileIds(
-                                incompleteMusicEntries.keys(),
-                                incompleteMusicEntries = incompleteMusicEntries,
-                                mode = mode
-                            )
-        return musicEntries
+        if self.file_db_in_memory():
+            rows = self.file_db_mem.execute(sqlquery, sqlparams)
+        else:
+            rows = self.connections.reader().execute(sqlquery, sqlparams)
+        return [MusicEntry(path, dir=bool(isdir)) for path, isdir in rows]
 
     def register_file_with_db(self, fileobj):
         """add data in File object to relevant tables in media database"""
@@ -284,149 +752,184 @@ class SQLiteCache(object):
             self.add_to_file_table(fileobj)
             word_ids = self.add_to_dictionary_table(fileobj.name)
             self.add_to_search_table(fileobj.uid, word_ids)
+            if self.searchindex is not None:
+                self.searchindex_writer().add(fileobj.uid, SQLiteCache.searchterms(fileobj.name))
+            if self.fts:
+                self.add_to_fts_table(fileobj)
             return fileobj
         except UnicodeEncodeError as e:
             log.e(_("wrong encoding for filename '%s' (%s)"), fileobj.relpath, e.__class__.__name__)
 
 
     def add_to_file_table(self, fileobj):
-        cursor = self.conn.execute('INSERT INTO files (parent, filename, filetype, isdir) VALUES (?,?,?,?)', (fileobj.parent.uid if fileobj.parent else -1, fileobj.name, fileobj.ext, 1 if fileobj.isdir else 0))
+        parent_id = fileobj.parent.uid if fileobj.parent else -1
+        basename = fileobj.name + fileobj.ext
+        cursor = self.conn.execute('''INSERT INTO files (parent, filename, filetype, isdir, sortkey, namekey, path)
+            VALUES (?, ?, ?, ?, ?, ?, coalesce((SELECT path || ? FROM files WHERE _id = ?), '') || ?)''',
+            (parent_id, fileobj.name, fileobj.ext, 1 if fileobj.isdir else 0,
+             CherryModel.fileSortFunc(basename), CherryModel.fileNameKey(basename),
+             os.path.sep, parent_id, basename))
         rowid = cursor.lastrowid
         fileobj.uid = rowid
+        if self.memchanges is not None:
+            self.memchanges.add(rowid)
         return fileobj
 
 
+    def add_to_fts_table(self, fileobj):
+        (path,) = self.conn.execute('SELECT path FROM files WHERE _id = ?',
+                                    (fileobj.uid,)).fetchone()
+        self.conn.execute('INSERT INTO files_fts(rowid, name, path) VALUES (?, ?, ?)',
+                          (fileobj.uid, SQLiteCache.ftstext(fileobj.name),
+                           SQLiteCache.ftstext(os.path.dirname(path))))
+
+
     def add_to_dictionary_table(self, filename):
+        '''returns the dictionary ids of all search words in filename, adding
+        missing words to the dictionary. Ids are looked up in the word id
+        cache first, if one is active; the rest is fetched and inserted in
+        batches.'''
+        cache = self.wordidcache
         word_ids = []
-        for word in set(SQLiteCache.searchterms(filename)):
-            wordrowid = self.conn.execute('''SELECT rowid FROM dictionary WHERE word = ? LIMIT 0,1''', (word,)).fetchone()
+        missing = []
+        for word in SQLiteCache.searchterms(filename):
+            wordrowid = None if cache is None else cache.get(word)
             if wordrowid is None:
-                wordrowid = self.conn.execute('''INSERT INTO dictionary (word) VALUES (?)''', (word,)).lastrowid
+                missing.append(word)
             else:
-                wordrowid = wordrowid[0]
-            word_ids.append(wordrowid)
+                word_ids.append(wordrowid)
+        if missing:
+            found = self.fetch_word_ids(missing)
+            new = [word for word in missing if word not in found]
+            if new:
+                # occurrences are counted by a trigger on the search table
+                self.conn.executemany('''INSERT INTO dictionary (word, occurrences) VALUES (?, 0)''',
+                                      ((word,) for word in new))
+                found.update(self.fetch_word_ids(new))
+            for word in missing:
+                word_ids.append(found[word])
+                if cache is not None:
+                    cache.put(word, found[word])
         return word_ids
 
 
+    def fetch_word_ids(self, words):
+        '''returns a dict mapping those of the given words that are in the
+        dictionary to their ids'''
+        found = {}
+        words = list(words)
+        for i in range(0, len(words), MAXSQLPARAMS):
+            chunk = words[i:i + MAXSQLPARAMS]
+            query = 'SELECT word, rowid FROM dictionary WHERE word IN ({0})'.format(
+                ', '.join('?' * len(chunk)))
+            found.update(self.conn.execute(query, chunk))
+        return found
+
+
     def add_to_search_table(self, file_id, word_id_seq):
         self.conn.executemany('INSERT INTO search (drowid, frowid) VALUES (?,?)',
                               ((wid, file_id) for wid in word_id_seq))
 
 
+    @writes
     def remove_recursive(self, fileobj, progress=None):
-        '''recursively remove fileobj and all its children from the media db.'''
-
-
+        '''recursively remove fileobj and all its children from the media db.
+        returns the number of removed entries.'''
         if progress is None:
             log.i(
                   _('removing dead reference(s): %s "%s"'),
                   'directory' if fileobj.isdir else 'file',
                   fileobj.relpath,
                   )
-            factory = None
-            remove = lambda item: self.remove_file(item)
-        else:
-            def factory(new, pnt):
-                if pnt is None:
-                    return (new, None, progress)
-                return (new, pnt, pnt[2].spawnchild('[-] ' + new.relpath))
-            remove = lambda item: (self.remove_file(item[0]), item[2].tick())
-
-        deld = 0
         try:
             with self.conn:
-                for item in self.db_recursive_filelister(fileobj, factory):
-                    remove(item)
-                    deld += 1
+                deld = self.remove_subtree(fileobj, progress)
         except Exception as e:
             log.e(_('error while removing dead reference(s): %s'), e)
             log.e(_('rolled back to safe state.'))
+            self.rollback_caches()
             return 0
         else:
             return deld
-
-
-    def remove_file(self, fileobj):
-        '''removes a file entry from the db, which means removing:
-            - all search references,
-            - all dictionary words which were orphaned by this,
-            - the reference in the files table.'''
-        try:
-            dead_wordids = self.remove_from_search(fileobj.uid)
-            self.remove_all_from_dictionary(dead_wordids)
-            self.remove_from_files(fileobj.uid)
-        except Exception as exception:
-            log.ex(exception)
-            log.e(_('error removing entry for %s'), fileobj.relpath)
-            raise exception
-
-
-    def remove_from_search(self, fileid):
-        '''remove all references to the given fileid from the search table.
-        returns a list of all wordids which had their last search references
-        deleted during this operation.'''
-        foundlist = self.conn.execute(
-                            'SELECT drowid FROM search' \
-                            ' WHERE frowid=?', (fileid,)) \
-                            .fetchall()
-        wordset = set([t[0] for t in foundlist])
-
-        self.conn.execute('DELETE FROM search WHERE frowid=?', (fileid,))
-
-        for wid in set(wordset):
-            count = self.conn.execute('SELECT count(*) FROM search'
-                                      ' WHERE drowid=?', (wid,)) \
-                                      .fetchone()[0]
-            if count:
-                wordset.remove(wid)
-        return wordset
-
-
-    def remove_all_from_dictionary(self, wordids):
-        '''deletes all words with the given ids from the dictionary table'''
-        if not wordids:
-            return
-        args = list(zip(wordids))
-        self.conn.executemany('DELETE FROM dictionary WHERE rowid=(?)', args)
-
-
-    def remove_from_files(self, fileid):
-        '''deletes the given file id from the files table'''
-        self.conn.execute('DELETE FROM files WHERE rowid=?', (fileid,))
-
-
-    def db_recursive_filelister(self, fileobj, factory=None):
-        """generator: enumerates fileobj and children listed in the db as File
-        objects. each item is returned before children are fetched from db.
-        this means that fileobj gets bounced back as the first return value."""
-        if factory is None:
-            queue = deque((fileobj,))
-            while queue:
-                item = queue.popleft()
-                yield item
-                queue.extend(self.fetch_child_files(item))
-        else:
-            queue = deque((factory(fileobj, None),))
-            child = lambda parent: lambda item: factory(item, parent)
-            while queue:
-                item = queue.popleft()
-                yield item
-                queue.extend(map(child(item), self.fetch_child_files(item[0])))
+        finally:
+            self.bump_generation()
+
+
+    def remove_subtree(self, fileobj, progress=None):
+        '''remove fileobj and everything below it with a few set operations:
+        collect all ids of the subtree in a temporary table, delete their
+        search and file rows in batches of REMOVEBATCHSIZE, then remove the
+        words that were orphaned by this in one sweep.'''
+        conn = self.conn
+        conn.execute('DELETE FROM _tmp_removed')
+        conn.execute('DELETE FROM _tmp_wordids')
+        conn.execute('''INSERT INTO _tmp_removed(_id)
+            WITH RECURSIVE subtree(_id) AS (
+                SELECT ?
+                UNION ALL
+                SELECT files._id FROM files JOIN subtree ON files.parent = subtree._id
+            ) SELECT _id FROM subtree''', (fileobj.uid,))
+        total = conn.execute('SELECT count(*) FROM _tmp_removed').fetchone()[0]
+        if self.memchanges is not None:
+            self.memchanges.update(uid for (uid,) in conn.execute('SELECT _id FROM _tmp_removed'))
+        batch = 'SELECT _id FROM _tmp_removed WHERE _id > ? AND _id <= ?'
+        deld = 0
+        lastid = -1
+        while True:
+            upto = conn.execute('''SELECT max(_id) FROM (SELECT _id FROM _tmp_removed
+                WHERE _id > ? ORDER BY _id LIMIT ?)''', (lastid, REMOVEBATCHSIZE)).fetchone()[0]
+            if upto is None:
+                break
+            bounds = (lastid, upto)
+            if self.searchindex is not None:
+                for uid, name in conn.execute(
+                        'SELECT _id, filename FROM files WHERE _id IN (%s)' % batch, bounds):
+                    self.searchindex_writer().remove(uid, SQLiteCache.searchterms(name))
+            conn.execute('''INSERT OR IGNORE INTO _tmp_wordids(_id)
+                SELECT drowid FROM search WHERE frowid IN (%s)''' % batch, bounds)
+            conn.execute('DELETE FROM search WHERE frowid IN (%s)' % batch, bounds)
+            if self.fts:
+                conn.execute('DELETE FROM files_fts WHERE rowid IN (%s)' % batch, bounds)
+            deld += conn.execute('DELETE FROM files WHERE _id IN (%s)' % batch, bounds).rowcount
+            lastid = upto
+            if progress is not None:
+                progress.spawnchild('[-] %s (%d/%d)' % (fileobj.relpath, deld, total)).tick()
+        orphans = '''SELECT _id FROM _tmp_wordids WHERE NOT EXISTS (
+            SELECT 1 FROM search WHERE search.drowid = _tmp_wordids._id)'''
+        if self.wordidcache is not None:
+            for (word,) in conn.execute(
+                    'SELECT word FROM dictionary WHERE _id IN (%s)' % orphans):
+                self.wordidcache.pop(word)
+        conn.execute('DELETE FROM dictionary WHERE _id IN (%s)' % orphans)
+        if progress is not None:
+            progress.tick()
+        return deld
 
 
     def fetch_child_files(self, fileobj, sort=True, reverse=False):
         '''fetches from files table a list of all File objects that have the
         argument fileobj as their parent.'''
-        id_tuples = self.conn.execute(
-                            'SELECT rowid, filename, filetype, isdir' \
-                            ' FROM files where parent=?', (fileobj.uid,)) \
-                            .fetchall()
+        order = ''
         if sort:
-            id_tuples = sorted(id_tuples, key=lambda t: t[1], reverse=reverse)
-        return (File(name + ext,
-                     parent=fileobj,
-                     isdir=False if isdir == 0 else True,
-                     uid=uid) for uid, name, ext, isdir in id_tuples)
+            order = ' ORDER BY filename DESC' if reverse else ' ORDER BY filename'
+        id_tuples = self.connections.reader().execute(
+                            'SELECT rowid, filename, filetype, isdir, mtime, inode' \
+                            ' FROM files where parent=?' + order, (fileobj.uid,)) \
+                            .fetchall()
+        return (File.from_row(row, parent=fileobj) for row in id_tuples)
+
+
+    def fetch_child_file(self, fileobj, basename):
+        '''returns the child of fileobj with the given basename as a File
+        object, or None if there is no such child in the files table.'''
+        # name and extension are split like in File, but don't rely on it
+        name = os.path.splitext(basename)[0]
+        row = self.connections.reader().execute(
+            '''SELECT rowid, filename, filetype, isdir, mtime, inode FROM files
+               WHERE parent = ? AND filename IN (?, ?)
+               AND filename || coalesce(filetype, '') = ?''',
+            (fileobj.uid, basename, name, basename)).fetchone()
+        return None if row is None else File.from_row(row, parent=fileobj)
 
 
     def normalize_basedir(self):
@@ -439,21 +942,128 @@ class SQLiteCache(object):
 
 
     @util.timed
-    def full_update(self):
+    @writes
+    def full_update(self, deep=False):
         '''verify complete media database against the filesystem and make
-        necesary changes.'''
+        necesary changes.
+
+        Unless ``deep`` is set, the content of directories whose modification
+        time and inode have not changed since the last update is assumed to
+        be unchanged as well; only their subdirectories are checked.'''
 
         log.i(_('running full update...'))
+        if self.file_db_is_empty():
+            try:
+                self.bulk_build(cherry.config['media.basedir'])
+            except:
+                log.e(_('error during media update. database update incomplete.'))
+            else:
+                log.i(_('media database update complete.'))
+            return
         try:
-            self.update_db_recursive(cherry.config['media.basedir'], skipfirst=True)
+            self.update_db_recursive(cherry.config['media.basedir'], skipfirst=True, deep=deep)
         except:
             log.e(_('error during media update. database update incomplete.'))
         finally:
-            self.update_word_occurrences()
             log.i(_('media database update complete.'))
 
+    def file_db_is_empty(self):
+        return self.connections.reader().execute('SELECT 1 FROM files LIMIT 1').fetchone() is None
+
+    @writes
+    def bulk_build(self, basedir):
+        '''fill an empty media database with the content of basedir.
 
-    def partial_update(self, path, *paths):
+        Much faster than a regular update for large collections: words are
+        mapped to ids in memory, rows are written in large batches, and
+        indexes and triggers are only created once all rows are in place.
+        '''
+        log.i(_('building media database from scratch...'))
+        scanstart = time.time()
+        conn = self.conn
+        cursor = conn.cursor()
+        wordids = {}            # word -> [rowid, occurrences]
+        filerows = []
+        searchrows = []
+        dirstamps = []
+        added = 0
+        lister = DirectoryLister(sort=False)
+
+        def flush():
+            cursor.executemany('''INSERT INTO files (_id, parent, filename, filetype, isdir, sortkey, namekey, path)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', filerows)
+            cursor.executemany('INSERT INTO search (drowid, frowid) VALUES (?, ?)', searchrows)
+            del filerows[:]
+            del searchrows[:]
+
+        try:
+            with conn:
+                structures = cursor.execute(
+                    '''SELECT type, name FROM sqlite_master
+                       WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+                       AND tbl_name IN ('files', 'dictionary', 'search')''').fetchall()
+                for structtype, name in structures:
+                    cursor.execute('DROP {0} IF EXISTS {1}'.format(structtype.upper(), name))
+                cursor.execute('DELETE FROM dictionary')
+                cursor.execute('DELETE FROM search')
+
+                nextid = cursor.execute('SELECT coalesce(max(_id), 0) FROM files').fetchone()[0] + 1
+                stack = [(File(basedir), -1, '')]
+                while stack:
+                    parent, parent_id, parent_path = stack.pop()
+                    children = lister.children(parent)
+                    if parent_id != -1 and parent.stamp is not None:
+                        dirstamps.append((parent.stamp, parent))
+                    for fileobj in children:
+                        try:
+                            fileobj.basename.encode('utf-8')
+                        except UnicodeEncodeError as e:
+                            log.e(_("wrong encoding for filename '%s' (%s)"), fileobj.relpath, e.__class__.__name__)
+                            continue
+                        fileobj.uid = nextid
+                        nextid += 1
+                        path = parent_path + os.path.sep + fileobj.basename if parent_path else fileobj.basename
+                        filerows.append((fileobj.uid, parent_id, fileobj.name, fileobj.ext,
+                                         1 if fileobj.isdir else 0,
+                                         CherryModel.fileSortFunc(fileobj.basename),
+                                         CherryModel.fileNameKey(fileobj.basename), path))
+                        for word in SQLiteCache.searchterms(fileobj.name):
+                            wordid = wordids.get(word)
+                            if wordid is None:
+                                wordid = wordids[word] = [len(wordids) + 1, 0]
+                            wordid[1] += 1
+                            searchrows.append((wordid[0], fileobj.uid))
+                        if fileobj.isdir:
+                            stack.append((fileobj, fileobj.uid, path))
+                            lister.prefetch(fileobj)
+                        added += 1
+                        if len(filerows) == BULKINSERTINTERVAL:
+                            flush()
+                            log.i(_('%d files added...'), added)
+                flush()
+                self.rebuild_tracks()
+                self.save_dirstamps(dirstamps, scanstart)
+                cursor.executemany('INSERT INTO dictionary (_id, word, occurrences) VALUES (?, ?, ?)',
+                                   ((wid, word, count) for word, (wid, count) in wordids.items()))
+                if self.fts:
+                    self.rebuild_fts()
+        finally:
+            lister.close()
+            log.i(_('creating media database indexes...'))
+            conn.executescript(database.defs.get(DBNAME)[DBVERSION].get('after.sql', ''))
+            self.memchanges = None      # everything is new
+            self.sync_db_to_memory()
+            self.reload_searchindex()
+            self.bump_generation()
+        log.i(_('items added %d, removed %d'), added, 0)
+
+
+    @writes
+    def partial_update(self, path, *paths, **kwargs):
+        '''update the database for the given paths. The paths themselves
+        are always listed; with ``deep=False``, subdirectories that did not
+        change since the last update are skipped.'''
+        deep = kwargs.pop('deep', True)
         basedir = cherry.config['media.basedir']
         paths = (path,) + paths
         log.i(_('updating paths: %s') % (paths,))
@@ -466,15 +1076,18 @@ class SQLiteCache(object):
                 continue
             log.i(_('updating %r...') % path)
             try:
-                self.update_db_recursive(normpath, skipfirst=False)
+                self.update_db_recursive(normpath, skipfirst=False, deep=deep)
             except Exception as exception:
                 log.e(_('update incomplete: %r'), exception)
-        self.update_word_occurrences()
         log.i(_('done updating paths.'))
 
 
-    def update_db_recursive(self, fullpath, skipfirst=False):
-        '''recursively update the media database for a path in basedir'''
+    @writes
+    def update_db_recursive(self, fullpath, skipfirst=False, deep=True):
+        '''recursively update the media database for a path in basedir.
+
+        If ``deep`` is ``False``, skip the content of directories below
+        fullpath that have not changed since the last update.'''
 
         from collections import namedtuple
         Item = namedtuple('Item', 'infs indb parent progress')
@@ -490,8 +1103,14 @@ class SQLiteCache(object):
             return Item(fs, db, parent, progress)
 
         log.d(_('recursive update for %s'), fullpath)
-        generator = self.enumerate_fs_with_db(fullpath, itemfactory=factory)
+        scanstart = time.time()
+        self.dirstamps = []
+        generator = self.enumerate_fs_with_db(fullpath, itemfactory=factory,
+                                              deep=deep, dirstamps=self.dirstamps)
         skipfirst and generator.send(None)
+        self.wordidcache = util.LRUCache(WORDIDCACHESIZE)
+        if self.searchindex is not None:
+            self.searchchanges = IndexChanges()
         adds_without_commit = 0
         add = 0
         deld = 0
@@ -524,23 +1143,51 @@ class SQLiteCache(object):
                         add += adds_without_commit
                         adds_without_commit = 0
                     progress.tick()
+                self.save_dirstamps(self.dirstamps, scanstart)
         except Exception as exc:
             log.e(_("error while updating media: %s %s"), exc.__class__.__name__, exc)
             log.e(_("rollback to previous commit."))
             traceback.print_exc()
+            self.rollback_caches()
             raise exc
         finally:
             add += adds_without_commit
             log.i(_('items added %d, removed %d'), add, deld)
-            self.load_db_to_memory()
-
+            self.wordidcache = None
+            self.dirstamps = None
+            if self.searchchanges is not None:
+                self.searchindex.apply(self.searchchanges)
+                self.searchchanges = None
+            self.sync_db_to_memory()
+            self.bump_generation()
+
+    def save_dirstamps(self, dirstamps, scanstart):
+        '''record (stamp, fileobj) pairs of completely scanned directories.
+
+        A directory modified less than ``RACYSTAMPWINDOW`` seconds before
+        the scan started at ``scanstart`` may have changed again within the
+        same mtime tick after it was listed. Its stamp is cleared instead,
+        so it gets listed again next time.'''
+        if self.memchanges is not None:
+            self.memchanges.update(f.uid for _, f in dirstamps)
+        trusted = scanstart - RACYSTAMPWINDOW
+        self.conn.executemany('UPDATE files SET mtime = ?, inode = ? WHERE _id = ?',
+                              ((mtime, inode, f.uid) if mtime < trusted else (None, None, f.uid)
+                               for (mtime, inode), f in dirstamps))
+
+    @writes
     def update_word_occurrences(self):
+        '''recount how often each word occurs in the media database.
+
+        Triggers keep the counts up to date as search entries come and go, so
+        this is only needed to repair a database that got out of sync.'''
         log.i(_('updating word occurrences...'))
-        self.conn.execute('''UPDATE dictionary SET occurrences = (
-                select count(*) from search WHERE search.drowid = dictionary.rowid
-            )''')
+        with self.conn:
+            self.conn.execute('''UPDATE dictionary SET occurrences = (
+                    select count(*) from search WHERE search.drowid = dictionary.rowid
+                )''')
 
-    def enumerate_fs_with_db(self, startpath, itemfactory=None):
+    def enumerate_fs_with_db(self, startpath, itemfactory=None, deep=True, dirstamps=None):
         '''
         Starting at `startpath`, enumerates path items containing representations
         for each path as it exists in the filesystem and the database,
@@ -571,6 +1218,14 @@ class SQLiteCache(object):
             itemfactory(infs, indb, parent [, optional arguments])
 
         and must return an object satisfying the above requirements for an item.
+
+        If ``deep`` is ``False``, directories below `startpath` whose
+        database entry carries the same modification time and inode as the
+        filesystem are not listed. Their files are skipped, and their
+        subdirectories are returned as known from the database. When `dirstamps` is given,
+        ``(stamp, infs)`` pairs for all directories listed from the
+        filesystem are appended to it, to be recorded once the update is
+        done.
         '''
         from backport.collections import OrderedDict
         basedir = cherry.config['media.basedir']
@@ -598,22 +1253,43 @@ class SQLiteCache(object):
         dbobj = self.db_find_file_by_path(startpath)
         stack = deque()
         stack.append(Item(fsobj, dbobj, None))
-        while stack:
-            item = stack.pop()
-            yield item
-            dbchildren = {}
-            if item.indb:
-                dbchildren = OrderedDict((
-                                   (f.basename, f)
-                                   for f in self.fetch_child_files(item.indb)
-                                   ))
-            if item.infs and item.infs.isdir:
-                for fs_child in File.inputfilter(item.infs.children()):
-                    db_child = dbchildren.pop(fs_child.basename, None)
-                    stack.append(Item(fs_child, db_child, item))
-            for db_child in dbchildren.values():
-                stack.append(Item(None, db_child, item))
-            del dbchildren
+        with DirectoryLister() as lister:
+            while stack:
+                item = stack.pop()
+                yield item
+                dbchildren = {}
+                if item.indb:
+                    dbchildren = OrderedDict((
+                                       (f.basename, f)
+                                       for f in self.fetch_child_files(item.indb)
+                                       ))
+                if item.infs and item.infs.isdir:
+                    knownstamp = None
+                    if not deep and item.parent is not None and item.indb and item.indb.isdir:
+                        knownstamp = item.indb.stamp
+                    fs_children = lister.children(item.infs, knownstamp)
+                    if fs_children is None:
+                        # unchanged: only look for changes in subdirectories
+                        for db_child in dbchildren.values():
+                            if db_child.isdir:
+                                fs_child = File(db_child.basename, parent=item.infs, isdir=True)
+                                stack.append(Item(fs_child, db_child, item))
+                                lister.prefetch(fs_child, None if deep else db_child.stamp)
+                        dbchildren = {}
+                        fs_children = ()
+                    elif dirstamps is not None and item.infs.stamp is not None:
+                        dirstamps.append((item.infs.stamp, item.infs))
+                    for fs_child in fs_children:
+                        db_child = dbchildren.pop(fs_child.basename, None)
+                        stack.append(Item(fs_child, db_child, item))
+                        if fs_child.isdir:
+                            knownstamp = None
+                            if not deep and db_child and db_child.isdir:
+                                knownstamp = db_child.stamp
+                            lister.prefetch(fs_child, knownstamp)
+                for db_child in dbchildren.values():
+                    stack.append(Item(None, db_child, item))
+                del dbchildren
 
 
     def db_find_file_by_path(self, fullpath, create=False):
@@ -637,19 +1313,15 @@ class SQLiteCache(object):
 
         file = root
         for part in relpath.split(os.path.sep):
-            found = False
-            for child in self.fetch_child_files(file):  # gotta be ugly: don't know if name/ext split in db
-                if part == child.basename:
-                    found = True
-                    file = child
-                    break
-            if not found:
+            child = self.fetch_child_file(file, part)
+            if child is None:
                 if create:
-                    file = File(part, parent=file)
-                    log.i(_('creating database entry for %r'), file.relpath)
-                    self.register_file_with_db(file)
+                    child = File(part, parent=file)
+                    log.i(_('creating database entry for %r'), child.relpath)
+                    self.register_file_with_db(child)
                 else:
                     return None
+            file = child
         return file
 
 
@@ -665,12 +1337,25 @@ if sys.version_info < (3,):
             except UnicodeError:
                 log.e(_('unable to decode filename %r in %r; skipping.'),
                     name, dirname)
+    _scandir = None
 else:
     _unicode_listdir = os.listdir
+    try:
+        from os import scandir as _scandir
+    except ImportError:     # python < 3.5
+        try:
+            from scandir import scandir as _scandir
+        except ImportError:
+            _scandir = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 class File():
-    def __init__(self, path, parent=None, isdir=None, uid= -1):
+    def __init__(self, path, parent=None, isdir=None, uid= -1, stamp=None):
         assert isinstance(path, type('')), _('expecting unicode path, got %s') % type(path)
 
         if len(path) > 1:
@@ -686,11 +1371,25 @@ class File():
             self.basename = path
         self.uid = uid
         self.parent = parent
+        self.stamp = stamp      # directory (mtime, inode), if known
+        self._exists = None     # cached filesystem state, if known
+        self._islink = None
         if isdir is None:
             self.isdir = os.path.isdir(os.path.abspath(self.fullpath))
         else:
             self.isdir = isdir
 
+    @classmethod
+    def from_row(cls, row, parent):
+        '''make a File from a files table row of
+        ``(_id, filename, filetype, isdir, mtime, inode)``'''
+        uid, name, ext, isdir, mtime, inode = row
+        return cls(name + ext,
+                   parent=parent,
+                   isdir=False if isdir == 0 else True,
+                   uid=uid,
+                   stamp=None if mtime is None else (mtime, inode))
+
     def __str__(self):
         return self.fullpath
 
@@ -745,12 +1444,16 @@ class File():
     @property
     def exists(self):
         '''True if this file's fullpath exists in the filesystem'''
-        return os.path.exists(self.fullpath)
+        if self._exists is None:
+            return os.path.exists(self.fullpath)
+        return self._exists
 
     @property
     def islink(self):
         '''True if this file is a symbolic link'''
-        return os.path.islink(self.fullpath)
+        if self._islink is None:
+            return os.path.islink(self.fullpath)
+        return self._islink
 
     def children(self, sort=True, reverse=True):
         '''If self.isdir and self.exists, return an iterable of fileobjects
@@ -758,6 +1461,11 @@ class File():
         Otherwise, log an error and return ().
         '''
         try:
+            if _scandir is not None:
+                entries = list(_scandir(self.fullpath))
+                if sort:
+                    entries.sort(key=lambda entry: entry.name, reverse=reverse)
+                return (self._child_from_direntry(entry) for entry in entries)
             content = _unicode_listdir(self.fullpath)
             if sort:
                 content = sorted(content, reverse=reverse)
@@ -766,6 +1474,20 @@ class File():
             log.e(_('cannot list directory: %s'), error)
             return ()
 
+    def _child_from_direntry(self, entry):
+        '''make a child File from an os.scandir entry, reusing the file type
+        information it has cached instead of asking the filesystem again.'''
+        try:
+            isdir = entry.is_dir()
+            islink = entry.is_symlink()
+        except OSError:
+            return File(entry.name, parent=self)
+        child = File(entry.name, parent=self, isdir=isdir)
+        child._islink = islink
+        if not islink:
+            child._exists = True
+        return child
+
 
     @classmethod
     def inputfilter(cls, files_iter):
@@ -794,9 +1516,133 @@ class File():
                     continue
             yield f
 
+def dirstamp(path):
+    '''returns a (modification time, inode) tuple for path, or None if it
+    cannot be determined. Together, these change whenever entries are added
+    to or removed from a directory, or the directory itself is replaced.'''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_ino)
+
+
+class DirectoryLister(object):
+    '''Lists the content of directories as filtered File objects, using
+    worker threads to list directories before they are needed.
+
+    Call :meth:`prefetch` with directories that will be needed soon, and
+    :meth:`children` to get the content of a directory. A directory that
+    has not been prefetched, or whose listing has not been started yet,
+    is listed in the calling thread. Prefetching is skipped while
+    ``maxpending`` listings are waiting to be picked up, which bounds
+    memory use.
+
+    Newest prefetches are served first, to match depth-first traversal.
+    '''
+
+    def __init__(self, threads=LISTERTHREADS, maxpending=LISTERMAXPENDING,
+                 sort=True, reverse=True):
+        self.maxpending = maxpending
+        self.sort = sort
+        self.reverse = reverse
+        self._jobs = queue.LifoQueue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._workers = []
+        for i in range(threads):
+            worker = threading.Thread(target=self._work,
+                                      name='DirectoryLister-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, exception, traceback):
+        self.close()
+
+    def close(self):
+        '''stop all worker threads once they finish their current job'''
+        with self._lock:
+            self._pending.clear()
+        for _ in self._workers:
+            self._jobs.put(None)
+
+    def prefetch(self, fileobj, knownstamp=None):
+        with self._lock:
+            if fileobj in self._pending or len(self._pending) >= self.maxpending:
+                return
+            job = self._pending[fileobj] = _ListingJob(fileobj, knownstamp)
+        self._jobs.put(job)
+
+    def children(self, fileobj, knownstamp=None):
+        '''returns a list of the filtered content of fileobj, or ``None``
+        if the directory stamp matches ``knownstamp``. Sets
+        ``fileobj.stamp`` to the current stamp of the directory.'''
+        with self._lock:
+            job = self._pending.pop(fileobj, None)
+        if job is None or job.claim():
+            return self.listdir(fileobj, knownstamp)
+        return job.result()
+
+    def listdir(self, fileobj, knownstamp=None):
+        fileobj.stamp = dirstamp(fileobj.fullpath)
+        if knownstamp is not None and fileobj.stamp == knownstamp:
+            return None
+        return list(File.inputfilter(fileobj.children(sort=self.sort,
+                                                      reverse=self.reverse)))
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            if job.claim():
+                job.run(self.listdir)
+
+
+class _ListingJob(object):
+    '''A directory listing that is run at most once, by whoever claims it
+    first.'''
+
+    def __init__(self, fileobj, knownstamp=None):
+        self.fileobj = fileobj
+        self.knownstamp = knownstamp
+        self._claimed = False
+        self._claimlock = threading.Lock()
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def claim(self):
+        with self._claimlock:
+            if self._claimed:
+                return False
+            self._claimed = True
+            return True
+
+    def run(self, listdir):
+        try:
+            self._result = listdir(self.fileobj, self.knownstamp)
+        except Exception as error:
+            self._error = error
+        finally:
+            self._done.set()
+
+    def result(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
 class MemoryDB:
     def __init__(self, db_file, table_to_dump):
         log.i(_("Loading files database into memory..."))
+        self.table = table_to_dump
+        self.lock = threading.Lock()
         self.db = sqlite3.connect(':memory:', check_same_thread=False)
         cu = self.db.cursor()
         cu.execute('attach database "%s" as attached_db' % db_file)
@@ -809,4 +1655,29 @@ class MemoryDB:
         self.db.commit()
         cu.execute("detach database attached_db")
 
-
+    def execute(self, query, params=()):
+        '''returns all result rows of a query. Never sees a sync in progress.'''
+        with self.lock:
+            return self.db.execute(query, params).fetchall()
+
+    def sync(self, source, ids):
+        '''replace the rows with the given ids by their current state in
+        the source connection, in a single transaction'''
+        ids = sorted(ids)
+        select = 'SELECT * FROM {0} WHERE _id IN ({1})'
+        delete = 'DELETE FROM {0} WHERE _id IN ({1})'
+        rows = []
+        for i in range(0, len(ids), MAXSQLPARAMS):
+            chunk = ids[i:i + MAXSQLPARAMS]
+            rows += source.execute(select.format(self.table, ', '.join('?' * len(chunk))),
+                                   chunk).fetchall()
+        with self.lock:
+            with self.db:
+                for i in range(0, len(ids), MAXSQLPARAMS):
+                    chunk = ids[i:i + MAXSQLPARAMS]
+                    self.db.execute(delete.format(self.table, ', '.join('?' * len(chunk))),
+                                    chunk)
+                if rows:
+                    self.db.executemany('INSERT INTO {0} VALUES ({1})'.format(
+                        self.table, ', '.join('?' * len(rows[0]))), rows)
+        log.d(_('synced %d changed rows to memory'), len(ids))
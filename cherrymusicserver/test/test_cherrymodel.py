@@ -35,6 +35,7 @@ from mock import *
 from nose.tools import *
 
 from collections import defaultdict
+from os.path import commonprefix
 
 from cherrymusicserver import log
 log.setTest()
@@ -68,18 +69,176 @@ def test_hidden_names_listdir(cache, os):
     assert model.listdir('')
 
 
+@patch('cherrymusicserver.cherrymodel.cherry.config', cherryconfig({'browser.pure_database_lookup': True}))
+@patch('cherrymusicserver.cherrymodel.os')
+@patch('cherrymusicserver.cherrymodel.CherryModel.cache')
+def test_database_listdir_does_not_touch_filesystem(cache, os):
+    model = cherrymodel.CherryModel()
+    os.path.join = lambda *a: '/'.join(a)
+    os.path.relpath = lambda path, start: path.lstrip('/')
+    DirEntry = cherrymodel.DirEntry
+    cache.countdir.return_value = 4
+    cache.listdir.return_value = [      # comes sorted from the database
+        DirEntry('z', True, False, 'Z'),
+        DirEntry('2 a.mp3', False, True, '00002 A.MP3'),
+        DirEntry('10 b.mp3', False, True, '00010 B.MP3'),
+        DirEntry('cover.jpg', False, False, 'COVER.JPG'),
+    ]
+
+    entries = list(model.listdir('dir'))
+
+    eq_(['dir/z', 'dir/2 a.mp3', 'dir/10 b.mp3'], [e.path for e in entries])
+    eq_([True, False, False], [e.dir for e in entries])
+    eq_([], os.path.isfile.call_args_list)
+    eq_([], os.path.isdir.call_args_list)
+    eq_([], os.listdir.call_args_list)
+
+
+@patch('cherrymusicserver.cherrymodel.cherry.config', cherryconfig({'browser.pure_database_lookup': True}))
+@patch('cherrymusicserver.cherrymodel.os')
+@patch('cherrymusicserver.cherrymodel.CherryModel.cache')
+def test_database_listdir_stamp_is_library_generation(cache, os):
+    model = cherrymodel.CherryModel()
+    cache.generation = 3
+    eq_(3, model.listdirStamp('dir'))
+    cache.generation = 4
+    eq_(4, model.listdirStamp('dir'))
+    eq_([], os.stat.call_args_list)
+
+
+@patch('cherrymusicserver.cherrymodel.cherry.config', cherryconfig({'browser.maxshowfiles': 1}))
+@patch('cherrymusicserver.cherrymodel.os')
+@patch('cherrymusicserver.cherrymodel.isplayable', lambda _: True)
+def test_compact_listdir(os):
+    model = cherrymodel.CherryModel()
+    os.path.join = lambda *a: '/'.join(a)
+    os.path.relpath = lambda path, start: path.lstrip('/')
+    os.path.commonprefix = commonprefix
+    os.path.isfile = lambda path: not path.endswith('/Ab')
+    os.listdir.return_value = ['ab.mp3', 'Ab', 'b.mp3', '.hidden']
+
+    def listdir(*args, **kwargs):
+        return [e.repr if e.compact else e.path for e in model.listdir(*args, **kwargs)]
+
+    eq_(['A', 'b'], listdir('dir'))
+    eq_(['dir/Ab', 'ab.'], listdir('dir', 'a'))
+    eq_(['dir/ab.mp3'], listdir('dir', 'AB.'))
+    eq_(['dir/Ab', 'dir/ab.mp3', 'dir/b.mp3'], listdir('dir', limit=5))
+    eq_(['dir/b.mp3'], listdir('dir', offset=2, limit=1))
+
+
+@patch('cherrymusicserver.cherrymodel.cherry.config', cherryconfig({'browser.maxshowfiles': 10}))
+@patch('cherrymusicserver.cherrymodel.os')
+@patch('cherrymusicserver.cherrymodel.isplayable', lambda _: True)
+def test_compact_listdir_numbered_tracks(os):
+    model = cherrymodel.CherryModel()
+    os.path.join = lambda *a: '/'.join(a)
+    os.path.relpath = lambda path, start: path.lstrip('/')
+    os.path.commonprefix = commonprefix
+    os.path.isfile = lambda path: True
+    os.listdir.return_value = ['%d Track.mp3' % n for n in range(39, 0, -1)]
+
+    def listdir(*args, **kwargs):
+        return [e.repr if e.compact else e.path for e in model.listdir(*args, **kwargs)]
+
+    eq_(['1', '2', '3', '4', '5', '6', '7', '8', '9'], listdir('dir'))
+    eq_(['1 '] + ['1%d' % n for n in range(10)], listdir('dir', '1'))
+    eq_(['dir/1 Track.mp3'], listdir('dir', '1 '))
+    eq_(['dir/15 Track.mp3'], listdir('dir', '15'))
+
+
 @patch('cherrymusicserver.cherrymodel.cherry.config', cherryconfig({'search.maxresults': 10}))
 @patch('cherrymusicserver.cherrymodel.CherryModel.cache')
 @patch('cherrymusicserver.cherrymodel.cherrypy')
 def test_hidden_names_search(cherrypy, cache):
     model = cherrymodel.CherryModel()
 
+    cache.generation = 1
     cache.searchfor.return_value = [cherrymodel.MusicEntry('.hidden', dir=True)]
     assert not model.search('something')
 
+    cache.generation = 2
     cache.searchfor.return_value = [cherrymodel.MusicEntry('nothidden', dir=True)]
     assert model.search('something')
 
 
+@patch('cherrymusicserver.cherrymodel.cherry.config', cherryconfig({'search.maxresults': 10}))
+@patch('cherrymusicserver.cherrymodel.CherryModel.cache')
+@patch('cherrymusicserver.cherrymodel.cherrypy')
+def test_search_results_are_cached_per_generation(cherrypy, cache):
+    model = cherrymodel.CherryModel()
+    cache.generation = 1
+    cache.searchfor.return_value = [cherrymodel.MusicEntry('found', dir=True)]
+
+    eq_(['found'], [e.path for e in model.search('Some Thing')])
+    eq_(['found'], [e.path for e in model.search(' some thing ')])
+    eq_(1, cache.searchfor.call_count)
+    eq_(1, model.search_cache_stats()['hits'])
+
+    model.search('!f some thing')
+    eq_(2, cache.searchfor.call_count, 'search mode must be part of the key')
+
+    cache.generation = 2
+    model.search('some thing')
+    eq_(3, cache.searchfor.call_count, 'library changes must invalidate cache')
+
+
+@patch('cherrymusicserver.cherrymodel.cherry.config', cherryconfig({'search.maxresults': 10}))
+@patch('cherrymusicserver.cherrymodel.CherryModel.cache')
+@patch('cherrymusicserver.cherrymodel.cherrypy')
+def test_search_cache_keeps_word_order(cherrypy, cache):
+    model = cherrymodel.CherryModel()
+    cache.generation = 1
+    cache.searchfor.side_effect = lambda *args, **kwargs: [
+        cherrymodel.MusicEntry('x/me love', dir=True),
+        cherrymodel.MusicEntry('y/love me', dir=True)]
+
+    eq_('y/love me', model.search('love me')[0].path)
+    eq_('x/me love', model.search('me love')[0].path)
+    eq_(2, cache.searchfor.call_count, 'word order changes the ranking')
+
+
+@patch('cherrymusicserver.cherrymodel.cherry.config', cherryconfig({'search.maxresults': 10}))
+@patch('cherrymusicserver.cherrymodel.CherryModel.cache')
+@patch('cherrymusicserver.cherrymodel.cherrypy')
+@patch('cherrymusicserver.cherrymodel.resultorder.rank', lambda term, results, **kwargs: results)
+@patch('cherrymusicserver.cherrymodel.util.tweaks')
+def test_changed_result_order_tweaks_invalidate_cached_search(tweaks, cherrypy, cache):
+    model = cherrymodel.CherryModel()
+    cache.generation = 1
+    cache.searchfor.return_value = [cherrymodel.MusicEntry('found', dir=True)]
+    tweaks.return_value.CherryModelTweaks.result_order_debug = False
+    tweaks.return_value.ResultOrderTweaks = ('old weights',)
+    model.search('some thing')
+    model.search('some thing')
+    eq_(1, cache.searchfor.call_count)
+
+    tweaks.return_value.ResultOrderTweaks = ('new weights',)
+    model.search('some thing')
+    eq_(2, cache.searchfor.call_count, 'new weights must rank again')
+
+
+@patch('cherrymusicserver.cherrymodel.cherry.config', cherryconfig({'search.maxresults': 10}))
+@patch('cherrymusicserver.cherrymodel.CherryModel.cache')
+@patch('cherrymusicserver.cherrymodel.cherrypy')
+@patch('cherrymusicserver.cherrymodel.resultorder.rank', lambda term, results, **kwargs: results)
+@patch('cherrymusicserver.cherrymodel.util.tweaks')
+def test_debug_search_results_are_not_cached(tweaks, cherrypy, cache):
+    model = cherrymodel.CherryModel()
+    cache.generation = 1
+    cache.searchfor.return_value = [cherrymodel.MusicEntry('found', dir=True)]
+    tweaks.return_value.CherryModelTweaks.result_order_debug_files = 0
+    tweaks.return_value.CherryModelTweaks.result_order_debug = False
+    model.search('other')
+
+    tweaks.return_value.CherryModelTweaks.result_order_debug = True
+    model.search('some thing')
+    tweaks.return_value.CherryModelTweaks.result_order_debug = False
+    model.search('some thing')
+
+    eq_(3, cache.searchfor.call_count)
+    eq_(0, model.search_cache_stats()['hits'])
+
+
 if __name__ == '__main__':
     nose.runmodule()
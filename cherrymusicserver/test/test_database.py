@@ -87,7 +87,7 @@ class TestDefs(unittest.TestCase):
     def test_versionpermutations_are_updatable(self):
         def check(dbdef):
             "incremental updates must work for all versions"
-            start, stop = int(min(dbdef)), int(max(dbdef)) + 1
+            start, stop = int(min(dbdef, key=int)), int(max(dbdef, key=int)) + 1
             program = ((i, range(i + 1, stop)) for i in range(start, stop))
             for base, updates in program:
                 connector = MemConnector().bound(None)  # new MemConnector for fresh db
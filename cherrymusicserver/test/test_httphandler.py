@@ -240,6 +240,11 @@ class TestHTTPHandler(unittest.TestCase):
         session is used to authenticate the http request."""
         self.assertRaises(AttributeError, self.http.api, 'updatedb')
 
+    def test_api_getsearchcachestats(self):
+        """when attribute error is raised, this means that cherrypy
+        session is used to authenticate the http request."""
+        self.assertRaises(AttributeError, self.http.api, 'getsearchcachestats')
+
     def test_api_compactlistdir(self):
         """when attribute error is raised, this means that cherrypy
         session is used to authenticate the http request."""
@@ -296,6 +301,110 @@ class TestHTTPHandler(unittest.TestCase):
         session is used to authenticate the http request."""
         self.assertRaises(AttributeError, self.http.api, 'changeplaylist')
 
+    def test_api_listdir_window(self):
+        with patch('cherrymusicserver.httphandler.HTTPHandler.model') as model:
+            model.listdir.return_value = []
+            self.call_api('listdir', directory='dir', offset=200, limit=100)
+            model.listdir.assert_called_with('dir', offset=200, limit=100)
+            self.call_api('compactlistdir', directory='dir', filterstr='A', limit='5')
+            model.listdir.assert_called_with('dir', 'A', 0, 5)
+            self.assertRaises(httphandler.cherrypy.HTTPError,
+                              self.call_api, 'listdir', directory='dir', limit='many')
+
+    def test_api_listdir_streams_json(self):
+        entries = [MusicEntry('a', dir=True), MusicEntry('a/b.mp3')]
+        with patch('cherrymusicserver.httphandler.HTTPHandler.model') as model:
+            with patch('cherrymusicserver.httphandler.cherrypy.response') as response:
+                model.listdir.return_value = entries
+                body = self.call_api('listdir', directory='a')
+                self.assertTrue(response.stream)
+        expected = {'data': [e.to_dict() for e in entries]}
+        self.assertEqual(expected, json.loads(b''.join(body).decode('utf-8')))
+
+    def test_api_results_are_encoded_once(self):
+        info = {'artist': 'a', 'title': 't', 'length': 1}
+        config = cherry.config.replace({'media.basedir': '/'})
+        with patch('cherrymusicserver.httphandler.metainfo.getSongInfo') as getSongInfo:
+            getSongInfo.return_value.dict.return_value = info
+            with patch('cherrymusicserver.httphandler.cherry.config', config):
+                self.assertEqual({'data': info}, json.loads(self.call_api('getsonginfo', path='p')))
+
+            legacy = config.replace({'server.legacy_json_api': True})
+            with patch('cherrymusicserver.httphandler.cherry.config', legacy):
+                data = json.loads(self.call_api('getsonginfo', path='p'))['data']
+            self.assertEqual(info, json.loads(data))
+
+    def test_validate_cache(self):
+        with patch('cherrymusicserver.httphandler.cherrypy.request') as request:
+            with patch('cherrymusicserver.httphandler.cherrypy.response') as response:
+                response.headers = {}
+                request.method = 'GET'
+                request.headers = {}
+                self.http.validate_cache('v1', lastmodified=1000)
+                etag = response.headers['ETag']
+                self.assertEqual('private, no-cache', response.headers['Cache-Control'])
+
+                request.headers = {'If-None-Match': 'W/"other", ' + etag}
+                with self.assertRaises(httphandler.cherrypy.HTTPRedirect) as context:
+                    self.http.validate_cache('v1')
+                self.assertEqual(304, context.exception.status)
+                request.headers = {'If-None-Match': etag}
+                self.http.validate_cache('v2')      # changed
+                request.method = 'POST'
+                self.http.validate_cache('v1')      # never 304 for POST
+                request.method = 'GET'
+
+                request.headers = {'If-Modified-Since': response.headers['Last-Modified']}
+                self.assertRaises(httphandler.cherrypy.HTTPRedirect,
+                                  self.http.validate_cache, 'v1', lastmodified=1000)
+                self.http.validate_cache('v1', lastmodified=1001)
+
+    def test_api_listdir_not_modified(self):
+        with patch('cherrymusicserver.httphandler.HTTPHandler.model') as model:
+            with patch('cherrymusicserver.httphandler.cherrypy.request') as request:
+                with patch('cherrymusicserver.httphandler.cherrypy.response') as response:
+                    model.listdirStamp.return_value = 7
+                    response.headers = {}
+                    request.method = 'GET'
+                    request.headers = {}
+                    self.call_api('listdir', directory='dir')
+                    request.headers = {'If-None-Match': response.headers['ETag']}
+                    model.listdir.reset_mock()
+                    self.assertRaises(httphandler.cherrypy.HTTPRedirect,
+                                      self.call_api, 'listdir', directory='dir')
+                    self.assertFalse(model.listdir.called)
+
+    def test_api_fetchalbumart_revalidates(self):
+        config = {'media.basedir': '/', 'media.fetch_album_art': False}
+        with patch('cherrymusicserver.httphandler.cherry.config', config):
+            with patch('cherrymusicserver.httphandler.cherrypy') as cherrypy:
+                with patch('cherrymusicserver.httphandler.albumartfetcher.AlbumArtFetcher') as fetcher:
+                    with patch('cherrymusicserver.httphandler.os.path.getmtime', return_value=1000):
+                        with patch('cherrymusicserver.httphandler.os.path.exists', return_value=True):
+                            cherrypy.request.method = 'GET'
+                            cherrypy.request.headers = {}
+                            with patch.object(self.http, 'albumartcache_load', return_value=b'img'):
+                                cherrypy.response.headers = {}
+                                self.assertEqual(b'img', self.http.api_fetchalbumart('dir'))
+                                headers = cherrypy.response.headers
+                                self.assertEqual('private, no-cache', headers['Cache-Control'])
+                                self.assertTrue('ETag' in headers)
+
+                            fetcher.return_value.fetchLocal.return_value = (None, None, False)
+                            with patch.object(self.http, 'albumartcache_load', return_value=None):
+                                cherrypy.response.headers = {}
+                                self.http.api_fetchalbumart('dir')
+                                headers = cherrypy.response.headers
+                                self.assertEqual('no-store', headers['Cache-Control'])
+                                self.assertFalse('ETag' in headers)
+                                self.assertFalse('Last-Modified' in headers)
+
+    def test_jsonstream(self):
+        for items in ([], [1], ['a', {'b': None}, [2.5, '\u00fc']]):
+            chunks = list(httphandler.jsonstream(iter(items), chunksize=2))
+            self.assertEqual({'data': items}, json.loads(b''.join(chunks).decode('utf-8')))
+        self.assertEqual(3, len(list(httphandler.jsonstream(['xx', 'yy'], chunksize=2))))
+
     def test_api_userchangepassword(self):
         """when attribute error is raised, this means that cherrypy
         session is used to authenticate the http request."""
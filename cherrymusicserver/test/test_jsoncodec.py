@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+from __future__ import unicode_literals
+
+import json
+
+from nose.tools import *
+
+from cherrymusicserver import jsoncodec
+
+DATA = {'data': [1, 2.5, None, True, 'a/b', 'ü€', {'nested': []}]}
+
+
+def test_encodes_standard_json():
+    eq_(DATA, json.loads(jsoncodec.dumps(DATA)))
+    eq_(DATA, jsoncodec.loads(json.dumps(DATA)))
+
+
+def test_all_available_encoders_agree():
+    encoders = [jsoncodec._stdlib_dumps]
+    if jsoncodec.orjson is not None:
+        encoders.append(jsoncodec._orjson_dumps)
+    if jsoncodec.ujson is not None:
+        encoders.append(jsoncodec._ujson_dumps)
+    for dumps in encoders:
+        eq_(DATA, json.loads(dumps(DATA)), dumps)
+        eq_(2 ** 70, json.loads(dumps(2 ** 70)), dumps)
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+
+import nose
+
+from mock import *
+from nose.tools import *
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from cherrymusicserver import log
+log.setTest()
+
+from cherrymusicserver import mediawatcher
+from cherrymusicserver import service
+from cherrymusicserver.mediawatcher import MediaWatcher
+
+
+def setup_module():
+    global basedir
+    basedir = tempfile.mkdtemp(prefix='cherrymusic.test_mediawatcher.')
+    os.makedirs(os.path.join(basedir, 'artist', 'album'))
+
+
+def teardown_module():
+    shutil.rmtree(basedir)
+
+
+def test_coalesce_keeps_all_changed_directories_parents_first():
+    artist = os.path.join(basedir, 'artist')
+    album = os.path.join(artist, 'album')
+    eq_([artist, album], mediawatcher.coalesce([album, artist, album], basedir))
+    eq_([album], mediawatcher.coalesce([album], basedir))
+
+
+def test_coalesce_replaces_removed_directories_with_existing_ancestor():
+    gone = os.path.join(basedir, 'artist', 'gone', 'deeper')
+    eq_([os.path.join(basedir, 'artist')], mediawatcher.coalesce([gone], basedir))
+    eq_([basedir], mediawatcher.coalesce([os.path.join(basedir, 'nope')], basedir))
+
+
+def test_debounce():
+    watcher = MediaWatcher(basedir, delay=2, maxdelay=10)
+    ok_(not watcher.due())
+
+    watcher.mark(basedir)
+    first = watcher._lastevent
+    ok_(not watcher.due(first + 1))
+    ok_(watcher.due(first + 2))
+
+    watcher._lastevent = first + 9
+    ok_(not watcher.due(first + 9.5))
+    ok_(watcher.due(first + 10), 'must not wait forever while events keep coming')
+
+
+def test_flush_updates_changed_directories():
+    cache = Mock()
+    service.provide('filecache', cache)
+    watcher = MediaWatcher(basedir)
+    album = os.path.join(basedir, 'artist', 'album')
+
+    watcher.mark(album)
+    watcher.flush()
+    cache.partial_update.assert_called_with(album, deep=False)
+
+    cache.reset_mock()
+    watcher.mark(album)
+    watcher.mark(basedir)
+    watcher.flush()
+    cache.full_update.assert_called_with()
+    cache.partial_update.assert_called_with(album, deep=False)
+    ok_(not watcher.due())
+
+    cache.reset_mock()
+    watcher.mark(basedir)
+    watcher.flush()
+    cache.full_update.assert_called_with()
+    ok_(not cache.partial_update.called)
+
+
+class TestWatching(unittest.TestCase):
+
+    def setUp(self):
+        if not mediawatcher.is_available():
+            raise nose.SkipTest('inotify not available')
+        self.cache = Mock()
+        service.provide('filecache', self.cache)
+        self.watcher = MediaWatcher(basedir, delay=0.1)
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.stop()
+
+    def test_new_files_trigger_update(self):
+        newdir = os.path.join(basedir, 'artist', 'newalbum')
+        os.mkdir(newdir)
+        open(os.path.join(newdir, 'track.mp3'), 'w').close()
+        deadline = time.time() + 5
+        while not self.cache.partial_update.called and time.time() < deadline:
+            time.sleep(0.05)
+        # newalbum only shows up, too, if it was watched before track.mp3 appeared
+        args, kwargs = self.cache.partial_update.call_args
+        eq_(os.path.join(basedir, 'artist'), args[0])
+        ok_(set(args[1:]) <= set([newdir]), args)
+        eq_({'deep': False}, kwargs)
+        ok_(any(path == newdir for path in self.watcher._watches.values()),
+            'new directories must be watched')
+
+    def test_stop_releases_inotify(self):
+        inotify = self.watcher._inotify
+        self.watcher.stop()
+        eq_(-1, inotify.fd)
+        eq_({}, self.watcher._watches)
+        self.watcher.stop()     # stopping twice is harmless
+
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -86,6 +86,21 @@ def test_set_public():
 
     assert not get_playlist('some_title')['public']
 
+def test_iter_playlists_sorted_and_filtered_in_database():
+    pldb = PlaylistDB()
+    create_playlist('zz sorted', ['needle'])
+    create_playlist('aa sorted', ['hay'])
+    titles = [p['title'] for p in pldb.iterPlaylists(_DEFAULT_USERID, sortby='title')]
+    assert titles == sorted(titles), titles
+    titles = [p['title'] for p in pldb.iterPlaylists(_DEFAULT_USERID, 'needle')]
+    assert titles == ['zz sorted'], titles
+
+def test_iter_playlist_reads_tracks_in_order():
+    pl = create_playlist('iterated', ['one', 'two', 'three'])
+    tracks = PlaylistDB().iterPlaylist(pl['plid'], _DEFAULT_USERID)
+    assert ['one', 'two', 'three'] == [t.repr for t in tracks]
+    assert PlaylistDB().iterPlaylist(-1, _DEFAULT_USERID) is None
+
 
 if __name__ == '__main__':
     nose.runmodule()
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+import nose
+
+from nose.tools import *
+
+from cherrymusicserver import log
+log.setTest()
+
+from cherrymusicserver import resultorder
+from cherrymusicserver.cherrymodel import MusicEntry
+
+
+def test_rank_best_match_first():
+    results = [
+        MusicEntry('Other Band/Something Else.mp3'),
+        MusicEntry('Beatles/Abbey Road/05 Something.mp3'),
+        MusicEntry('Beatles/Abbey Road', dir=True),
+        MusicEntry('Beatles/Abbey Road/17 Her Majesty.mp3'),
+    ]
+    ranked = resultorder.rank('abbey road', results)
+    eq_('Beatles/Abbey Road', ranked[0].path)
+    eq_('Other Band/Something Else.mp3', ranked[-1].path)
+
+
+def test_rank_keeps_order_of_equal_scores():
+    results = [MusicEntry('a/x%d.mp3' % i) for i in range(5)]
+    eq_(results, resultorder.rank('x', results))
+
+
+def test_score_parts():
+    order = resultorder.ResultOrder('beatles', debug=True)
+    entry = MusicEntry('music/Beatles, The', dir=True)
+    eq_(
+        order.word_in_file_name_bonus + order.word_in_file_path_bonus
+        + order.perfect_match_bonus
+        + order.folder_bonus
+        + order.starts_with_bonus,
+        order.score(entry))
+    ok_('perfect_match_bias               %d' % order.perfect_match_bonus in entry.debugOutputSort)
+
+
+def test_score_ignores_track_number():
+    order = resultorder.ResultOrder('help')
+    with_number = MusicEntry('Beatles/Help/07 Help.mp3')
+    without_number = MusicEntry('Beatles/Help/Help.mp3')
+    eq_(order.score(without_number), order.score(with_number) + order.starts_with_bonus)
+
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2014 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+
+import nose
+
+from nose.tools import *
+
+from cherrymusicserver import log
+log.setTest()
+
+from cherrymusicserver.searchindex import IndexChanges, SearchIndex
+
+
+def test_finds_files_by_word_prefix():
+    index = SearchIndex()
+    index.add(1, ['abba', 'waterloo'])
+    index.add(2, ['abbey', 'road'])
+    index.add(3, ['waterfall'])
+
+    eq_([1], index.fileids(['abba'], 100, 100))
+    eq_(set([1, 2]), set(index.fileids(['abb'], 100, 100)))
+    eq_(set([1, 3]), set(index.fileids(['water'], 100, 100)))
+    eq_([], index.fileids(['zappa'], 100, 100))
+
+
+def test_ranks_files_by_number_of_matching_terms():
+    index = SearchIndex()
+    index.add(1, ['abbey'])
+    index.add(2, ['abbey', 'road'])
+    index.add(3, ['road'])
+
+    eq_(2, index.fileids(['abbey', 'road'], 100, 100)[0])
+    eq_([2], index.fileids(['abbey', 'road'], 100, 1))
+
+
+def test_prefers_rare_words_within_per_term_limit():
+    index = SearchIndex()
+    for fileid in range(10):
+        index.add(fileid, ['common'])
+    index.add(99, ['comet'])
+
+    eq_([99], index.fileids(['com'], 1, 100))
+
+
+def test_remove_drops_orphaned_words():
+    index = SearchIndex()
+    index.add(1, ['abba', 'gold'])
+    index.add(2, ['gold'])
+
+    index.remove(1, ['abba', 'gold'])
+
+    eq_(1, len(index))
+    eq_([], index.fileids(['abba'], 100, 100))
+    eq_([2], index.fileids(['gold'], 100, 100))
+
+
+def test_remove_unknown_file_is_harmless():
+    index = SearchIndex()
+    index.add(1, ['abba'])
+
+    index.remove(2, ['abba', 'unknown'])
+
+    eq_([1], index.fileids(['abba'], 100, 100))
+
+
+def test_apply_merges_collected_changes():
+    index = SearchIndex()
+    index.add(1, ['abba', 'gold'])
+    index.add(2, ['gold'])
+    changes = IndexChanges()
+    changes.add(3, ['abbey', 'zappa'])
+    changes.add(4, ['gold'])
+    changes.remove(1, ['abba', 'gold'])
+    changes.add(5, ['queen'])
+    changes.remove(5, ['queen'])
+
+    index.apply(changes)
+
+    eq_(['abbey', 'gold', 'zappa'], index._words)
+    eq_([3], index.fileids(['abb'], 100, 100))
+    eq_(set([2, 4]), set(index.fileids(['gold'], 100, 100)))
+    eq_([], index.fileids(['queen'], 100, 100))
+
+
+def test_apply_keeps_reused_file_ids():
+    index = SearchIndex()
+    index.add(1, ['old'])
+    changes = IndexChanges()
+    changes.remove(1, ['old'])
+    changes.add(1, ['old', 'new'])
+
+    index.apply(changes)
+
+    eq_([1], index.fileids(['old'], 100, 100))
+    eq_([1], index.fileids(['new'], 100, 100))
+
+
+if __name__ == '__main__':
+    nose.runmodule()
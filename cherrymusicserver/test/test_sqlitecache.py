@@ -33,13 +33,17 @@
 from __future__ import unicode_literals
 
 import unittest
+from mock import patch
 from nose.tools import *
+from nose import SkipTest
 
 import os
 import re
 import shutil
+import sqlite3
 import sys
 import tempfile
+import time
 
 import cherrymusicserver as cherry
 from cherrymusicserver import configuration
@@ -50,7 +54,8 @@ from cherrymusicserver import service
 
 sqlitecache.debug = True
 
-from cherrymusicserver.database.sql import MemConnector
+from cherrymusicserver.cherrymodel import CherryModel
+from cherrymusicserver.database.sql import MemConnector, TmpConnector
 
 log.setTest()
 
@@ -80,6 +85,10 @@ class TestFile(object):
     def exists(self):
         return os.path.exists(self.fullpath)
 
+    @property
+    def relpath(self):
+        return self.fullpath
+
 
     @classmethod
     def enumerate_files_in(cls, somewhere, sort):
@@ -216,6 +225,23 @@ class AddFilesToDatabaseTest(unittest.TestCase):
         self.assertTrue(len(idset) == 0, "there must not be more ids than unique words")
 
 
+    def test_add_to_dictionary_table_with_wordidcache(self):
+        from cherrymusicserver import util
+        self.Cache.wordidcache = util.LRUCache(100)
+        fileobj = self.Cache.register_file_with_db(TestFile('onlyword'))
+        cached_id = self.Cache.wordidcache.get('onlyword')
+
+        self.assertEqual([cached_id], self.Cache.add_to_dictionary_table('onlyword'))
+
+        self.Cache.remove_recursive(fileobj)
+        self.assertEqual(None, self.Cache.wordidcache.get('onlyword'),
+                         'words removed from dictionary must be removed from cache')
+
+        newid = self.Cache.add_to_dictionary_table('onlyword')[0]
+        found = self.Cache.conn.execute('SELECT rowid FROM dictionary WHERE word=?',
+                                        ('onlyword',)).fetchall()
+        self.assertEqual([(newid,)], found)
+
     def test_add_to_search_table(self):
         fileid = 99
         wordids = (13, 42)
@@ -245,6 +271,221 @@ class AddFilesToDatabaseTest(unittest.TestCase):
             self.assertTrue(filename in found, "all added files must be findable by cache search")
 
 
+    def test_db_find_file_by_path(self):
+        folder = TestFile('some.dir/', isdir=True)
+        self.Cache.register_file_with_db(folder)
+        for name in ('track.mp3', 'track', 'track.ogg'):
+            self.Cache.register_file_with_db(TestFile(name, parent=folder, isdir=False))
+
+        eq_(folder.uid, self.Cache.db_find_file_by_path('some.dir').uid)
+        for name in ('track.mp3', 'track', 'track.ogg'):
+            found = self.Cache.db_find_file_by_path(os.path.join('some.dir', name))
+            eq_(name, found.basename)
+            eq_(folder.uid, found.parent.uid)
+        eq_(None, self.Cache.db_find_file_by_path(os.path.join('some.dir', 'track.mp')))
+        eq_(None, self.Cache.db_find_file_by_path(os.path.join('some', 'track.mp3')))
+
+    def test_listdir(self):
+        folder = TestFile('folder/', isdir=True)
+        self.Cache.register_file_with_db(folder)
+        for name in ('b.mp3', 'a.TXT', 'c.d/'):
+            self.Cache.register_file_with_db(TestFile(name, parent=folder))
+
+        eq_([('c.d', True, False), ('a.TXT', False, False), ('b.mp3', False, True)],
+            [e[:3] for e in self.Cache.listdir('folder', formats=['mp3'])])
+        eq_([False, True, True], [e.playable for e in self.Cache.listdir('folder')])
+        eq_([], list(self.Cache.listdir('nosuchfolder')))
+
+    def test_listdir_in_natural_order(self):
+        folder = TestFile('folder/', isdir=True)
+        self.Cache.register_file_with_db(folder)
+        for name in ('10 ten.mp3', 'b/', '9 nine.mp3', 'A.mp3', 'a/'):
+            self.Cache.register_file_with_db(TestFile(name, parent=folder))
+
+        eq_(['a', 'b', '9 nine.mp3', '10 ten.mp3', 'A.mp3'],
+            [e.name for e in self.Cache.listdir('folder')])
+        eq_(['9 nine.mp3', '10 ten.mp3', 'a', 'A.mp3', 'b'],
+            [e.name for e in self.Cache.listdir('folder', dirsfirst=False)])
+
+    def test_listdir_window(self):
+        folder = TestFile('folder/', isdir=True)
+        self.Cache.register_file_with_db(folder)
+        for name in ('.hidden/', 'b/', 'a/', 'c.txt', 'd.mp3', 'ab.mp3', 'b.mp3'):
+            self.Cache.register_file_with_db(TestFile(name, parent=folder))
+
+        def listdir(**kwargs):
+            return [e.name for e in self.Cache.listdir('folder', formats=['mp3'], **kwargs)]
+
+        eq_(['.hidden', 'a', 'b', 'ab.mp3', 'b.mp3', 'c.txt', 'd.mp3'], listdir())
+        eq_(['a', 'b', 'ab.mp3', 'b.mp3', 'd.mp3'], listdir(hidden=False, playableonly=True))
+        eq_(['b', 'ab.mp3'], listdir(hidden=False, offset=1, limit=2))
+        eq_(['b.mp3', 'd.mp3'], listdir(hidden=False, offset=3, limit=5, playableonly=True))
+        eq_([], listdir(offset=7))
+        eq_(['a', 'ab.mp3'], listdir(prefix='A'))
+        eq_(['ab.mp3'], listdir(prefix='A', offset=1))
+        eq_(['a', 'ab.mp3', 'b'], listdir(hidden=False, dirsfirst=False, limit=3))
+
+        eq_(7, self.Cache.countdir('folder'))
+        eq_(6, self.Cache.countdir('folder', hidden=False))
+        eq_(2, self.Cache.countdir('folder', prefix='B'))
+        eq_(0, self.Cache.countdir('nosuchfolder'))
+
+    def test_listdir_groups(self):
+        folder = TestFile('folder/', isdir=True)
+        self.Cache.register_file_with_db(folder)
+        for name in ('.hidden', 'ab/', 'abc.mp3', 'abd.mp3', 'Acd.mp3', 'b.mp3', 'ba/'):
+            self.Cache.register_file_with_db(TestFile(name, parent=folder))
+
+        eq_(['a', 'b'], self.Cache.listdir_groups('folder', hidden=False))
+        eq_(['.', 'a', 'b'], self.Cache.listdir_groups('folder'))
+        groups = self.Cache.listdir_groups('folder', prefix='AB')
+        eq_([('ab', True, False, 'AB'), 'abc', 'abd'], groups)
+        eq_([('b.mp3', False, True, 'B.MP3')], self.Cache.listdir_groups('folder', prefix='B.'))
+        eq_([], self.Cache.listdir_groups('folder', prefix='C'))
+
+    def test_listdir_numbered_tracks(self):
+        folder = TestFile('folder/', isdir=True)
+        self.Cache.register_file_with_db(folder)
+        for number in range(1, 40):
+            self.Cache.register_file_with_db(TestFile('%d Track.mp3' % number, parent=folder))
+
+        eq_(['1', '2', '3', '4', '5', '6', '7', '8', '9'],
+            self.Cache.listdir_groups('folder', hidden=False))
+        eq_(['1 Track.mp3'] + ['%d Track.mp3' % n for n in range(10, 20)],
+            [e.name for e in self.Cache.listdir('folder', prefix='1')])
+        eq_(11, self.Cache.countdir('folder', prefix='1'))
+        eq_(['1 '] + ['1%d' % n for n in range(10)],
+            self.Cache.listdir_groups('folder', prefix='1'))
+        eq_(['12 Track.mp3', '13 Track.mp3'],
+            [e.name for e in self.Cache.listdir('folder', prefix='1', offset=3, limit=2)])
+
+    def test_listdir_seeks_index(self):
+        for key in ('sortkey', 'namekey'):
+            where, args = self.Cache._listdirwhere(1, True, 'A', 'B', key=key)
+            plan = self.Cache.conn.execute(
+                'EXPLAIN QUERY PLAN SELECT filename FROM files WHERE ' + where +
+                ' ORDER BY %s LIMIT 1' % key, args).fetchall()
+            plan = ' '.join(str(row) for row in plan)
+            ok_('SEARCH' in plan and 'idx_files_parent_isdir_' + key in plan, plan)
+            ok_('TEMP B-TREE' not in plan, plan)
+
+    def test_fill_in_missing_sortkeys(self):
+        self.Cache.register_file_with_db(TestFile('7 seven.mp3'))
+        self.Cache.conn.execute('UPDATE files SET sortkey = NULL, namekey = NULL')
+
+        self.Cache.fill_in_missing_sortkeys()
+
+        eq_([('00007 SEVEN.MP3', '7 SEVEN.MP3')],
+            self.Cache.conn.execute('SELECT sortkey, namekey FROM files').fetchall())
+
+    def test_db_find_file_by_path_uses_index(self):
+        plan = self.Cache.conn.execute(
+            '''EXPLAIN QUERY PLAN SELECT rowid FROM files
+               WHERE parent = ? AND filename IN (?, ?)
+               AND filename || coalesce(filetype, '') = ?''', (1, 'a.b', 'a', 'a.b')).fetchall()
+        ok_('idx_files_parent_filename_filetype' in ' '.join(str(row) for row in plan), plan)
+
+    def test_names_are_unique_per_directory(self):
+        self.Cache.conn.execute('''INSERT INTO files (parent, filename, filetype, isdir)
+                                   VALUES (-1, 'twice', '.mp3', 0)''')
+        assert_raises(sqlite3.IntegrityError, self.Cache.conn.execute,
+                      '''INSERT INTO files (parent, filename, filetype, isdir)
+                         VALUES (-1, 'twice', '.mp3', 0)''')
+
+    def test_schema_update_removes_duplicate_names(self):
+        dbdef = database.defs.get(sqlitecache.DBNAME)
+        conn = sqlite3.connect(':memory:')
+        conn.executescript(dbdef['1']['create.sql'] + dbdef['1']['after.sql'])
+        conn.executemany('''INSERT INTO files (_id, parent, filename, filetype, isdir)
+                            VALUES (?, ?, ?, ?, ?)''', [
+            (1, -1, 'dir', '', 1),
+            (2, -1, 'dir', '', 1),
+            (3, 2, 'below', '.mp3', 0),
+            (4, 1, 'song', '.mp3', 0),
+            (5, 1, 'song', '.ogg', 0),
+        ])
+        conn.executemany('INSERT INTO dictionary (_id, word) VALUES (?, ?)',
+                         [(1, 'below'), (2, 'song')])
+        conn.executemany('INSERT INTO search (drowid, frowid) VALUES (?, ?)',
+                         [(1, 3), (2, 4), (2, 5)])
+
+        conn.executescript(dbdef['2']['update.sql'] + dbdef['2']['after.sql'])
+
+        eq_([(1,), (4,), (5,)],
+            conn.execute('SELECT _id FROM files ORDER BY _id').fetchall())
+        eq_([(4,), (5,)], conn.execute('SELECT frowid FROM search ORDER BY frowid').fetchall())
+        eq_([('song', 2)], conn.execute('SELECT word, occurrences FROM dictionary').fetchall(),
+            'words of removed duplicates must go')
+
+
+    def test_fetchRankedFileIds(self):
+        both = TestFile('abbey road')
+        one = TestFile('abbey tavern')
+        none = TestFile('penny lane')
+        for fileobj in (one, both, none):
+            self.Cache.register_file_with_db(fileobj)
+
+        terms = sqlitecache.SQLiteCache.searchterms('abbey road')
+        ranked = self.Cache.fetchRankedFileIds(terms, 100, 100)
+
+        self.assertEqual([both.uid, one.uid], ranked,
+                         "files must be ranked by number of matching terms")
+        self.assertEqual([both.uid], self.Cache.fetchRankedFileIds(terms, 100, 1),
+                         "no more than maxresults ids must be returned")
+
+    def test_register_file_with_searchindex(self):
+        cherry.config = cherry.config.replace({'search.engine': 'memory'})
+        self.Cache = sqlitecache.SQLiteCache()
+        testnames = (
+                     'SUCHMICH',
+                     'findmich suchmich',
+                     'nichtmich',
+                     )
+
+        for filename in testnames:
+            self.Cache.register_file_with_db(TestFile(filename))
+
+        found = [entry.path for entry in self.Cache.searchfor('suchmich', 100)]
+        self.assertEqual(sorted(testnames[:2]), sorted(found),
+                         "in-memory search must find exactly the matching files")
+
+    def test_fts_search(self):
+        if not sqlitecache.SQLiteCache.fts5_available(self.Cache.conn):
+            raise SkipTest('sqlite3 lacks FTS5')
+        cherry.config = cherry.config.replace({'search.engine': 'fts5'})
+        self.Cache = sqlitecache.SQLiteCache()
+        beatles = self.Cache.register_file_with_db(TestFile('The Beatles' + os.path.sep))
+        both = TestFile('Abbey Road', parent=beatles)
+        one = TestFile('abbey tavern')
+        none = TestFile('penny lane', parent=beatles)
+        for fileobj in (one, both, none):
+            self.Cache.register_file_with_db(fileobj)
+
+        terms = sqlitecache.SQLiteCache.searchterms('abbey ro')
+        self.assertEqual([both.uid, one.uid], self.Cache.fetchFtsFileIds(terms, 100),
+                         "files must be ranked by relevance")
+        terms = sqlitecache.SQLiteCache.searchterms('beat penny')
+        self.assertEqual(none.uid, self.Cache.fetchFtsFileIds(terms, 100)[0],
+                         "directory names must be searchable")
+
+        terms = sqlitecache.SQLiteCache.searchterms('abbey ro')
+
+        self.Cache.remove_subtree(beatles)
+        self.assertEqual([one.uid], self.Cache.fetchFtsFileIds(terms, 100))
+
+    def test_fts_falls_back_to_database(self):
+        cherry.config = cherry.config.replace({'search.engine': 'fts5'})
+        fts5_available = sqlitecache.SQLiteCache.fts5_available
+        sqlitecache.SQLiteCache.fts5_available = classmethod(lambda cls, conn: False)
+        try:
+            self.Cache = sqlitecache.SQLiteCache()
+        finally:
+            sqlitecache.SQLiteCache.fts5_available = fts5_available
+        self.Cache.register_file_with_db(TestFile('findme'))
+        self.assertFalse(self.Cache.fts)
+        self.assertEqual(['findme'], [e.path for e in self.Cache.searchfor('find', 100)])
+
+
 
 
 class FileTest(unittest.TestCase):
@@ -287,6 +528,22 @@ class FileTest(unittest.TestCase):
             self.assertFilesEqual(expected, actual)
 
 
+    def testDirectoryListerMatchesChildren(self):
+        cherry.config = configuration.from_defaults()
+        cherry.config = cherry.config.replace({'media.basedir': tmpdir})
+        root = sqlitecache.File(os.path.join(tmpdir, self.testdir))
+        firstdir = sqlitecache.File('firstdir', parent=root)
+        seconddir = sqlitecache.File('seconddir', parent=firstdir)
+        expected = lambda f: [(c.basename, c.isdir) for c in f.children()]
+
+        with sqlitecache.DirectoryLister(threads=2) as lister:
+            lister.prefetch(firstdir)
+            lister.prefetch(seconddir)
+            for fileobj in (root, firstdir, seconddir):
+                listed = [(c.basename, c.isdir) for c in lister.children(fileobj)]
+                self.assertEqual(expected(fileobj), listed)
+
+
 class RemoveFilesFromDatabaseTest(unittest.TestCase):
 
     testdirname = 'deltest'
@@ -456,6 +713,27 @@ class RemoveFilesFromDatabaseTest(unittest.TestCase):
         self.assertEqual(1, common,
                          'words still referenced elsewhere must not be removed')
 
+    def testRemoveRecursiveInBatches(self):
+        removelist = self.get_fileobjects_for('root_dir')
+        progress = sqlitecache.ProgressTree('root_dir')
+        batchsize = sqlitecache.REMOVEBATCHSIZE
+        sqlitecache.REMOVEBATCHSIZE = 2
+        try:
+            deld = self.Cache.remove_recursive(self.fileobjects['root_dir'], progress)
+        finally:
+            sqlitecache.REMOVEBATCHSIZE = batchsize
+
+        self.assertEqual(len(removelist), deld)
+        for fob in removelist:
+            self.assertFalse(self.fileid_in_db(fob.uid),
+                        'all children entries from removed dir must be removed')
+        self.assertEqual(1.0, progress.completeness)
+        words = [w for (w,) in self.Cache.conn.execute('SELECT word FROM dictionary')]
+        self.assertTrue('root' in words and 'file' in words,
+                        'words still referenced elsewhere must not be removed')
+        self.assertFalse('dir' in words or 'first' in words,
+                         'orphaned words must be removed')
+
     def testRollbackOnException(self):
 
         class BoobytrappedConnector(MemConnector):
@@ -471,9 +749,12 @@ class RemoveFilesFromDatabaseTest(unittest.TestCase):
             def __execute(connector, stmt, *parameters):
                 '''triggers an Exception when the 'undeletable' item should be
                 removed. relies on way too much knowledge of Cache internals. :(
+                (deletes from files are parameterized by a single id, or the
+                bounds of an id range)
                 '''
-                if stmt.lower().startswith('delete from files') \
-                  and parameters[0][0] == undeletable.uid:
+                params = parameters[0] if parameters else ()
+                if stmt.lower().startswith('delete from files') and params \
+                  and min(params) <= undeletable.uid <= max(params):
                     connector.exceptcount += 1
                     raise Exception("boom goes the dynamite")
                 return super(
@@ -515,6 +796,112 @@ class RemoveFilesFromDatabaseTest(unittest.TestCase):
                         'complete rollback must restore all deleted entries.')
 
 
+class ConnectionsTest(unittest.TestCase):
+
+    testdirname = 'connections'
+
+    def setUp(self):
+        self.testdir = getAbsPath(self.testdirname)
+        setupTestfiles(self.testdir, ('some.mp3',))
+        cherry.config = configuration.from_defaults()
+        cherry.config = cherry.config.replace({'media.basedir': self.testdir})
+        service.provide('dbconnector', TmpConnector)
+        database.ensure_current_version(sqlitecache.DBNAME, autoconsent=True)
+        self.Cache = sqlitecache.SQLiteCache()
+        self.Cache.full_update()
+
+    def tearDown(self):
+        removeTestfiles(self.testdir, ('some.mp3',))
+        self.Cache.conn.close()
+
+    def in_thread(self, func):
+        import threading
+        result = []
+        thread = threading.Thread(target=lambda: result.append(func()))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def count_uncommitted(self):
+        return self.Cache.connections.reader().execute(
+            "SELECT count(*) FROM files WHERE filename = 'uncommitted'").fetchone()[0]
+
+    def test_database_uses_wal(self):
+        eq_('wal', self.Cache.conn.execute('PRAGMA journal_mode').fetchone()[0])
+
+    def test_threads_read_through_own_connections(self):
+        connections = self.Cache.connections
+        reader = connections.reader()
+        ok_(reader is connections.reader())
+        ok_(reader is not connections.writer)
+        ok_(self.in_thread(connections.reader) is not reader)
+        assert_raises(sqlite3.OperationalError, reader.execute, 'DELETE FROM files')
+
+    def test_readers_see_committed_state_while_writing(self):
+        with self.Cache.connections.writing() as conn:
+            conn.execute("INSERT INTO files (parent, filename, filetype, isdir, path)"
+                         " VALUES (-1, 'uncommitted', '', 0, 'uncommitted')")
+            eq_(1, self.count_uncommitted(), 'writer must see own changes')
+            eq_(0, self.in_thread(self.count_uncommitted))
+            eq_(1, len(self.in_thread(lambda: self.Cache.searchfor('some'))),
+                'searching must not wait for the writer')
+            conn.rollback()
+
+
+class MemoryDBTest(unittest.TestCase):
+
+    testdirname = 'memorydb'
+    testfiles = ('a/', 'a/one.mp3', 'a/two.mp3')
+
+    def setUp(self):
+        self.testdir = getAbsPath(self.testdirname)
+        setupTestfiles(self.testdir, self.testfiles)
+        cherry.config = configuration.from_defaults()
+        cherry.config = cherry.config.replace({
+            'media.basedir': self.testdir,
+            'search.load_file_db_into_memory': True,
+        })
+        service.provide('dbconnector', TmpConnector)
+        database.ensure_current_version(sqlitecache.DBNAME, autoconsent=True)
+        self.Cache = sqlitecache.SQLiteCache()
+        self.Cache.full_update()
+
+    def tearDown(self):
+        removeTestfiles(self.testdir, self.testfiles)
+        self.Cache.conn.close()
+
+    def memory_paths(self):
+        return sorted(path for (path,) in self.Cache.file_db_mem.execute('SELECT path FROM files'))
+
+    def disk_paths(self):
+        return sorted(path for (path,) in self.Cache.conn.execute('SELECT path FROM files'))
+
+    def test_bulk_build_is_loaded(self):
+        eq_(['a', 'a/one.mp3', 'a/two.mp3'], self.memory_paths())
+
+    def test_updates_are_synced_incrementally(self):
+        memdb = self.Cache.file_db_mem
+        setupTestfile(TestFile(os.path.join(self.testdir, 'a', 'three.mp3')))
+        os.remove(os.path.join(self.testdir, 'a', 'one.mp3'))
+
+        self.Cache.partial_update('a')
+
+        ok_(memdb is self.Cache.file_db_mem, 'must not reload the whole table')
+        eq_(self.disk_paths(), self.memory_paths())
+        eq_(['a', 'a/three.mp3', 'a/two.mp3'], self.memory_paths())
+
+    def test_large_changes_load_new_copy(self):
+        memdb = self.Cache.file_db_mem
+        setupTestfile(TestFile(os.path.join(self.testdir, 'a', 'three.mp3')))
+        maxrows, sqlitecache.MEMORYSYNCMAXROWS = sqlitecache.MEMORYSYNCMAXROWS, 0
+        try:
+            self.Cache.partial_update('a')
+        finally:
+            sqlitecache.MEMORYSYNCMAXROWS = maxrows
+        ok_(memdb is not self.Cache.file_db_mem)
+        eq_(self.disk_paths(), self.memory_paths())
+
+
 class RandomEntriesTest(unittest.TestCase):
 
     testdirname = 'randomFileEntries'
@@ -567,7 +954,7 @@ class RandomEntriesTest(unittest.TestCase):
 
     def test_should_not_return_deleted_entries(self):
         files = self.register_files('a', 'b', 'c')
-        self.Cache.remove_file(files['b'])
+        self.Cache.remove_recursive(files['b'])
 
         entries = self.Cache.randomFileEntries(10)
 
@@ -595,6 +982,60 @@ class RandomEntriesTest(unittest.TestCase):
         eq_(1, len(entries), entries)
         eq_('dir/subdir/file', entries[0].path, entries[0])
 
+    def register_tracks(self, dirname, *filenames):
+        parent = TestFile(dirname + '/', isdir=True)
+        self.Cache.register_file_with_db(parent)
+        tracks = [TestFile(name, parent=parent, isdir=False) for name in filenames]
+        for track in tracks:
+            self.Cache.register_file_with_db(track)
+        return tracks
+
+    def test_should_return_exact_count(self):
+        self.register_tracks('dir', *('%d.mp3' % i for i in range(50)))
+
+        entries = self.Cache.randomFileEntries(20)
+
+        eq_(20, len(entries))
+        eq_(20, len(set(e.path for e in entries)), 'no duplicates')
+
+    def test_should_only_return_given_formats(self):
+        self.register_tracks('dir', 'a.mp3', 'b.MP3', 'c.ogg', 'd.txt')
+
+        entries = self.Cache.randomFileEntries(10, formats=['mp3', 'ogg'])
+
+        eq_(['dir/a.mp3', 'dir/b.MP3', 'dir/c.ogg'], sorted(e.path for e in entries))
+
+    def test_should_only_return_files_below_subtree(self):
+        self.register_tracks('dir', 'a.mp3')
+        self.register_tracks('dir2', 'b.mp3', 'c.txt')
+
+        entries = self.Cache.randomFileEntries(10, formats=['mp3'], subtree='dir2')
+
+        eq_(['dir2/b.mp3'], [e.path for e in entries])
+
+    def test_subtree_is_found_with_path_index(self):
+        plan = self.Cache.conn.execute(
+            '''EXPLAIN QUERY PLAN SELECT path FROM files
+               WHERE isdir = 0 AND path > ? AND path < ?''', ('dir/', 'dir0')).fetchall()
+        ok_(any('idx_files_path_isdir_filetype' in row[-1] for row in plan), plan)
+
+    def test_track_positions_stay_dense_after_removal(self):
+        tracks = self.register_tracks('dir', 'a.mp3', 'b.mp3', 'c.mp3', 'd.ogg')
+
+        self.Cache.remove_recursive(tracks[0])
+
+        eq_([('.mp3', 1), ('.mp3', 2), ('.ogg', 1)], self.Cache.conn.execute(
+            'SELECT filetype, pos FROM tracks ORDER BY filetype, pos').fetchall())
+        eq_(['dir/b.mp3', 'dir/c.mp3'],
+            sorted(e.path for e in self.Cache.randomFileEntries(10, formats=['mp3'])))
+
+    def test_should_choose_uniformly(self):
+        self.register_tracks('dir', 'a.mp3', 'b.ogg', 'c.ogg', 'd.ogg')
+        import random
+        random.seed(42)
+        picked = [self.Cache.randomFileEntries(1)[0].path for i in range(400)]
+        ok_(70 < picked.count('dir/a.mp3') < 130, picked.count('dir/a.mp3'))
+
 
 class SymlinkTest(unittest.TestCase):
 
@@ -737,6 +1178,90 @@ class UpdateTest(unittest.TestCase):
             expected_files.remove(item.indb.relpath)
         self.assertEqual(0, len(expected_files))
 
+    def test_fill_in_missing_paths(self):
+        self.Cache.conn.execute('UPDATE files SET path = NULL')
+
+        self.Cache.fill_in_missing_paths()
+
+        paths = [row[0] for row in self.Cache.conn.execute('SELECT path FROM files')]
+        expected = [f.rstrip(os.path.sep) for f in self.testfiles]
+        self.assertEqual(sorted(expected), sorted(paths))
+
+    def test_fill_in_missing_tracks(self):
+        numbered = 'SELECT file, filetype, pos FROM tracks ORDER BY file'
+        expected = self.Cache.conn.execute(numbered).fetchall()
+        self.Cache.conn.execute('DELETE FROM tracks')
+        self.Cache.conn.execute('DELETE FROM trackcounts')
+
+        self.Cache.fill_in_missing_tracks()
+
+        self.assertTrue(expected)
+        self.assertEqual(expected, self.Cache.conn.execute(numbered).fetchall())
+
+    def test_bulk_build_matches_regular_update(self):
+        def dbcontent():
+            files = self.Cache.conn.execute(
+                'SELECT parent > -1, filename, filetype, isdir, path FROM files').fetchall()
+            words = self.Cache.conn.execute(
+                '''SELECT word, occurrences, path FROM search
+                   JOIN dictionary ON dictionary._id = search.drowid
+                   JOIN files ON files._id = search.frowid''').fetchall()
+            tracks = self.Cache.conn.execute(
+                '''SELECT tracks.filetype, trackcounts.tracks, path FROM tracks
+                   JOIN trackcounts ON trackcounts.filetype = tracks.filetype
+                   JOIN files ON files._id = tracks.file''').fetchall()
+            return sorted(files), sorted(words), sorted(tracks)
+        bulk = dbcontent()  # empty database was bulk-built by setUp
+
+        self.clearCache()
+        self.Cache.update_db_recursive(self.testdir, skipfirst=True)
+
+        self.assertEqual(dbcontent(), bulk)
+        indexes = [row[0] for row in self.Cache.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertTrue('idx_files_parent_filename_filetype' in indexes,
+                        'indexes must be recreated after bulk build')
+
+    def test_word_occurrences_are_counted_incrementally(self):
+        def miscounted():
+            return self.Cache.conn.execute(
+                '''SELECT word, occurrences FROM dictionary WHERE occurrences != (
+                       SELECT count(*) FROM search WHERE drowid = dictionary._id)''').fetchall()
+        setupTestfiles(self.testdir, (os.path.join('root_dir', 'second_file'),))
+        self.Cache.full_update(deep=True)
+        self.assertEqual([], miscounted())
+
+        shutil.rmtree(os.path.join(self.testdir, 'root_dir'))
+        self.Cache.full_update(deep=True)
+        self.assertEqual([], miscounted())
+        self.assertEqual([('file', 1)], self.Cache.conn.execute(
+            "SELECT word, occurrences FROM dictionary WHERE word = 'file'").fetchall())
+
+    def test_updates_bump_generation(self):
+        generation = self.Cache.generation
+        self.Cache.full_update()
+        self.assertTrue(self.Cache.generation > generation)
+
+        generation = self.Cache.generation
+        self.Cache.remove_recursive(self.Cache.db_find_file_by_path(
+            getAbsPath(self.testdir, 'root_dir')))
+        self.assertTrue(self.Cache.generation > generation)
+
+    def test_generation_is_shared_through_the_database(self):
+        service.provide('dbconnector', TmpConnector)
+        database.ensure_current_version(sqlitecache.DBNAME, autoconsent=True)
+        cherry.config = cherry.config.replace({'browser.pure_database_lookup': True})
+        self.Cache = sqlitecache.SQLiteCache()
+        other = sqlitecache.SQLiteCache()     # like a separate update process
+        model = CherryModel()
+        with patch('cherrymusicserver.cherrymodel.CherryModel.cache', self.Cache):
+            stamp = model.listdirStamp('root_dir')
+            setupTestfiles(self.testdir, (os.path.join('root_dir', 'second_file'),))
+            other.full_update()
+            self.assertNotEqual(stamp, model.listdirStamp('root_dir'),
+                                'updates by other caches must change the listing ETag')
+        other.conn.close()
+
     def test_new_file_in_known_dir(self):
         newfile = os.path.join('root_dir', 'second_file')
         setupTestfiles(self.testdir, (newfile,))
@@ -746,6 +1271,77 @@ class UpdateTest(unittest.TestCase):
         self.assertNotEqual(None, self.Cache.db_find_file_by_path(getAbsPath(self.testdir, newfile)),
                             'file must have been added correctly to the database')
 
+    def test_full_update_skips_unchanged_dirs(self):
+        dirpath = os.path.join(self.testdir, 'root_dir')
+        os.utime(dirpath, (0, 0))
+        self.Cache.full_update()
+        stat = os.stat(dirpath)
+        newfile = os.path.join('root_dir', 'sneaky_file')
+        setupTestfiles(self.testdir, (newfile,))
+        os.utime(dirpath, (stat.st_atime, stat.st_mtime))
+
+        self.Cache.full_update()
+        self.assertEqual(None, self.Cache.db_find_file_by_path(getAbsPath(self.testdir, newfile)),
+                         'unchanged directory must not have been listed')
+
+        self.Cache.full_update(deep=True)
+        self.assertNotEqual(None, self.Cache.db_find_file_by_path(getAbsPath(self.testdir, newfile)),
+                            'deep update must list all directories')
+
+    def test_full_update_does_not_trust_recently_modified_dirs(self):
+        dirpath = os.path.join(self.testdir, 'root_dir')
+        newfile = os.path.join('root_dir', 'sneaky_file')
+        self.Cache.full_update()
+        setupTestfiles(self.testdir, (newfile,))
+        now = time.time()
+        os.utime(dirpath, (now, now))
+
+        self.Cache.full_update()
+        self.assertEqual((None, None), self.Cache.conn.execute(
+            'SELECT mtime, inode FROM files WHERE path = ?', ('root_dir',)).fetchone(),
+            'stamps within the timestamp granularity must not be recorded')
+
+        setupTestfiles(self.testdir, (newfile + '2',))
+        os.utime(dirpath, (now, now))
+        self.Cache.full_update()
+        self.assertNotEqual(None, self.Cache.db_find_file_by_path(getAbsPath(self.testdir, newfile + '2')),
+                            'directory with a racy stamp must be listed again')
+
+    def test_full_update_descends_into_unchanged_dirs(self):
+        rootstat = os.stat(self.testdir)
+        newfile = os.path.join('root_dir', 'new_file')
+        setupTestfiles(self.testdir, (newfile,))
+        os.utime(self.testdir, (rootstat.st_atime, rootstat.st_mtime))
+
+        self.Cache.full_update()
+        self.assertNotEqual(None, self.Cache.db_find_file_by_path(getAbsPath(self.testdir, newfile)),
+                            'changes below an unchanged directory must be found')
+
+    def test_partial_update_lists_given_dirs_even_if_unchanged(self):
+        dirpath = os.path.join(self.testdir, 'root_dir')
+        stat = os.stat(dirpath)
+        newfile = os.path.join('root_dir', 'sneaky_file')
+        setupTestfiles(self.testdir, (newfile,))
+        os.utime(dirpath, (stat.st_atime, stat.st_mtime))
+
+        self.Cache.partial_update(dirpath, deep=False)
+        self.assertNotEqual(None, self.Cache.db_find_file_by_path(getAbsPath(self.testdir, newfile)),
+                            'given directories must always be listed')
+
+    def test_update_merges_changes_into_searchindex(self):
+        cherry.config = cherry.config.replace({'search.engine': 'memory'})
+        self.Cache = sqlitecache.SQLiteCache()
+        newfile = os.path.join('root_dir', 'unheard_of')
+        setupTestfiles(self.testdir, (newfile,))
+        os.remove(getAbsPath(self.testdir, 'root_dir', 'first_file'))
+
+        self.Cache.full_update()
+
+        self.assertEqual(None, self.Cache.searchchanges)
+        self.assertEqual([newfile],
+                         [e.path for e in self.Cache.searchfor('unheard', 100)])
+        self.assertEqual([], self.Cache.searchfor('first', 100))
+
     def test_partial_update(self):
 
         newfiles = (
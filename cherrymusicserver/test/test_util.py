@@ -61,6 +61,65 @@ def test_moving_average():
     assert mov.min == 0
     assert mov.max == 2
 
+def test_lru_cache():
+    cache = util.LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache, 'least recently used item must be dropped'
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.pop('a') == 1
+    assert cache.get('a') is None
+    assert len(cache) == 1
+
+def test_lru_cache_weight():
+    cache = util.LRUCache(10, maxweight=5, weigh=len)
+    cache.put('a', 'xx')
+    cache.put('b', 'xx')
+    cache.put('c', 'xx')
+    assert 'a' not in cache, 'oldest item must be dropped when too heavy'
+    assert cache.weight == 4
+    cache.put('d', 'xxxxxx')
+    assert 'd' not in cache, 'items heavier than maxweight must not be stored'
+    cache.get('b')
+    cache.get('d')
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+
+def test_tweak_loader():
+    import os
+    import tempfile
+    import types
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'sometweaks.py')
+    try:
+        with open(path, 'w') as f:
+            f.write('class Tweaks:\n    value = 1\n')
+        module = types.ModuleType(str('sometweaks'))
+        module.__file__ = path
+        exec(compile(open(path).read(), path, 'exec'), vars(module))
+        loader = util.TweakLoader(module, interval=0)
+        eq_(1, loader.get().Tweaks.value)
+        assert_raises(AttributeError, setattr, loader.get().Tweaks, 'value', 2)
+
+        with open(path, 'w') as f:
+            f.write('class Tweaks:\n    value = 2\n')
+        os.utime(path, (0, 0))
+        eq_(2, loader.get().Tweaks.value)
+
+        with open(path, 'w') as f:
+            f.write('this is not python')
+        os.utime(path, (1, 1))
+        eq_(2, loader.get().Tweaks.value, 'broken file must keep old values')
+
+        loader.interval = 3600
+        os.utime(path, (2, 2))
+        ok_(loader.get() is loader.get(), 'must not check again before interval')
+    finally:
+        os.remove(path)
+        os.rmdir(tmpdir)
+
 def test_time2text():
     assert util.time2text(0) == 'just now'
     for mult in [60, 60*60, 60*60*24, 60*60*24*31, 60*60*24*365]:
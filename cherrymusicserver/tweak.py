@@ -31,18 +31,13 @@
 
 """This file contains all static values that can be used to tweak the
 program execution. All classes are static and only contain simple values.
-To use this class, please import it using the fully classified module name, e.g
+To use them, get the current values from the util module:
 
-    import cherrymusicserver.tweak
+    from cherrymusicserver import util
+    util.tweaks().ResultOrderTweaks.perfect_match_bonus
 
-To account for changes while the server is running, reload the module
-before using it:
-
-    reload(cherrymusicserver.tweak)
-
-make sure to have reload imported as well:
-
-    from imp import reload
+Changes to this file are picked up within a few seconds while the server
+is running.
 """
 
 class ResultOrderTweaks:
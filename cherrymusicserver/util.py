@@ -173,6 +173,163 @@ class MovingAverage(object):
         return self._avg
 
 
+from backport.collections import OrderedDict
+
+
+class LRUCache(object):
+    """A mapping of limited size that forgets its least recently used
+    items first. Not threadsafe.
+
+    Optionally, the total ``weight`` of all values can be limited as well,
+    where weight is whatever the ``weigh(value)`` function returns, e.g. an
+    estimate of its memory footprint. Lookups with :meth:`get` are counted
+    as ``hits`` and ``misses``."""
+
+    def __init__(self, maxsize, maxweight=None, weigh=None):
+        assert maxsize > 0
+        assert maxweight is None or weigh is not None
+        self._items = OrderedDict()
+        self._weights = {}
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._items[key] = value
+        return value
+
+    def put(self, key, value):
+        self.pop(key)
+        if self.maxweight is not None:
+            weight = self.weigh(value)
+            if weight > self.maxweight:
+                return
+            self._weights[key] = weight
+            self.weight += weight
+        self._items[key] = value
+        while len(self._items) > self.maxsize or (
+                self.maxweight is not None and self.weight > self.maxweight):
+            self.pop(next(iter(self._items)))
+
+    def pop(self, key, default=None):
+        self.weight -= self._weights.pop(key, 0)
+        return self._items.pop(key, default)
+
+    def clear(self):
+        self._items.clear()
+        self._weights.clear()
+        self.weight = 0
+
+    def stats(self):
+        """returns a dict of size, weight and hit statistics"""
+        return {
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+            'weight': self.weight,
+            'maxweight': self.maxweight,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+import inspect
+import threading
+from collections import namedtuple
+
+TWEAKCHECKINTERVAL = 2      # seconds between checks for a changed tweak file
+
+class TweakLoader(object):
+    """Keeps an immutable snapshot of the classes in a tweak module, like
+    :mod:`cherrymusicserver.tweak`. Every class becomes a namedtuple with
+    the same attributes.
+
+    The source file of the module is executed again when its modification
+    time has changed, which is checked at most every ``interval`` seconds.
+    If it can't be loaded, the last good snapshot is kept."""
+
+    def __init__(self, module, interval=TWEAKCHECKINTERVAL):
+        self.path = module.__file__
+        if self.path.endswith(('.pyc', '.pyo')):
+            self.path = self.path[:-1]
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._mtime = self._getmtime()
+        self._snapshot = self.freeze(vars(module))
+        self._checked = time()
+
+    @staticmethod
+    def freeze(namespace):
+        """returns the classes in namespace as nested namedtuples"""
+        groups = OrderedDict()
+        for name, value in sorted(namespace.items()):
+            if inspect.isclass(value) and not name.startswith('_'):
+                fields = sorted(k for k in vars(value) if not k.startswith('_'))
+                group = namedtuple(name, fields)
+                groups[name] = group(*(getattr(value, k) for k in fields))
+        return namedtuple('Tweaks', list(groups))(**groups)
+
+    def get(self):
+        """returns the current snapshot"""
+        now = time()
+        if now - self._checked < self.interval:
+            return self._snapshot
+        if self._lock.acquire(False):   # somebody else is checking already
+            try:
+                self._checked = now
+                mtime = self._getmtime()
+                if mtime != self._mtime:
+                    self._mtime = mtime
+                    self._snapshot = self._load()
+            finally:
+                self._lock.release()
+        return self._snapshot
+
+    def _getmtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def _load(self):
+        namespace = {'__name__': '__tweak__', '__file__': self.path}
+        try:
+            with open(self.path, 'rb') as sourcefile:
+                code = compile(sourcefile.read(), self.path, 'exec', 0, True)
+            exec(code, namespace)
+            snapshot = self.freeze(namespace)
+        except Exception as error:
+            log.e(_('cannot load tweaks from %r: %r'), self.path, error)
+            return self._snapshot
+        log.i(_('reloaded tweaks from %r'), self.path)
+        return snapshot
+
+
+_tweakloader = None
+
+def tweaks():
+    """returns the current values from :mod:`cherrymusicserver.tweak`"""
+    global _tweakloader
+    if _tweakloader is None:
+        import cherrymusicserver.tweak
+        _tweakloader = TweakLoader(cherrymusicserver.tweak)
+    return _tweakloader.get()
+
+
 class Performance:
     indentation = 0
 
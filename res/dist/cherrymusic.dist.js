@@ -1008,7 +1008,7 @@ return track;},addSong:function(path,title,plid){"use strict";var self=this;var
 var playlist;if(plid){playlist=this.getPlaylistById(plid);}
 if(typeof playlist=='undefined'){playlist=this.getEditingPlaylist();}
 playlist.addTrack(track);if(!jPlayerIsPlaying()&&playlist.jplayerplaylist.playlist.length==1){if(userOptions.misc.autoplay_on_add){playlist.makeThisPlayingPlaylist();playlist.jplayerplaylist.play(0);}else{playlist.jplayerplaylist.select(0);}}
-var success=function(data){var metainfo=$.parseJSON(data)
+var success=function(data){var metainfo=typeof data==='string'?$.parseJSON(data):data;
 if(metainfo.length){track.duration=metainfo.length;}
 self.getEditingPlaylist().jplayerplaylist._refresh(true);}
 api('getsonginfo',{'path':decodeURIComponent(path)},success,errorFunc('error getting song metainfo'),true);},clearPlaylist:function(){"use strict";this.getEditingPlaylist().remove();if(this.getEditingPlaylist()==this.getPlayingPlaylist()){$(this.cssSelectorjPlayer).jPlayer("clearMedia");}
@@ -1050,14 +1050,14 @@ MediaBrowser.static._addAllToPlaylist($(this),pl.id);if(isplaylist){pl.setSaved(
 $(this).blur();return false;});}
 MediaBrowser.static={_renderList:function(l,listview){"use strict";var self=this;var html="";$.each(l,function(i,e){switch(e.type){case'dir':html+=MediaBrowser.static._renderDirectory(e,listview);break;case'file':html+=MediaBrowser.static._renderFile(e);break;case'compact':html+=MediaBrowser.static._renderCompactDirectory(e);break;case'playlist':html+=MediaBrowser.static._renderPlaylist(e);break;default:window.console.log('cannot render unknown type '+e.type);}});return html;},_renderMessage:function(msg){var template=templateLoader.cached('mediabrowser-message');return Mustache.render(template,{message:msg});},_renderFile:function(json){var template=templateLoader.cached('mediabrowser-file');var template_data={fileurl:json.urlpath,fullpath:json.path,label:json.label,};return Mustache.render(template,template_data);},_renderDirectory:function(json,listview){var template=templateLoader.cached('mediabrowser-directory');var template_data={isrootdir:json.path&&!json.path.indexOf('/')>0,dirpath:json.path,label:json.label,listview:listview,maychangecoverart:!!isAdmin,coverarturl:encodeURIComponent(JSON.stringify({'directory':json.path})),directoryname:encodeURIComponent(json.path),};return Mustache.render(template,template_data);},_renderPlaylist:function(e){var template=templateLoader.cached('mediabrowser-playlist');var template_data={playlistid:e['plid'],isowner:e.owner,candelete:e.owner||isAdmin,playlistlabel:e['title'],username:e['username'],age:time2text(e['age']),username_color:userNameToColor(e.username),publicchecked:e['public']?'checked="checked"':'',publiclabelclass:e['public']?'label-success':'label-default',};return Mustache.render(template,template_data);},_renderCompactDirectory:function(json){var template=templateLoader.cached('mediabrowser-compact');var template_data={filepath:json.urlpath,filter:json.label,filterUPPER:json.label.toUpperCase(),};return Mustache.render(template,template_data);},addThisTrackToPlaylist:function(){"use strict"
 playlistManager.addSong($(this).attr("path"),$(this).attr("title"));$(this).blur();return false;},_addAllToPlaylist:function($source,plid){"use strict";$source.find('li .musicfile').each(function(){playlistManager.addSong($(this).attr("path"),$(this).attr("title"),plid);});},albumArtLoader:function(cssSelector){"use strict";var winheight=$(window).height();var scrolled_down=$(cssSelector).scrollTop();var preload_threshold=100;$(cssSelector).find('.list-dir-albumart.unloaded').each(function(idx){var img_pos=$(this).position().top;var above_screen=img_pos<scrolled_down-preload_threshold;var below_screen=img_pos>winheight+scrolled_down+preload_threshold;if(!above_screen&&!below_screen){$(this).find('img').attr('src','api/fetchalbumart/?data='+$(this).attr('search-data'));$(this).removeClass('unloaded');}});}};var browser=detectBrowser();if(['msie','safari'].indexOf(browser)!=-1){var encoderPreferenceOrder=['mp3','ogg'];}else{var encoderPreferenceOrder=['ogg','mp3'];}
-var SERVER_CONFIG={};var availableEncoders=undefined;var availablejPlayerFormats=['mp3','ogg'];var availableDecoders=undefined;var transcodingEnabled=undefined;var userOptions=undefined;var isAdmin=undefined;var loggedInUserName=undefined;var REMEMBER_PLAYLIST_INTERVAL=3000;var CHECK_MUSIC_PLAYING_INTERVAL=2000;var HEARTBEAT_INTERVAL_MS=30*1000;var playlistSelector='.jp-playlist';var executeAfterConfigLoaded=[]
+var SERVER_CONFIG={};var availableEncoders=undefined;var availablejPlayerFormats=['mp3','ogg'];var availableDecoders=undefined;var transcodingEnabled=undefined;var userOptions=undefined;var isAdmin=undefined;var loggedInUserName=undefined;var REMEMBER_PLAYLIST_INTERVAL=3000;var CACHEABLE_API_ACTIONS=['listdir','compactlistdir','getsonginfo'];var CHECK_MUSIC_PLAYING_INTERVAL=2000;var HEARTBEAT_INTERVAL_MS=30*1000;var playlistSelector='.jp-playlist';var executeAfterConfigLoaded=[]
 function api(){"use strict";var action=arguments[0];var has_data=!(typeof arguments[1]==='function');var data={};if(has_data){data=arguments[1];}
 var successfunc=arguments[has_data?2:1];var errorfunc=arguments[has_data?3:2];var completefunc=arguments[has_data?4:3];if(!successfunc)successfunc=function(){};if(!completefunc)completefunc=function(){};var successFuncWrapper=function(successFunc){return function handler(json){var result=$.parseJSON(json);if(result.flash){successNotify(result.flash);}
 successFunc(result.data);}}
 var errorFuncWrapper=function(errorFunc){return function(httpstatus){if(httpstatus.status==401){reloadPage();}
 errorFunc();}}
 if(!errorfunc){errorfunc=function(){errorFunc('Error calling API function "'+action+'"')();};}
-$.ajax({url:'api/'+action,context:$(this),type:'POST',data:{'data':JSON.stringify(data)},success:successFuncWrapper(successfunc),error:errorFuncWrapper(errorfunc),complete:completefunc,});}
+$.ajax({url:'api/'+action,context:$(this),type:CACHEABLE_API_ACTIONS.indexOf(action)===-1?'POST':'GET',data:{'data':JSON.stringify(data)},success:successFuncWrapper(successfunc),error:errorFuncWrapper(errorfunc),complete:completefunc,});}
 htmlencode=function(val){return $('<div />').text(val?val:'').html();}
 htmldecode=function(val){return $('<div />').html(val?val:'').text();}
 function errorFunc(msg){"use strict";return function(){window.console.error('CMError: '+msg);displayNotification(msg,'error');};}
@@ -1108,7 +1108,7 @@ function logout(){"use strict";api('logout',reloadPage);}
 function TemplateLoader(template_path){this.template_path=template_path;this.loaded_templates={};var self=this;this.get=function(template_name,callback){if(this.loaded_templates.hasOwnProperty(template_name)){callback(this.loaded_templates[template_name]);}else{$.get(this.template_path+'/'+template_name+'.html',function(data){self.loaded_templates[template_name]=data;if(typeof callback==='undefined'){window.console.log('preloaded template '+template_name);}else{callback(self.loaded_templates[template_name]);}});}}
 this.render=function(template_name,content,$jqobj){this.get(template_name,function(template){$jqobj.html(Mustache.render(template,content));});}
 this.render_append=function(template_name,content,$jqobj){this.get(template_name,function(template){$jqobj.append(Mustache.render(template,content));});};this.cached=function(template_name){if(this.loaded_templates.hasOwnProperty(template_name)){return this.loaded_templates[template_name];}else{window.console.error('Can not return unloaded template '+template_name+'!');return'';}}}
-var templateLoader=new TemplateLoader('res/templates');templateLoader.get('mediabrowser-directory');templateLoader.get('mediabrowser-file');templateLoader.get('mediabrowser-compact');templateLoader.get('mediabrowser-message');templateLoader.get('mediabrowser-playlist');templateLoader.get('flash-message');function updateUserList(){"use strict";var success=function(data){var htmllist="";var response=$.parseJSON(data);var time=response['time'];var template_user_data={'users':[]};$.each(response['userlist'],function(i,e){var reltime=time-e.last_time_online;template_user_data['users'].push({isadmin:e.admin,may_download:e.may_download,isnotadmin:!e.admin,isdeletable:e.deletable,userid:e.id,isonline:reltime<HEARTBEAT_INTERVAL_MS/500,username:e.username,username_color:userNameToColor(e.username),fuzzytime:time2text(reltime),});});templateLoader.get('user-list',function(template){$('#adminuserlist').html(Mustache.render(template,template_user_data));});};busy('#adminuserlist').hide().fadeIn('fast');api('getuserlist',success,errorFunc('cannot fetch user list'),function(){busy('#adminuserlist').fadeOut('fast')});}
+var templateLoader=new TemplateLoader('res/templates');templateLoader.get('mediabrowser-directory');templateLoader.get('mediabrowser-file');templateLoader.get('mediabrowser-compact');templateLoader.get('mediabrowser-message');templateLoader.get('mediabrowser-playlist');templateLoader.get('flash-message');function updateUserList(){"use strict";var success=function(data){var htmllist="";var response=typeof data==='string'?$.parseJSON(data):data;var time=response['time'];var template_user_data={'users':[]};$.each(response['userlist'],function(i,e){var reltime=time-e.last_time_online;template_user_data['users'].push({isadmin:e.admin,may_download:e.may_download,isnotadmin:!e.admin,isdeletable:e.deletable,userid:e.id,isonline:reltime<HEARTBEAT_INTERVAL_MS/500,username:e.username,username_color:userNameToColor(e.username),fuzzytime:time2text(reltime),});});templateLoader.get('user-list',function(template){$('#adminuserlist').html(Mustache.render(template,template_user_data));});};busy('#adminuserlist').hide().fadeIn('fast');api('getuserlist',success,errorFunc('cannot fetch user list'),function(){busy('#adminuserlist').fadeOut('fast')});}
 function addNewUser(){"use strict";var newusername=$('#newusername').val();var newpassword=$('#newpassword').val();var newisadmin=$('#newisadmin').attr('checked')?1:0;if(newusername.trim()===''||newpassword.trim()===''){return;}
 var success=function(data){$('#newusername').val('');$('#newpassword').val('');$('#newisadmin').prop('checked',false);updateUserList();};busy('#adminpanel').hide().fadeIn('fast');api('adduser',{'username':newusername,'password':newpassword,'isadmin':newisadmin},success,errorFunc('failed to add new user'),function(){busy('#adminpanel').fadeOut('fast')});}
 function userDelete(userid){var success=function(data){updateUserList();};busy('#adminuserlist').hide().fadeIn('fast');api('userdelete',{'userid':userid},success,errorFunc('failed to delete user'),function(){busy('#adminuserlist').fadeOut('fast')});}
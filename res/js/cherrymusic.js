@@ -46,6 +46,8 @@ var loggedInUserName = undefined;
 var REMEMBER_PLAYLIST_INTERVAL = 3000;
 var CHECK_MUSIC_PLAYING_INTERVAL = 2000;
 var HEARTBEAT_INTERVAL_MS = 30*1000;
+// answered with ETags, so the browser cache can revalidate them
+var CACHEABLE_API_ACTIONS = ['listdir', 'compactlistdir', 'getsonginfo'];
 
 var playlistSelector = '.jp-playlist';
 
@@ -105,7 +107,7 @@ function api(){
     $.ajax({
         url: 'api/'+action,
         context: $(this),
-        type: 'POST',
+        type: CACHEABLE_API_ACTIONS.indexOf(action) === -1 ? 'POST' : 'GET',
         data: {'data': JSON.stringify(data)},
         success: successFuncWrapper(successfunc),
         error: errorFuncWrapper(errorfunc),
@@ -649,7 +651,8 @@ function updateUserList(){
     "use strict";
     var success = function(data){
         var htmllist = "";
-        var response = $.parseJSON(data);
+        // still a JSON string if the server runs with legacy_json_api
+        var response = typeof data === 'string' ? $.parseJSON(data) : data;
         var time = response['time'];
         var template_user_data = {'users': []};
         $.each(response['userlist'],function(i,e){
@@ -685,7 +685,7 @@ PlaylistManager.prototype = {
             }
         }
         var success = function(data){
-            var metainfo = $.parseJSON(data)
+            var metainfo = typeof data === 'string' ? $.parseJSON(data) : data;
             if (metainfo.length) {
                 track.duration = metainfo.length;
             }